@@ -1,11 +1,13 @@
 # This code is licensed under the MIT License (see LICENSE file for details)
 
+import collections
 import threading
 import queue
 import ctypes
 
 import numpy
 from OpenGL import GL
+from OpenGL import extensions
 from PyQt5 import Qt
 
 from . import shared_resources
@@ -17,6 +19,28 @@ IMAGE_TYPE_TO_GL_TEXTURE_FORMATS = {
     'rgba': GL.GL_RGBA32F
 }
 
+# Internal formats that store 8- and 16-bit integer data as compactly as it is uploaded: normalized
+# to [0, 1] (or [-1, 1] for int16) on sampling, exactly as it would be in a 32-bit float texture, but
+# at a half or a quarter of the texture memory and upload bandwidth, and without conversion by the
+# driver. Data of other types uses IMAGE_TYPE_TO_GL_TEXTURE_FORMATS.
+NUMPY_DTYPE_TO_GL_TEXTURE_FORMATS = {
+    numpy.bool8: {'G': GL.GL_R8, 'Ga': GL.GL_RG8, 'rgb': GL.GL_RGB8, 'rgba': GL.GL_RGBA8},
+    numpy.uint8: {'G': GL.GL_R8, 'Ga': GL.GL_RG8, 'rgb': GL.GL_RGB8, 'rgba': GL.GL_RGBA8},
+    numpy.uint16: {'G': GL.GL_R16, 'Ga': GL.GL_RG16, 'rgb': GL.GL_RGB16, 'rgba': GL.GL_RGBA16},
+    numpy.int16: {'G': GL.GL_R16_SNORM, 'Ga': GL.GL_RG16_SNORM, 'rgb': GL.GL_RGB16_SNORM, 'rgba': GL.GL_RGBA16_SNORM}
+}
+
+# If True, float32 and float64 images are stored in half-precision float textures. This halves their
+# texture memory, but keeps only about three significant digits, and values beyond +/-65504 become +/-Inf.
+USE_HALF_FLOAT_TEXTURES = False
+
+IMAGE_TYPE_TO_HALF_FLOAT_TEXTURE_FORMATS = {
+    'G': GL.GL_R16F,
+    'Ga': GL.GL_RG16F,
+    'rgb': GL.GL_RGB16F,
+    'rgba': GL.GL_RGBA16F
+}
+
 IMAGE_TYPE_TO_SOURCE_FORMATS = {
     'G': GL.GL_RED,
     'Ga': GL.GL_RG,
@@ -28,60 +52,393 @@ NUMPY_DTYPE_TO_GL_PIXEL_TYPE = {
     numpy.bool8: GL.GL_UNSIGNED_BYTE,
     numpy.uint8: GL.GL_UNSIGNED_BYTE,
     numpy.uint16: GL.GL_UNSIGNED_SHORT,
-    numpy.float32: GL.GL_FLOAT
+    numpy.int16: GL.GL_SHORT,
+    numpy.uint32: GL.GL_UNSIGNED_INT,
+    numpy.int32: GL.GL_INT,
+    numpy.float32: GL.GL_FLOAT,
+    # there is no double-precision pixel transfer type: float64 data is converted to float32 for upload
+    numpy.float64: GL.GL_FLOAT
 }
 
 USE_BG_UPLOAD_THREAD = True # debug flag for testing with flaky drivers
 
+# If True and the GL implementation supports persistently-mapped buffers (GL 4.4 or ARB_buffer_storage),
+# image data is copied into a ring of PBO_RING_SIZE pixel buffer objects per texture, from which the
+# texture is updated asynchronously. Instead of waiting for the transfer with glFinish, the upload thread
+# inserts a fence that bind() waits for. Otherwise, textures are updated directly from client memory.
+USE_PBO_UPLOADS = True
+PBO_RING_SIZE = 3
+
+# Images larger than this in either dimension are split into tiles, each held in its own texture. If None,
+# GL_MAX_TEXTURE_SIZE is used. Smaller tiles make partial updates cheaper, as only the tiles that a changed
+# region intersects are uploaded (and have their mipmaps regenerated), at the cost of more draw passes.
+TILE_SIZE = None
+
+# Tile size of textures filled by upload_visible(), which holds only the tiles in view. This does not depend
+# on the GL implementation, so that the tiles in view can be found before anything is uploaded.
+SPARSE_TILE_SIZE = 1024
+
+_max_texture_size = None
+def _tile_size():
+    # requires a current context
+    global _max_texture_size
+    if TILE_SIZE is not None:
+        return TILE_SIZE
+    if _max_texture_size is None:
+        _max_texture_size = int(GL.glGetIntegerv(GL.GL_MAX_TEXTURE_SIZE))
+    return _max_texture_size
+
+_pbo_support = None
+def _supports_pbo_uploads():
+    # requires a current context; assumes that all of our (shared) contexts have the same capabilities
+    global _pbo_support
+    if _pbo_support is None:
+        _pbo_support = extensions.hasGLExtension('GL_ARB_buffer_storage') and extensions.hasGLExtension('GL_ARB_sync')
+    return _pbo_support
+
+# bytes per texel of each internal format
+_GL_TEXTURE_FORMAT_BYTES = {
+    format: len(image_type) * component_bytes
+    for formats, component_bytes in (
+        (NUMPY_DTYPE_TO_GL_TEXTURE_FORMATS[numpy.uint8], 1),
+        (NUMPY_DTYPE_TO_GL_TEXTURE_FORMATS[numpy.uint16], 2),
+        (NUMPY_DTYPE_TO_GL_TEXTURE_FORMATS[numpy.int16], 2),
+        (IMAGE_TYPE_TO_HALF_FLOAT_TEXTURE_FORMATS, 2),
+        (IMAGE_TYPE_TO_GL_TEXTURE_FORMATS, 4))
+    for image_type, format in formats.items()
+}
+
+class TexturePool:
+    """Textures that are no longer needed, kept for reuse by a later upload of the same internal format
+    and size instead of being deleted, so that flipping between images of different sizes or types does
+    not allocate a new texture each time.
+
+    At most budget bytes of (estimated) texture memory, including mipmaps, are kept: beyond that, the least
+    recently released textures are deleted. Textures are released from the GUI thread and acquired from
+    the upload thread; both require a current GL context (of the shared group)."""
+    def __init__(self, budget=256*2**20):
+        self.budget = budget
+        self.size = 0
+        # texture: (format, width, height), nbytes, in order of release
+        self._textures = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._textures)
+
+    @staticmethod
+    def texture_bytes(format, width, height):
+        # a full mipmap chain adds a third
+        return _GL_TEXTURE_FORMAT_BYTES[format] * width * height * 4 // 3
+
+    def acquire(self, format, width, height):
+        """Remove and return the most recently released texture of the given format and size,
+        or None if there is none."""
+        key = format, width, height
+        with self._lock:
+            for texture, (texture_key, nbytes) in reversed(self._textures.items()):
+                if texture_key == key:
+                    del self._textures[texture]
+                    self.size -= nbytes
+                    return texture
+
+    def release(self, texture, format, width, height):
+        """Add a texture to the pool, deleting older ones as necessary to keep within the budget."""
+        nbytes = self.texture_bytes(format, width, height)
+        with self._lock:
+            self._textures[texture] = (format, width, height), nbytes
+            self.size += nbytes
+            to_delete = []
+            while self.size > self.budget:
+                old_texture, (old_key, old_nbytes) = self._textures.popitem(last=False)
+                self.size -= old_nbytes
+                to_delete.append(old_texture)
+        if to_delete:
+            GL.glDeleteTextures(to_delete)
+
+    def clear(self):
+        """Delete all the pooled textures."""
+        with self._lock:
+            textures = list(self._textures)
+            self._textures.clear()
+            self.size = 0
+        if textures:
+            GL.glDeleteTextures(textures)
+
+texture_pool = TexturePool()
+
+def texture_format(image):
+    """Return the GL internal format of the texture for an Image."""
+    dtype = image.data.dtype.type
+    if dtype in NUMPY_DTYPE_TO_GL_TEXTURE_FORMATS:
+        return NUMPY_DTYPE_TO_GL_TEXTURE_FORMATS[dtype][image.type]
+    elif USE_HALF_FLOAT_TEXTURES and dtype in (numpy.float32, numpy.float64):
+        return IMAGE_TYPE_TO_HALF_FLOAT_TEXTURE_FORMATS[image.type]
+    else:
+        return IMAGE_TYPE_TO_GL_TEXTURE_FORMATS[image.type]
+
+class _Tile:
+    # a texture holding the [x, x+w) x [y, y+h) region of an AsyncTexture (in the texture's axes), allocated
+    # on its first upload if .wanted
+    def __init__(self, x, y, w, h, wanted=True):
+        self.x, self.y, self.w, self.h = x, y, w, h
+        self.wanted = wanted
+        self.texture = None
+        # (serial, generation) of the Image last uploaded to the tile by upload_visible()
+        self.source = None
+        self.mipmaps_dirty = False
+        self.min_filter = None
+
 class AsyncTexture:
+    """Texture holding an Image's data, uploaded in the layout in which it is stored: the texture's
+    rows are the rows of memory, so if y varies fastest in the Image (image.memory_order == 'C'), the
+    texture is transposed, .shape is (height, width), and .transposed is True. Texture coordinates must
+    then be swapped (tex_coord.yx) when sampling.
+
+    Images larger than the tile size (TILE_SIZE, or by default GL_MAX_TEXTURE_SIZE) are split into a grid
+    of .tiles, each a separate texture, and only the tiles that a changed region intersects are updated.
+    A tile is bound with bind(tex_unit, tile=index), and sampled at the texture coordinates transformed
+    by tile_transform(index). For images that fit in one texture, there is a single tile, index 0.
+
+    Alternately, upload_visible() uploads only the tiles of an image in view, releasing the others,
+    so that the memory and upload time used by a very large image depend on the size of the view,
+    rather than of the image. Only those tiles may then be bound.
+
+    Mipmaps are needed only where the texture is drawn smaller than 1:1, so uploads merely mark them
+    out of date, and they are regenerated by bind() when it is asked for them. Otherwise, the texture
+    is bound with a non-mipmapped minification filter."""
     def __init__(self):
         self.ready = threading.Event()
         self.status = 'waiting'
-        self.texture = None
+        self.tiles = []
         self.format = None
         self.shape = None
+        self.transposed = False
+        # pixel x and y edges of the tile grid
+        self._tile_edges = None
+        # fence after the most recent upload, which bind() waits for
+        self._fence = None
+        # PBO ring: lists of buffer ids, their mapped addresses, and fences after the uploads that read them
+        self._pbos = []
+        self._pbo_pointers = []
+        self._pbo_fences = []
+        self._pbo_size = 0
+        self._pbo_index = 0
 
     def upload(self, image, upload_region=None):
-        new_format = IMAGE_TYPE_TO_GL_TEXTURE_FORMATS[image.type]
-        new_shape = image.data.shape[:2]
+        data, source_format, source_type = self._prepare(image)
+        if upload_region is not None and self.transposed:
+            x, y, w, h = upload_region
+            upload_region = y, x, h, w
+        if not self.tiles and upload_region is not None:
+            raise ValueError('The first time the texture is uploaded, the full region must be used.')
+        self._start_upload(data, source_format, source_type, upload_region)
+
+    def upload_visible(self, image, visible_rect=None, tile_size=SPARSE_TILE_SIZE):
+        """Upload those tiles of image that intersect visible_rect, given as (left, top, right, bottom)
+        fractions of the image's width and height (or all of them, if visible_rect is None), and release
+        the others to the texture pool. Tiles that already hold the current contents of image (as given by
+        its .serial and .generation) are not uploaded again. Requires a current GL context."""
+        if self.status == 'uploading':
+            # the tiles may be changed only once the upload thread is done with them
+            self.ready.wait()
+        data, source_format, source_type = self._prepare(image)
+        if not self.tiles:
+            self._layout_tiles(tile_size, wanted=False)
+        visible = set(self.tiles_in(visible_rect))
+        source = image.serial, image.generation
+        stale = []
+        for index, tile in enumerate(self.tiles):
+            tile.wanted = index in visible
+            if tile.wanted:
+                if tile.source != source:
+                    stale.append(tile)
+                    tile.source = source
+            elif tile.texture is not None:
+                texture_pool.release(tile.texture, self.format, tile.w, tile.h)
+                tile.texture = tile.source = tile.min_filter = None
+        if stale:
+            # upload the bounding box of the stale tiles (which may include some visible tiles that are not)
+            x0, y0 = min(tile.x for tile in stale), min(tile.y for tile in stale)
+            x1, y1 = max(tile.x + tile.w for tile in stale), max(tile.y + tile.h for tile in stale)
+            self._start_upload(data, source_format, source_type, (x0, y0, x1 - x0, y1 - y0))
 
-        if self.texture is not None and new_format != self.format or new_shape != self.shape:
-            self.destroy()
+    def release(self):
+        """Release the texture's tiles to the texture pool, once any upload in progress is done. Requires
+        a current GL context."""
+        if self.status == 'uploading':
+            self.ready.wait()
+        self._release_texture()
+
+    def _prepare(self, image):
+        # Set the format and shape of the texture for image, releasing the tiles if they no longer fit,
+        # and return the data (in the texture's axes) and the GL pixel format and type for uploading it.
+        new_format = texture_format(image)
+        transposed = image.memory_order == 'C'
+        data = image.data.swapaxes(0, 1) if transposed else image.data
+        new_shape = data.shape[:2]
+        if new_format != self.format or new_shape != self.shape:
+            if self.status == 'uploading':
+                # the upload thread may still be laying out or writing to the tiles, which may be released
+                # to the pool (and the texture's shape changed) only once it is done with them
+                self.ready.wait()
+            self._release_texture()
+        self.transposed = transposed
         self.format = new_format
         self.shape = new_shape
         source_format = IMAGE_TYPE_TO_SOURCE_FORMATS[image.type]
         source_type = NUMPY_DTYPE_TO_GL_PIXEL_TYPE[image.data.dtype.type]
-        upload_args = image.data, source_format, source_type, upload_region
-        if self.texture is None and upload_region is not None:
-            raise ValueError('The first time the texture is uploaded, the full region must be used.')
+        return data, source_format, source_type
+
+    def _start_upload(self, *upload_args):
         if self.ready.is_set():
             # if the texture was already uploaded and done is set, make sure to
             # reset it so that bind waits for this new upload.
             self.ready.clear()
         self.status = 'uploading'
         if USE_BG_UPLOAD_THREAD:
-            OffscreenContextThread.get().enqueue(self._upload, *upload_args)
+            OffscreenContextThread.get().enqueue_upload(self, *upload_args)
         else:
             self._upload_fg(*upload_args)
 
-    def bind(self, tex_unit):
+    def bind(self, tex_unit, mipmaps=False, tile=0):
         if self.status not in ('uploading', 'uploaded'):
             raise RuntimeError('Cannot bind texture that has not been first uploaded')
         self.ready.wait()
         if hasattr(self, 'exception'):
             raise self.exception
-        assert self.texture is not None
+        assert self.tiles
+        if self._fence is not None:
+            _wait_for_fence(self._fence)
+            GL.glDeleteSync(self._fence)
+            self._fence = None
+        tile = self.tiles[tile]
         GL.glActiveTexture(GL.GL_TEXTURE0 + tex_unit)
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, tile.texture)
+        if mipmaps and tile.mipmaps_dirty:
+            GL.glGenerateMipmap(GL.GL_TEXTURE_2D)
+            tile.mipmaps_dirty = False
+        # a mipmapped filter must not be used with out-of-date mipmaps: they may not even be allocated
+        min_filter = GL.GL_LINEAR_MIPMAP_LINEAR if mipmaps else GL.GL_LINEAR
+        if min_filter != tile.min_filter:
+            GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, min_filter)
+            tile.min_filter = min_filter
+
+    def image_tile_edges(self):
+        """Return arrays of the x and y edges of the tile grid, as fractions of the image's width and height."""
+        x_edges, y_edges = self._tile_edges
+        w, h = self.shape
+        edges = x_edges / w, y_edges / h
+        return edges[::-1] if self.transposed else edges
+
+    def tile_at(self, x, y):
+        """Return the index of the tile containing the point (x, y), given as fractions of the image's
+        width and height."""
+        if self.transposed:
+            x, y = y, x
+        x_edges, y_edges = self._tile_edges
+        w, h = self.shape
+        i = min(numpy.searchsorted(x_edges, x * w, 'right') - 1, len(x_edges) - 2)
+        j = min(numpy.searchsorted(y_edges, y * h, 'right') - 1, len(y_edges) - 2)
+        return int(j * (len(x_edges) - 1) + max(i, 0))
+
+    def tiles_in(self, rect=None):
+        """Return the indices of the tiles that intersect rect, given as (left, top, right, bottom) fractions
+        of the image's width and height (or of all the tiles, if rect is None)."""
+        if rect is None:
+            return range(len(self.tiles))
+        x0, y0, x1, y1 = rect
+        if self.transposed:
+            x0, y0, x1, y1 = y0, x0, y1, x1
+        w, h = self.shape
+        return [index for index, tile in enumerate(self.tiles)
+            if tile.x / w < x1 and (tile.x + tile.w) / w > x0 and tile.y / h < y1 and (tile.y + tile.h) / h > y0]
+
+    def tile_transform(self, tile):
+        """Return (ox, oy, sx, sy) such that ((tx - ox) * sx, (ty - oy) * sy) are the coordinates within
+        the given tile of the texture coordinates (tx, ty) (which are in the texture's axes)."""
+        tile = self.tiles[tile]
+        w, h = self.shape
+        return tile.x / w, tile.y / h, w / tile.w, h / tile.h
 
     def destroy(self):
-        if self.texture is not None:
+        self._release_texture()
+        if self._fence is not None:
+            GL.glDeleteSync(self._fence)
+            self._fence = None
+        self._destroy_pbos()
+
+    def _release_texture(self):
+        # return the tile textures to the pool, for reuse by this or another AsyncTexture
+        if self.tiles:
             # requires a valid context
             assert Qt.QOpenGLContext.currentContext() is not None
-            GL.glDeleteTextures([self.texture])
-            self.texture = None
+            for tile in self.tiles:
+                if tile.texture is not None:
+                    texture_pool.release(tile.texture, self.format, tile.w, tile.h)
+            self.tiles = []
             self.status = 'waiting'
 
+    def _layout_tiles(self, tile_size, wanted=True):
+        w, h = self.shape
+        x_edges = numpy.linspace(0, w, -(-w // tile_size) + 1).round().astype(int)
+        y_edges = numpy.linspace(0, h, -(-h // tile_size) + 1).round().astype(int)
+        self._tile_edges = x_edges, y_edges
+        self.tiles = [_Tile(int(x0), int(y0), int(x1 - x0), int(y1 - y0), wanted)
+            for y0, y1 in zip(y_edges[:-1], y_edges[1:])
+            for x0, x1 in zip(x_edges[:-1], x_edges[1:])]
+
+    def _allocate_tile(self, tile, source_format, source_type):
+        tile.texture = texture_pool.acquire(self.format, tile.w, tile.h)
+        if tile.texture is None:
+            tile.texture = GL.glGenTextures(1)
+            GL.glBindTexture(GL.GL_TEXTURE_2D, tile.texture)
+            GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAX_LEVEL, 6)
+            GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR)
+            GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_NEAREST)
+            GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
+            GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
+            # allocate storage only: the data are uploaded like any other update
+            GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, self.format, tile.w, tile.h, 0, source_format, source_type, None)
+            tile.min_filter = GL.GL_LINEAR
+        # else, a pooled texture has the right format and size, and the parameters set above, except
+        # perhaps for the minification filter, which bind() will set
+
+    def _destroy_pbos(self):
+        for fence in self._pbo_fences:
+            if fence is not None:
+                GL.glDeleteSync(fence)
+        if self._pbos:
+            # deleting a mapped buffer unmaps it
+            GL.glDeleteBuffers(len(self._pbos), self._pbos)
+        self._pbos = []
+        self._pbo_pointers = []
+        self._pbo_fences = []
+        self._pbo_size = 0
+
+    def _next_pbo(self, size):
+        # Return the next buffer of the ring and its mapped address, (re)creating the ring if its
+        # buffers are smaller than size, and waiting until the GL is done with any previous upload from it.
+        if size > self._pbo_size:
+            self._destroy_pbos()
+            flags = GL.GL_MAP_WRITE_BIT | GL.GL_MAP_PERSISTENT_BIT | GL.GL_MAP_COHERENT_BIT
+            for _ in range(PBO_RING_SIZE):
+                pbo = GL.glGenBuffers(1)
+                GL.glBindBuffer(GL.GL_PIXEL_UNPACK_BUFFER, pbo)
+                GL.glBufferStorage(GL.GL_PIXEL_UNPACK_BUFFER, size, None, flags)
+                self._pbos.append(pbo)
+                self._pbo_pointers.append(GL.glMapBufferRange(GL.GL_PIXEL_UNPACK_BUFFER, 0, size, flags))
+                self._pbo_fences.append(None)
+            self._pbo_size = size
+            self._pbo_index = 0
+        i = self._pbo_index
+        self._pbo_index = (i + 1) % len(self._pbos)
+        if self._pbo_fences[i] is not None:
+            _wait_for_fence(self._pbo_fences[i])
+            GL.glDeleteSync(self._pbo_fences[i])
+            self._pbo_fences[i] = None
+        return i
+
     def _upload_fg(self, data, source_format, source_type, upload_region):
         assert Qt.QOpenGLContext.currentContext() is not None
         orig_unpack_alignment = GL.glGetIntegerv(GL.GL_UNPACK_ALIGNMENT)
@@ -95,47 +452,86 @@ class AsyncTexture:
 
     def _upload(self, data, source_format, source_type, upload_region):
         try:
-            if self.texture is None:
-                self.texture = GL.glGenTextures(1)
-                alloc_texture = True
+            if not self.tiles:
+                self._layout_tiles(_tile_size())
+            if data.dtype == numpy.float64:
+                data = data.astype(numpy.float32)
+            # data's rows may be padded: GL_UNPACK_ROW_LENGTH gives their length in pixels
+            row_length = data.strides[1] // data.strides[0]
+            if upload_region is None:
+                rx, ry, (rw, rh) = 0, 0, self.shape
             else:
-                alloc_texture = False
-            GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture)
-            w, h = self.shape
-            if alloc_texture:
-                GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAX_LEVEL, 6)
-                GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR_MIPMAP_LINEAR)
-                GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_NEAREST)
-                GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
-                GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
-                GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, self.format, w, h, 0,
-                    source_format, source_type, data.ctypes.data_as(ctypes.c_void_p))
-            else: # texture already exists
-                row_stride = w
-                if upload_region is None:
-                    x = y = 0
-                else:
-                    x, y, w, h = upload_region
-                    data = data[x:x+w, y:y+h]
-                try:
-                    GL.glPixelStorei(GL.GL_UNPACK_ROW_LENGTH, row_stride)
-                    GL.glTexSubImage2D(GL.GL_TEXTURE_2D, 0, x, y, w, h,
-                        source_format, source_type, data.ctypes.data_as(ctypes.c_void_p))
-                finally:
-                    GL.glPixelStorei(GL.GL_UNPACK_ROW_LENGTH, 0)
-            # whether or not allocating texture, need to regenerate mipmaps
-            GL.glGenerateMipmap(GL.GL_TEXTURE_2D)
-            # need glFinish to make sure that the GL calls (which run asynchronously)
-            # have completed before we set self.ready
-            GL.glFinish()
+                rx, ry, rw, rh = upload_region
+            data = data[rx:rx+rw, ry:ry+rh]
+            use_pbo = USE_PBO_UPLOADS and _supports_pbo_uploads()
+            if use_pbo:
+                # the bytes from the first to the last pixel, including any row padding in between
+                span = data.strides[1] * (rh - 1) + data.strides[0] * rw
+                pbo_index = self._next_pbo(span)
+                ctypes.memmove(self._pbo_pointers[pbo_index], data.ctypes.data, span)
+                GL.glBindBuffer(GL.GL_PIXEL_UNPACK_BUFFER, self._pbos[pbo_index])
+            try:
+                GL.glPixelStorei(GL.GL_UNPACK_ROW_LENGTH, row_length)
+                for tile in self.tiles:
+                    if not tile.wanted:
+                        continue
+                    # the part of the region within the tile
+                    x0, x1 = max(rx, tile.x), min(rx + rw, tile.x + tile.w)
+                    y0, y1 = max(ry, tile.y), min(ry + rh, tile.y + tile.h)
+                    if x0 >= x1 or y0 >= y1:
+                        continue
+                    offset = (x0 - rx) * data.strides[0] + (y0 - ry) * data.strides[1]
+                    # with a PBO bound, the pixel data "pointer" is an offset into the buffer
+                    pixels = ctypes.c_void_p(offset if use_pbo else data.ctypes.data + offset)
+                    if tile.texture is None:
+                        self._allocate_tile(tile, source_format, source_type)
+                    GL.glBindTexture(GL.GL_TEXTURE_2D, tile.texture)
+                    GL.glTexSubImage2D(GL.GL_TEXTURE_2D, 0, x0 - tile.x, y0 - tile.y, x1 - x0, y1 - y0,
+                        source_format, source_type, pixels)
+                    # mipmaps must be regenerated before they are next used
+                    tile.mipmaps_dirty = True
+            finally:
+                GL.glPixelStorei(GL.GL_UNPACK_ROW_LENGTH, 0)
+                if use_pbo:
+                    GL.glBindBuffer(GL.GL_PIXEL_UNPACK_BUFFER, 0)
+            if use_pbo:
+                # Rather than waiting here for the GL calls (which run asynchronously) to complete, fence
+                # them: bind() waits for self._fence, and the next upload into this PBO for its fence.
+                self._pbo_fences[pbo_index] = GL.glFenceSync(GL.GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+                if self._fence is not None:
+                    # the previous upload was never bound
+                    GL.glDeleteSync(self._fence)
+                self._fence = GL.glFenceSync(GL.GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+                # make sure the fences are submitted, so that waits on them from other contexts finish
+                GL.glFlush()
+            else:
+                # need glFinish to make sure that the GL calls (which run asynchronously)
+                # have completed before we set self.ready
+                GL.glFinish()
             self.status = 'uploaded'
         except Exception as e:
             self.exception = e
         finally:
             self.ready.set()
 
+def _wait_for_fence(fence):
+    while GL.glClientWaitSync(fence, GL.GL_SYNC_FLUSH_COMMANDS_BIT, 10**9) == GL.GL_TIMEOUT_EXPIRED:
+        pass
+
+def _region_union(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    x, y = min(ax, bx), min(ay, by)
+    return x, y, max(ax + aw, bx + bw) - x, max(ay + ah, by + bh) - y
 
 class OffscreenContextThread(Qt.QThread):
+    """Runs texture uploads (and other GL jobs) in an offscreen context on a background thread.
+
+    Uploads are coalesced per AsyncTexture, so that the display does not fall further and further
+    behind when frames arrive faster than they can be uploaded: an upload queued while an older one
+    for the same texture is still pending replaces it, covering the union of their changed regions.
+    .queue_depth is the number of jobs waiting to run, and .dropped_frames counts the uploads that
+    have been superseded in this way."""
     _ACTIVE_THREAD = None
 
     @classmethod
@@ -150,12 +546,41 @@ class OffscreenContextThread(Qt.QThread):
         self.offscreen_surface.setFormat(shared_resources.GL_QSURFACE_FORMAT)
         self.offscreen_surface.create()
         self.queue = queue.Queue()
+        # AsyncTexture: [data, source_format, source_type, upload_region] of its pending upload
+        self._pending_uploads = {}
+        self._pending_lock = threading.Lock()
+        self.dropped_frames = 0
         self.running = True
         self.start()
 
+    @property
+    def queue_depth(self):
+        return self.queue.qsize()
+
     def enqueue(self, func, *args):
         self.queue.put((func, args))
 
+    def enqueue_upload(self, texture, data, source_format, source_type, upload_region):
+        with self._pending_lock:
+            pending = self._pending_uploads.get(texture)
+            if pending is None:
+                self._pending_uploads[texture] = [data, source_format, source_type, upload_region]
+                self.queue.put((self._upload, (texture,)))
+                return
+            self.dropped_frames += 1
+            pending_region = pending[3]
+            if pending_region is None or upload_region is None:
+                # the newest data must be uploaded in full to cover the pending upload too
+                upload_region = None
+            else:
+                upload_region = _region_union(pending_region, upload_region)
+            pending[:] = data, source_format, source_type, upload_region
+
+    def _upload(self, texture):
+        with self._pending_lock:
+            upload_args = self._pending_uploads.pop(texture)
+        texture._upload(*upload_args)
+
     def run(self):
         gl_context = Qt.QOpenGLContext()
         gl_context.setShareContext(Qt.QOpenGLContext.globalShareContext())
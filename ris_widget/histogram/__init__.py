@@ -1 +1,3 @@
-from .histogram import histogram
\ No newline at end of file
+from .histogram import histogram, histogram_statistics, histogram_percentiles, histogram_stack, HistogramStackStatistics, FIXED_RANGE_DTYPES
+from .masks import SpanMask, RectMask, EllipseMask, PolygonMask, BitmapMask
+from .cache import HistogramCache
\ No newline at end of file
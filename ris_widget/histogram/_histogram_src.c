@@ -2,6 +2,7 @@
 
 #include <inttypes.h>
 #include <math.h>
+#include <stdlib.h>
 
 void hist_uint8(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
     uint32_t *histogram, uint8_t *min, uint8_t *max) {
@@ -152,37 +153,54 @@ void masked_ranged_hist_uint16(const char *image, uint16_t rows, uint16_t cols,
     *max = working_max;
 }
 
+// The float minmax kernels skip NaN and +/-Inf pixels, which are instead counted in
+// nan_count and inf_count. If there are no finite pixels, min is INFINITY and max is -INFINITY.
+
 void minmax_float(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
-    float *min, float *max) {
-    float working_min = *(float *) image;
-    float working_max = *(float *) image;
+    float *min, float *max, uint32_t *nan_count, uint32_t *inf_count) {
+    float working_min = INFINITY;
+    float working_max = -INFINITY;
+    uint32_t nans = 0, infs = 0;
     const char *row_start, *pixel;
     for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride) {
         for (pixel = row_start; pixel != row_start + cols*c_stride; pixel += c_stride) {
             float val = *(float *) pixel;
-            if (val < working_min) working_min = val;
-            else if (val > working_max) working_max = val;
+            if (isnan(val)) nans++;
+            else if (isinf(val)) infs++;
+            else {
+                if (val < working_min) working_min = val;
+                if (val > working_max) working_max = val;
+            }
         }
     }
     *min = working_min;
     *max = working_max;
+    *nan_count = nans;
+    *inf_count = infs;
 }
 
 void masked_minmax_float(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
-    const uint16_t *starts, const uint16_t *ends, float *min, float *max) {
+    const uint16_t *starts, const uint16_t *ends, float *min, float *max, uint32_t *nan_count, uint32_t *inf_count) {
     // ends are exclusive bounds
-    float working_min, working_max;
-    working_min = working_max = *(float *) (image + (*starts)*c_stride);
+    float working_min = INFINITY;
+    float working_max = -INFINITY;
+    uint32_t nans = 0, infs = 0;
     const char *row_start, *pixel;
     for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride, starts++, ends++) {
         for (pixel = row_start + (*starts)*c_stride; pixel != row_start + (*ends)*c_stride; pixel += c_stride) {
             float val = *(float *) pixel;
-            if (val < working_min) working_min = val;
-            else if (val > working_max) working_max = val;
+            if (isnan(val)) nans++;
+            else if (isinf(val)) infs++;
+            else {
+                if (val < working_min) working_min = val;
+                if (val > working_max) working_max = val;
+            }
         }
     }
     *min = working_min;
     *max = working_max;
+    *nan_count = nans;
+    *inf_count = infs;
 }
 
 void ranged_hist_float(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
@@ -193,8 +211,11 @@ void ranged_hist_float(const char *image, uint16_t rows, uint16_t cols, uint32_t
     for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride) {
         for (pixel = row_start; pixel != row_start + cols*c_stride; pixel += c_stride) {
             float val = *(float *) pixel;
-            if (val >= hist_min && val < hist_max)
-                histogram[(uint16_t) (bin_factor * (val - hist_min))]++;
+            if (val >= hist_min && val < hist_max) {
+                // float rounding can put values just below hist_max at index n_bins
+                uint16_t bin = (uint16_t) (bin_factor * (val - hist_min));
+                histogram[bin < n_bins ? bin : n_bins - 1]++;
+            }
             else if (val == hist_max) (*last_bin)++;
         }
     }
@@ -209,9 +230,719 @@ void masked_ranged_hist_float(const char *image, uint16_t rows, uint16_t cols, u
     for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride, starts++, ends++) {
         for (pixel = row_start + (*starts)*c_stride; pixel != row_start + (*ends)*c_stride; pixel += c_stride) {
             float val = *(float *) pixel;
-            if (val >= hist_min && val < hist_max)
-                histogram[(uint16_t) (bin_factor * (val - hist_min))]++;
+            if (val >= hist_min && val < hist_max) {
+                // float rounding can put values just below hist_max at index n_bins
+                uint16_t bin = (uint16_t) (bin_factor * (val - hist_min));
+                histogram[bin < n_bins ? bin : n_bins - 1]++;
+            }
             else if (val == hist_max) (*last_bin)++;
         }
     }
-}
\ No newline at end of file
+}
+
+// The *_contiguous kernels below are used when pixels within a row are adjacent in memory
+// (c_stride == sizeof(pixel)). They scatter four consecutive pixels into four separate
+// sub-histograms, so that neighboring pixels with the same value (very common in dim or
+// flat images) do not serialize on load-increment-store of the same counter, and they
+// compute min/max without data-dependent branches. The sub-histograms are summed into
+// the output histogram at the end.
+
+#define N_SUBHISTS 4
+
+void hist_uint8_contiguous(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    uint32_t *histogram, uint8_t *min, uint8_t *max) {
+    uint32_t subhists[N_SUBHISTS][256] = {{0}};
+    uint8_t working_min = *(uint8_t *) image;
+    uint8_t working_max = *(uint8_t *) image;
+    const char *row_start;
+    uint32_t i, j;
+    for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride) {
+        const uint8_t *pixel = (const uint8_t *) row_start;
+        const uint8_t *unrolled_end = pixel + (cols & ~(N_SUBHISTS - 1));
+        const uint8_t *row_end = pixel + cols;
+        for (; pixel != unrolled_end; pixel += N_SUBHISTS) {
+            uint8_t v0 = pixel[0], v1 = pixel[1], v2 = pixel[2], v3 = pixel[3];
+            subhists[0][v0]++;
+            subhists[1][v1]++;
+            subhists[2][v2]++;
+            subhists[3][v3]++;
+            uint8_t mn01 = v0 < v1 ? v0 : v1, mn23 = v2 < v3 ? v2 : v3;
+            uint8_t mx01 = v0 > v1 ? v0 : v1, mx23 = v2 > v3 ? v2 : v3;
+            uint8_t mn = mn01 < mn23 ? mn01 : mn23, mx = mx01 > mx23 ? mx01 : mx23;
+            working_min = mn < working_min ? mn : working_min;
+            working_max = mx > working_max ? mx : working_max;
+        }
+        for (; pixel != row_end; pixel++) {
+            uint8_t val = *pixel;
+            subhists[0][val]++;
+            working_min = val < working_min ? val : working_min;
+            working_max = val > working_max ? val : working_max;
+        }
+    }
+    for (i = 0; i < N_SUBHISTS; i++) {
+        for (j = 0; j < 256; j++) histogram[j] += subhists[i][j];
+    }
+    *min = working_min;
+    *max = working_max;
+}
+
+void masked_hist_uint8_contiguous(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    const uint16_t *starts, const uint16_t *ends, uint32_t *histogram, uint8_t *min, uint8_t *max) {
+    // ends are exclusive bounds
+    uint32_t subhists[N_SUBHISTS][256] = {{0}};
+    uint8_t working_min, working_max;
+    working_min = working_max = *(uint8_t *) (image + (*starts)*c_stride);
+    const char *row_start;
+    uint32_t i, j;
+    for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride, starts++, ends++) {
+        const uint8_t *pixel = (const uint8_t *) row_start + *starts;
+        const uint8_t *row_end = (const uint8_t *) row_start + *ends;
+        const uint8_t *unrolled_end = pixel + ((row_end - pixel) & ~(N_SUBHISTS - 1));
+        for (; pixel < unrolled_end; pixel += N_SUBHISTS) {
+            uint8_t v0 = pixel[0], v1 = pixel[1], v2 = pixel[2], v3 = pixel[3];
+            subhists[0][v0]++;
+            subhists[1][v1]++;
+            subhists[2][v2]++;
+            subhists[3][v3]++;
+            uint8_t mn01 = v0 < v1 ? v0 : v1, mn23 = v2 < v3 ? v2 : v3;
+            uint8_t mx01 = v0 > v1 ? v0 : v1, mx23 = v2 > v3 ? v2 : v3;
+            uint8_t mn = mn01 < mn23 ? mn01 : mn23, mx = mx01 > mx23 ? mx01 : mx23;
+            working_min = mn < working_min ? mn : working_min;
+            working_max = mx > working_max ? mx : working_max;
+        }
+        for (; pixel < row_end; pixel++) {
+            uint8_t val = *pixel;
+            subhists[0][val]++;
+            working_min = val < working_min ? val : working_min;
+            working_max = val > working_max ? val : working_max;
+        }
+    }
+    for (i = 0; i < N_SUBHISTS; i++) {
+        for (j = 0; j < 256; j++) histogram[j] += subhists[i][j];
+    }
+    *min = working_min;
+    *max = working_max;
+}
+
+void hist_uint16_contiguous(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    uint32_t *histogram, uint8_t shift, uint16_t *min, uint16_t *max) {
+    // Sub-histograms need as many bins as (65535 >> shift) + 1, which is the same set of bins
+    // the non-contiguous kernel may touch; only bins up to the image max are folded back in.
+    uint32_t n_bins = (0xFFFFu >> shift) + 1;
+    uint32_t *subhists = calloc(N_SUBHISTS * n_bins, sizeof(uint32_t));
+    if (subhists == NULL) {
+        hist_uint16(image, rows, cols, r_stride, c_stride, histogram, shift, min, max);
+        return;
+    }
+    uint32_t *h0 = subhists, *h1 = subhists + n_bins, *h2 = subhists + 2*n_bins, *h3 = subhists + 3*n_bins;
+    uint16_t working_min = *(uint16_t *) image;
+    uint16_t working_max = *(uint16_t *) image;
+    const char *row_start;
+    uint32_t i, j;
+    for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride) {
+        const uint16_t *pixel = (const uint16_t *) row_start;
+        const uint16_t *unrolled_end = pixel + (cols & ~(N_SUBHISTS - 1));
+        const uint16_t *row_end = pixel + cols;
+        for (; pixel != unrolled_end; pixel += N_SUBHISTS) {
+            uint16_t v0 = pixel[0], v1 = pixel[1], v2 = pixel[2], v3 = pixel[3];
+            h0[v0 >> shift]++;
+            h1[v1 >> shift]++;
+            h2[v2 >> shift]++;
+            h3[v3 >> shift]++;
+            uint16_t mn01 = v0 < v1 ? v0 : v1, mn23 = v2 < v3 ? v2 : v3;
+            uint16_t mx01 = v0 > v1 ? v0 : v1, mx23 = v2 > v3 ? v2 : v3;
+            uint16_t mn = mn01 < mn23 ? mn01 : mn23, mx = mx01 > mx23 ? mx01 : mx23;
+            working_min = mn < working_min ? mn : working_min;
+            working_max = mx > working_max ? mx : working_max;
+        }
+        for (; pixel != row_end; pixel++) {
+            uint16_t val = *pixel;
+            h0[val >> shift]++;
+            working_min = val < working_min ? val : working_min;
+            working_max = val > working_max ? val : working_max;
+        }
+    }
+    for (i = 0; i < N_SUBHISTS; i++) {
+        const uint32_t *subhist = subhists + i*n_bins;
+        for (j = 0; j <= (uint32_t) (working_max >> shift); j++) histogram[j] += subhist[j];
+    }
+    free(subhists);
+    *min = working_min;
+    *max = working_max;
+}
+
+void masked_hist_uint16_contiguous(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    const uint16_t *starts, const uint16_t *ends, uint32_t *histogram, uint8_t shift, uint16_t *min, uint16_t *max) {
+    // ends are exclusive bounds
+    uint32_t n_bins = (0xFFFFu >> shift) + 1;
+    uint32_t *subhists = calloc(N_SUBHISTS * n_bins, sizeof(uint32_t));
+    if (subhists == NULL) {
+        masked_hist_uint16(image, rows, cols, r_stride, c_stride, starts, ends, histogram, shift, min, max);
+        return;
+    }
+    uint32_t *h0 = subhists, *h1 = subhists + n_bins, *h2 = subhists + 2*n_bins, *h3 = subhists + 3*n_bins;
+    uint16_t working_min, working_max;
+    working_min = working_max = *(uint16_t *) (image + (*starts)*c_stride);
+    const char *row_start;
+    uint32_t i, j;
+    for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride, starts++, ends++) {
+        const uint16_t *pixel = (const uint16_t *) row_start + *starts;
+        const uint16_t *row_end = (const uint16_t *) row_start + *ends;
+        const uint16_t *unrolled_end = pixel + ((row_end - pixel) & ~(N_SUBHISTS - 1));
+        for (; pixel < unrolled_end; pixel += N_SUBHISTS) {
+            uint16_t v0 = pixel[0], v1 = pixel[1], v2 = pixel[2], v3 = pixel[3];
+            h0[v0 >> shift]++;
+            h1[v1 >> shift]++;
+            h2[v2 >> shift]++;
+            h3[v3 >> shift]++;
+            uint16_t mn01 = v0 < v1 ? v0 : v1, mn23 = v2 < v3 ? v2 : v3;
+            uint16_t mx01 = v0 > v1 ? v0 : v1, mx23 = v2 > v3 ? v2 : v3;
+            uint16_t mn = mn01 < mn23 ? mn01 : mn23, mx = mx01 > mx23 ? mx01 : mx23;
+            working_min = mn < working_min ? mn : working_min;
+            working_max = mx > working_max ? mx : working_max;
+        }
+        for (; pixel < row_end; pixel++) {
+            uint16_t val = *pixel;
+            h0[val >> shift]++;
+            working_min = val < working_min ? val : working_min;
+            working_max = val > working_max ? val : working_max;
+        }
+    }
+    for (i = 0; i < N_SUBHISTS; i++) {
+        const uint32_t *subhist = subhists + i*n_bins;
+        for (j = 0; j <= (uint32_t) (working_max >> shift); j++) histogram[j] += subhist[j];
+    }
+    free(subhists);
+    *min = working_min;
+    *max = working_max;
+}
+
+// The fused float kernels below compute the histogram over a known [hist_min, hist_max] range
+// together with the min, max, NaN count and Inf count (as in minmax_float), in a single pass.
+
+void ranged_hist_minmax_float(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    uint32_t *histogram, uint16_t n_bins, float hist_min, float hist_max,
+    float *min, float *max, uint32_t *nan_count, uint32_t *inf_count) {
+    const char *row_start, *pixel;
+    float bin_factor = (float) n_bins / (hist_max - hist_min);
+    uint32_t *last_bin = histogram + n_bins - 1;
+    float working_min = INFINITY;
+    float working_max = -INFINITY;
+    uint32_t nans = 0, infs = 0;
+    for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride) {
+        for (pixel = row_start; pixel != row_start + cols*c_stride; pixel += c_stride) {
+            float val = *(float *) pixel;
+            if (isfinite(val)) {
+                working_min = val < working_min ? val : working_min;
+                working_max = val > working_max ? val : working_max;
+                if (val >= hist_min && val < hist_max) {
+                    uint16_t bin = (uint16_t) (bin_factor * (val - hist_min));
+                    histogram[bin < n_bins ? bin : n_bins - 1]++;
+                }
+                else if (val == hist_max) (*last_bin)++;
+            }
+            else if (isnan(val)) nans++;
+            else infs++;
+        }
+    }
+    *min = working_min;
+    *max = working_max;
+    *nan_count = nans;
+    *inf_count = infs;
+}
+
+void masked_ranged_hist_minmax_float(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    const uint16_t *starts, const uint16_t *ends, uint32_t *histogram, uint16_t n_bins, float hist_min, float hist_max,
+    float *min, float *max, uint32_t *nan_count, uint32_t *inf_count) {
+    // ends are exclusive bounds
+    const char *row_start, *pixel;
+    float bin_factor = (float) n_bins / (hist_max - hist_min);
+    uint32_t *last_bin = histogram + n_bins - 1;
+    float working_min = INFINITY;
+    float working_max = -INFINITY;
+    uint32_t nans = 0, infs = 0;
+    for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride, starts++, ends++) {
+        for (pixel = row_start + (*starts)*c_stride; pixel != row_start + (*ends)*c_stride; pixel += c_stride) {
+            float val = *(float *) pixel;
+            if (isfinite(val)) {
+                working_min = val < working_min ? val : working_min;
+                working_max = val > working_max ? val : working_max;
+                if (val >= hist_min && val < hist_max) {
+                    uint16_t bin = (uint16_t) (bin_factor * (val - hist_min));
+                    histogram[bin < n_bins ? bin : n_bins - 1]++;
+                }
+                else if (val == hist_max) (*last_bin)++;
+            }
+            else if (isnan(val)) nans++;
+            else infs++;
+        }
+    }
+    *min = working_min;
+    *max = working_max;
+    *nan_count = nans;
+    *inf_count = infs;
+}
+
+// The RGB kernels below read interleaved (R, G, B[, A]) pixels, where c_stride is the distance
+// between pixels and the components of a pixel are adjacent. They fill four consecutive
+// histograms of n_bins each: luma, then R, G, and B, where luma is the integer approximation
+// (13933*R + 46871*G + 4732*B) >> 16 of the CIE 1931 linear luminance 0.2126*R + 0.7152*G + 0.0722*B.
+// min and max are those of the luma values.
+
+void hist_rgb_uint8(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    uint32_t *histograms, uint8_t *min, uint8_t *max) {
+    uint32_t *luma_hist = histograms, *r_hist = histograms + 256, *g_hist = histograms + 512, *b_hist = histograms + 768;
+    uint8_t working_min = 255;
+    uint8_t working_max = 0;
+    const char *row_start, *pixel;
+    for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride) {
+        for (pixel = row_start; pixel != row_start + cols*c_stride; pixel += c_stride) {
+            const uint8_t *rgb = (const uint8_t *) pixel;
+            uint8_t luma = (uint8_t) ((13933u*rgb[0] + 46871u*rgb[1] + 4732u*rgb[2]) >> 16);
+            luma_hist[luma]++;
+            r_hist[rgb[0]]++;
+            g_hist[rgb[1]]++;
+            b_hist[rgb[2]]++;
+            working_min = luma < working_min ? luma : working_min;
+            working_max = luma > working_max ? luma : working_max;
+        }
+    }
+    *min = working_min;
+    *max = working_max;
+}
+
+void masked_hist_rgb_uint8(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    const uint16_t *starts, const uint16_t *ends, uint32_t *histograms, uint8_t *min, uint8_t *max) {
+    // ends are exclusive bounds
+    uint32_t *luma_hist = histograms, *r_hist = histograms + 256, *g_hist = histograms + 512, *b_hist = histograms + 768;
+    uint8_t working_min = 255;
+    uint8_t working_max = 0;
+    const char *row_start, *pixel;
+    for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride, starts++, ends++) {
+        for (pixel = row_start + (*starts)*c_stride; pixel != row_start + (*ends)*c_stride; pixel += c_stride) {
+            const uint8_t *rgb = (const uint8_t *) pixel;
+            uint8_t luma = (uint8_t) ((13933u*rgb[0] + 46871u*rgb[1] + 4732u*rgb[2]) >> 16);
+            luma_hist[luma]++;
+            r_hist[rgb[0]]++;
+            g_hist[rgb[1]]++;
+            b_hist[rgb[2]]++;
+            working_min = luma < working_min ? luma : working_min;
+            working_max = luma > working_max ? luma : working_max;
+        }
+    }
+    *min = working_min;
+    *max = working_max;
+}
+
+void hist_rgb_uint16(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    uint32_t *histograms, uint8_t shift, uint16_t *min, uint16_t *max) {
+    uint32_t *luma_hist = histograms, *r_hist = histograms + 1024, *g_hist = histograms + 2048, *b_hist = histograms + 3072;
+    uint16_t working_min = 65535;
+    uint16_t working_max = 0;
+    const char *row_start, *pixel;
+    for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride) {
+        for (pixel = row_start; pixel != row_start + cols*c_stride; pixel += c_stride) {
+            const uint16_t *rgb = (const uint16_t *) pixel;
+            uint16_t luma = (uint16_t) ((13933u*rgb[0] + 46871u*rgb[1] + 4732u*rgb[2]) >> 16);
+            luma_hist[luma >> shift]++;
+            r_hist[rgb[0] >> shift]++;
+            g_hist[rgb[1] >> shift]++;
+            b_hist[rgb[2] >> shift]++;
+            working_min = luma < working_min ? luma : working_min;
+            working_max = luma > working_max ? luma : working_max;
+        }
+    }
+    *min = working_min;
+    *max = working_max;
+}
+
+void masked_hist_rgb_uint16(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    const uint16_t *starts, const uint16_t *ends, uint32_t *histograms, uint8_t shift, uint16_t *min, uint16_t *max) {
+    // ends are exclusive bounds
+    uint32_t *luma_hist = histograms, *r_hist = histograms + 1024, *g_hist = histograms + 2048, *b_hist = histograms + 3072;
+    uint16_t working_min = 65535;
+    uint16_t working_max = 0;
+    const char *row_start, *pixel;
+    for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride, starts++, ends++) {
+        for (pixel = row_start + (*starts)*c_stride; pixel != row_start + (*ends)*c_stride; pixel += c_stride) {
+            const uint16_t *rgb = (const uint16_t *) pixel;
+            uint16_t luma = (uint16_t) ((13933u*rgb[0] + 46871u*rgb[1] + 4732u*rgb[2]) >> 16);
+            luma_hist[luma >> shift]++;
+            r_hist[rgb[0] >> shift]++;
+            g_hist[rgb[1] >> shift]++;
+            b_hist[rgb[2] >> shift]++;
+            working_min = luma < working_min ? luma : working_min;
+            working_max = luma > working_max ? luma : working_max;
+        }
+    }
+    *min = working_min;
+    *max = working_max;
+}
+
+// The ranged RGB kernels bin luma and each channel over [hist_min, hist_max] as the ranged_hist_uint8
+// and ranged_hist_uint16 kernels do, so that the channel histograms share the luma histogram's axis.
+
+void ranged_hist_rgb_uint8(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    uint32_t *histograms, uint8_t hist_min, uint8_t hist_max, uint8_t *min, uint8_t *max) {
+    uint32_t *luma_hist = histograms, *r_hist = histograms + 256, *g_hist = histograms + 512, *b_hist = histograms + 768;
+    uint8_t working_min = 255;
+    uint8_t working_max = 0;
+    const char *row_start, *pixel;
+    for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride) {
+        for (pixel = row_start; pixel != row_start + cols*c_stride; pixel += c_stride) {
+            const uint8_t *rgb = (const uint8_t *) pixel;
+            uint8_t luma = (uint8_t) ((13933u*rgb[0] + 46871u*rgb[1] + 4732u*rgb[2]) >> 16);
+            if (luma >= hist_min && luma <= hist_max) luma_hist[luma - hist_min]++;
+            if (rgb[0] >= hist_min && rgb[0] <= hist_max) r_hist[rgb[0] - hist_min]++;
+            if (rgb[1] >= hist_min && rgb[1] <= hist_max) g_hist[rgb[1] - hist_min]++;
+            if (rgb[2] >= hist_min && rgb[2] <= hist_max) b_hist[rgb[2] - hist_min]++;
+            working_min = luma < working_min ? luma : working_min;
+            working_max = luma > working_max ? luma : working_max;
+        }
+    }
+    *min = working_min;
+    *max = working_max;
+}
+
+void masked_ranged_hist_rgb_uint8(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    const uint16_t *starts, const uint16_t *ends, uint32_t *histograms, uint8_t hist_min, uint8_t hist_max, uint8_t *min, uint8_t *max) {
+    // ends are exclusive bounds
+    uint32_t *luma_hist = histograms, *r_hist = histograms + 256, *g_hist = histograms + 512, *b_hist = histograms + 768;
+    uint8_t working_min = 255;
+    uint8_t working_max = 0;
+    const char *row_start, *pixel;
+    for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride, starts++, ends++) {
+        for (pixel = row_start + (*starts)*c_stride; pixel != row_start + (*ends)*c_stride; pixel += c_stride) {
+            const uint8_t *rgb = (const uint8_t *) pixel;
+            uint8_t luma = (uint8_t) ((13933u*rgb[0] + 46871u*rgb[1] + 4732u*rgb[2]) >> 16);
+            if (luma >= hist_min && luma <= hist_max) luma_hist[luma - hist_min]++;
+            if (rgb[0] >= hist_min && rgb[0] <= hist_max) r_hist[rgb[0] - hist_min]++;
+            if (rgb[1] >= hist_min && rgb[1] <= hist_max) g_hist[rgb[1] - hist_min]++;
+            if (rgb[2] >= hist_min && rgb[2] <= hist_max) b_hist[rgb[2] - hist_min]++;
+            working_min = luma < working_min ? luma : working_min;
+            working_max = luma > working_max ? luma : working_max;
+        }
+    }
+    *min = working_min;
+    *max = working_max;
+}
+
+#define RANGED_BIN_UINT16(HIST, VAL) \
+    if ((VAL) >= hist_min && (VAL) < hist_max) (HIST)[(uint16_t) (bin_factor * ((VAL) - hist_min))]++; \
+    else if ((VAL) == hist_max) (HIST)[n_bins - 1]++;
+
+void ranged_hist_rgb_uint16(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    uint32_t *histograms, uint16_t n_bins, uint16_t hist_min, uint16_t hist_max, uint16_t *min, uint16_t *max) {
+    uint32_t *luma_hist = histograms, *r_hist = histograms + n_bins, *g_hist = histograms + 2*n_bins, *b_hist = histograms + 3*n_bins;
+    uint16_t working_min = 65535;
+    uint16_t working_max = 0;
+    float bin_factor = (float) n_bins / (hist_max - hist_min);
+    const char *row_start, *pixel;
+    for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride) {
+        for (pixel = row_start; pixel != row_start + cols*c_stride; pixel += c_stride) {
+            const uint16_t *rgb = (const uint16_t *) pixel;
+            uint16_t luma = (uint16_t) ((13933u*rgb[0] + 46871u*rgb[1] + 4732u*rgb[2]) >> 16);
+            RANGED_BIN_UINT16(luma_hist, luma)
+            RANGED_BIN_UINT16(r_hist, rgb[0])
+            RANGED_BIN_UINT16(g_hist, rgb[1])
+            RANGED_BIN_UINT16(b_hist, rgb[2])
+            working_min = luma < working_min ? luma : working_min;
+            working_max = luma > working_max ? luma : working_max;
+        }
+    }
+    *min = working_min;
+    *max = working_max;
+}
+
+void masked_ranged_hist_rgb_uint16(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    const uint16_t *starts, const uint16_t *ends, uint32_t *histograms, uint16_t n_bins, uint16_t hist_min, uint16_t hist_max,
+    uint16_t *min, uint16_t *max) {
+    // ends are exclusive bounds
+    uint32_t *luma_hist = histograms, *r_hist = histograms + n_bins, *g_hist = histograms + 2*n_bins, *b_hist = histograms + 3*n_bins;
+    uint16_t working_min = 65535;
+    uint16_t working_max = 0;
+    float bin_factor = (float) n_bins / (hist_max - hist_min);
+    const char *row_start, *pixel;
+    for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride, starts++, ends++) {
+        for (pixel = row_start + (*starts)*c_stride; pixel != row_start + (*ends)*c_stride; pixel += c_stride) {
+            const uint16_t *rgb = (const uint16_t *) pixel;
+            uint16_t luma = (uint16_t) ((13933u*rgb[0] + 46871u*rgb[1] + 4732u*rgb[2]) >> 16);
+            RANGED_BIN_UINT16(luma_hist, luma)
+            RANGED_BIN_UINT16(r_hist, rgb[0])
+            RANGED_BIN_UINT16(g_hist, rgb[1])
+            RANGED_BIN_UINT16(b_hist, rgb[2])
+            working_min = luma < working_min ? luma : working_min;
+            working_max = luma > working_max ? luma : working_max;
+        }
+    }
+    *min = working_min;
+    *max = working_max;
+}
+
+// Stack kernels: bin each of n_images images of the same type in a single call. The data pointer
+// and geometry of image k are images[k], rows[k], cols[k], r_strides[k], and c_strides[k]; its
+// histogram is written to histograms + k*n_bins and its min/max to mins[k]/maxs[k].
+
+void hist_stack_uint8(const char **images, uint32_t n_images, const uint16_t *rows, const uint16_t *cols,
+    const uint32_t *r_strides, const uint32_t *c_strides, uint32_t *histograms, uint8_t *mins, uint8_t *maxs) {
+    uint32_t k;
+    for (k = 0; k < n_images; k++) {
+        if (c_strides[k] == sizeof(uint8_t)) {
+            hist_uint8_contiguous(images[k], rows[k], cols[k], r_strides[k], c_strides[k], histograms + k*256, mins + k, maxs + k);
+        } else {
+            hist_uint8(images[k], rows[k], cols[k], r_strides[k], c_strides[k], histograms + k*256, mins + k, maxs + k);
+        }
+    }
+}
+
+void ranged_hist_stack_uint8(const char **images, uint32_t n_images, const uint16_t *rows, const uint16_t *cols,
+    const uint32_t *r_strides, const uint32_t *c_strides, uint32_t *histograms, uint8_t hist_min, uint8_t hist_max,
+    uint8_t *mins, uint8_t *maxs) {
+    uint32_t k;
+    for (k = 0; k < n_images; k++) {
+        ranged_hist_uint8(images[k], rows[k], cols[k], r_strides[k], c_strides[k], histograms + k*256,
+            hist_min, hist_max, mins + k, maxs + k);
+    }
+}
+
+void hist_stack_uint16(const char **images, uint32_t n_images, const uint16_t *rows, const uint16_t *cols,
+    const uint32_t *r_strides, const uint32_t *c_strides, uint32_t *histograms, uint8_t shift, uint16_t *mins, uint16_t *maxs) {
+    uint32_t k;
+    for (k = 0; k < n_images; k++) {
+        if (c_strides[k] == sizeof(uint16_t)) {
+            hist_uint16_contiguous(images[k], rows[k], cols[k], r_strides[k], c_strides[k], histograms + k*1024, shift, mins + k, maxs + k);
+        } else {
+            hist_uint16(images[k], rows[k], cols[k], r_strides[k], c_strides[k], histograms + k*1024, shift, mins + k, maxs + k);
+        }
+    }
+}
+
+void ranged_hist_stack_uint16(const char **images, uint32_t n_images, const uint16_t *rows, const uint16_t *cols,
+    const uint32_t *r_strides, const uint32_t *c_strides, uint32_t *histograms, uint16_t n_bins, uint16_t hist_min,
+    uint16_t hist_max, uint16_t *mins, uint16_t *maxs) {
+    uint32_t k;
+    for (k = 0; k < n_images; k++) {
+        ranged_hist_uint16(images[k], rows[k], cols[k], r_strides[k], c_strides[k], histograms + k*n_bins,
+            n_bins, hist_min, hist_max, mins + k, maxs + k);
+    }
+}
+
+void minmax_stack_float(const char **images, uint32_t n_images, const uint16_t *rows, const uint16_t *cols,
+    const uint32_t *r_strides, const uint32_t *c_strides, float *mins, float *maxs, uint32_t *nan_counts, uint32_t *inf_counts) {
+    uint32_t k;
+    for (k = 0; k < n_images; k++) {
+        minmax_float(images[k], rows[k], cols[k], r_strides[k], c_strides[k], mins + k, maxs + k, nan_counts + k, inf_counts + k);
+    }
+}
+
+void ranged_hist_stack_float(const char **images, uint32_t n_images, const uint16_t *rows, const uint16_t *cols,
+    const uint32_t *r_strides, const uint32_t *c_strides, uint32_t *histograms, uint16_t n_bins, float hist_min, float hist_max) {
+    uint32_t k;
+    for (k = 0; k < n_images; k++) {
+        ranged_hist_float(images[k], rows[k], cols[k], r_strides[k], c_strides[k], histograms + k*n_bins, n_bins, hist_min, hist_max);
+    }
+}
+
+// Kernels for int16, int32, uint32, and double images, which (like float images) are binned over
+// a range found by a first pass over the image. Each pixel is read as type T and converted to double,
+// which holds every value of these types exactly. The bodies, shared by all four types, follow the
+// float kernels; the NaN and Inf tests are always false for the integer types. For masked kernels,
+// ends are exclusive bounds.
+
+#define ROWS_LOOP for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride)
+#define COLS_LOOP for (pixel = row_start; pixel != row_start + cols*c_stride; pixel += c_stride)
+#define MASKED_ROWS_LOOP for (row_start = image; row_start != image + rows*r_stride; row_start += r_stride, starts++, ends++)
+#define MASKED_COLS_LOOP for (pixel = row_start + (*starts)*c_stride; pixel != row_start + (*ends)*c_stride; pixel += c_stride)
+
+#define MINMAX_BODY(T, ROWS, COLS) \
+    double working_min = INFINITY; \
+    double working_max = -INFINITY; \
+    uint32_t nans = 0, infs = 0; \
+    const char *row_start, *pixel; \
+    ROWS { \
+        COLS { \
+            double val = (double) *(T *) pixel; \
+            if (isnan(val)) nans++; \
+            else if (isinf(val)) infs++; \
+            else { \
+                if (val < working_min) working_min = val; \
+                if (val > working_max) working_max = val; \
+            } \
+        } \
+    } \
+    *min = working_min; \
+    *max = working_max; \
+    *nan_count = nans; \
+    *inf_count = infs;
+
+#define RANGED_HIST_BODY(T, ROWS, COLS) \
+    const char *row_start, *pixel; \
+    double bin_factor = (double) n_bins / (hist_max - hist_min); \
+    uint32_t *last_bin = histogram + n_bins - 1; \
+    ROWS { \
+        COLS { \
+            double val = (double) *(T *) pixel; \
+            if (val >= hist_min && val < hist_max) { \
+                uint16_t bin = (uint16_t) (bin_factor * (val - hist_min)); \
+                histogram[bin < n_bins ? bin : n_bins - 1]++; \
+            } \
+            else if (val == hist_max) (*last_bin)++; \
+        } \
+    }
+
+#define RANGED_HIST_MINMAX_BODY(T, ROWS, COLS) \
+    const char *row_start, *pixel; \
+    double bin_factor = (double) n_bins / (hist_max - hist_min); \
+    uint32_t *last_bin = histogram + n_bins - 1; \
+    double working_min = INFINITY; \
+    double working_max = -INFINITY; \
+    uint32_t nans = 0, infs = 0; \
+    ROWS { \
+        COLS { \
+            double val = (double) *(T *) pixel; \
+            if (isfinite(val)) { \
+                working_min = val < working_min ? val : working_min; \
+                working_max = val > working_max ? val : working_max; \
+                if (val >= hist_min && val < hist_max) { \
+                    uint16_t bin = (uint16_t) (bin_factor * (val - hist_min)); \
+                    histogram[bin < n_bins ? bin : n_bins - 1]++; \
+                } \
+                else if (val == hist_max) (*last_bin)++; \
+            } \
+            else if (isnan(val)) nans++; \
+            else infs++; \
+        } \
+    } \
+    *min = working_min; \
+    *max = working_max; \
+    *nan_count = nans; \
+    *inf_count = infs;
+
+
+void minmax_int16(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    double *min, double *max, uint32_t *nan_count, uint32_t *inf_count) {
+    MINMAX_BODY(int16_t, ROWS_LOOP, COLS_LOOP)
+}
+
+void masked_minmax_int16(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    const uint16_t *starts, const uint16_t *ends, double *min, double *max, uint32_t *nan_count, uint32_t *inf_count) {
+    MINMAX_BODY(int16_t, MASKED_ROWS_LOOP, MASKED_COLS_LOOP)
+}
+
+void ranged_hist_int16(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    uint32_t *histogram, uint16_t n_bins, double hist_min, double hist_max) {
+    RANGED_HIST_BODY(int16_t, ROWS_LOOP, COLS_LOOP)
+}
+
+void masked_ranged_hist_int16(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    const uint16_t *starts, const uint16_t *ends, uint32_t *histogram, uint16_t n_bins, double hist_min, double hist_max) {
+    RANGED_HIST_BODY(int16_t, MASKED_ROWS_LOOP, MASKED_COLS_LOOP)
+}
+
+void ranged_hist_minmax_int16(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    uint32_t *histogram, uint16_t n_bins, double hist_min, double hist_max,
+    double *min, double *max, uint32_t *nan_count, uint32_t *inf_count) {
+    RANGED_HIST_MINMAX_BODY(int16_t, ROWS_LOOP, COLS_LOOP)
+}
+
+void masked_ranged_hist_minmax_int16(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    const uint16_t *starts, const uint16_t *ends, uint32_t *histogram, uint16_t n_bins, double hist_min, double hist_max,
+    double *min, double *max, uint32_t *nan_count, uint32_t *inf_count) {
+    RANGED_HIST_MINMAX_BODY(int16_t, MASKED_ROWS_LOOP, MASKED_COLS_LOOP)
+}
+
+void minmax_int32(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    double *min, double *max, uint32_t *nan_count, uint32_t *inf_count) {
+    MINMAX_BODY(int32_t, ROWS_LOOP, COLS_LOOP)
+}
+
+void masked_minmax_int32(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    const uint16_t *starts, const uint16_t *ends, double *min, double *max, uint32_t *nan_count, uint32_t *inf_count) {
+    MINMAX_BODY(int32_t, MASKED_ROWS_LOOP, MASKED_COLS_LOOP)
+}
+
+void ranged_hist_int32(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    uint32_t *histogram, uint16_t n_bins, double hist_min, double hist_max) {
+    RANGED_HIST_BODY(int32_t, ROWS_LOOP, COLS_LOOP)
+}
+
+void masked_ranged_hist_int32(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    const uint16_t *starts, const uint16_t *ends, uint32_t *histogram, uint16_t n_bins, double hist_min, double hist_max) {
+    RANGED_HIST_BODY(int32_t, MASKED_ROWS_LOOP, MASKED_COLS_LOOP)
+}
+
+void ranged_hist_minmax_int32(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    uint32_t *histogram, uint16_t n_bins, double hist_min, double hist_max,
+    double *min, double *max, uint32_t *nan_count, uint32_t *inf_count) {
+    RANGED_HIST_MINMAX_BODY(int32_t, ROWS_LOOP, COLS_LOOP)
+}
+
+void masked_ranged_hist_minmax_int32(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    const uint16_t *starts, const uint16_t *ends, uint32_t *histogram, uint16_t n_bins, double hist_min, double hist_max,
+    double *min, double *max, uint32_t *nan_count, uint32_t *inf_count) {
+    RANGED_HIST_MINMAX_BODY(int32_t, MASKED_ROWS_LOOP, MASKED_COLS_LOOP)
+}
+
+void minmax_uint32(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    double *min, double *max, uint32_t *nan_count, uint32_t *inf_count) {
+    MINMAX_BODY(uint32_t, ROWS_LOOP, COLS_LOOP)
+}
+
+void masked_minmax_uint32(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    const uint16_t *starts, const uint16_t *ends, double *min, double *max, uint32_t *nan_count, uint32_t *inf_count) {
+    MINMAX_BODY(uint32_t, MASKED_ROWS_LOOP, MASKED_COLS_LOOP)
+}
+
+void ranged_hist_uint32(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    uint32_t *histogram, uint16_t n_bins, double hist_min, double hist_max) {
+    RANGED_HIST_BODY(uint32_t, ROWS_LOOP, COLS_LOOP)
+}
+
+void masked_ranged_hist_uint32(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    const uint16_t *starts, const uint16_t *ends, uint32_t *histogram, uint16_t n_bins, double hist_min, double hist_max) {
+    RANGED_HIST_BODY(uint32_t, MASKED_ROWS_LOOP, MASKED_COLS_LOOP)
+}
+
+void ranged_hist_minmax_uint32(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    uint32_t *histogram, uint16_t n_bins, double hist_min, double hist_max,
+    double *min, double *max, uint32_t *nan_count, uint32_t *inf_count) {
+    RANGED_HIST_MINMAX_BODY(uint32_t, ROWS_LOOP, COLS_LOOP)
+}
+
+void masked_ranged_hist_minmax_uint32(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    const uint16_t *starts, const uint16_t *ends, uint32_t *histogram, uint16_t n_bins, double hist_min, double hist_max,
+    double *min, double *max, uint32_t *nan_count, uint32_t *inf_count) {
+    RANGED_HIST_MINMAX_BODY(uint32_t, MASKED_ROWS_LOOP, MASKED_COLS_LOOP)
+}
+
+void minmax_double(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    double *min, double *max, uint32_t *nan_count, uint32_t *inf_count) {
+    MINMAX_BODY(double, ROWS_LOOP, COLS_LOOP)
+}
+
+void masked_minmax_double(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    const uint16_t *starts, const uint16_t *ends, double *min, double *max, uint32_t *nan_count, uint32_t *inf_count) {
+    MINMAX_BODY(double, MASKED_ROWS_LOOP, MASKED_COLS_LOOP)
+}
+
+void ranged_hist_double(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    uint32_t *histogram, uint16_t n_bins, double hist_min, double hist_max) {
+    RANGED_HIST_BODY(double, ROWS_LOOP, COLS_LOOP)
+}
+
+void masked_ranged_hist_double(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    const uint16_t *starts, const uint16_t *ends, uint32_t *histogram, uint16_t n_bins, double hist_min, double hist_max) {
+    RANGED_HIST_BODY(double, MASKED_ROWS_LOOP, MASKED_COLS_LOOP)
+}
+
+void ranged_hist_minmax_double(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    uint32_t *histogram, uint16_t n_bins, double hist_min, double hist_max,
+    double *min, double *max, uint32_t *nan_count, uint32_t *inf_count) {
+    RANGED_HIST_MINMAX_BODY(double, ROWS_LOOP, COLS_LOOP)
+}
+
+void masked_ranged_hist_minmax_double(const char *image, uint16_t rows, uint16_t cols, uint32_t r_stride, uint32_t c_stride,
+    const uint16_t *starts, const uint16_t *ends, uint32_t *histogram, uint16_t n_bins, double hist_min, double hist_max,
+    double *min, double *max, uint32_t *nan_count, uint32_t *inf_count) {
+    RANGED_HIST_MINMAX_BODY(double, MASKED_ROWS_LOOP, MASKED_COLS_LOOP)
+}
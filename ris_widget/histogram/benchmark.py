@@ -0,0 +1,55 @@
+# This code is licensed under the MIT License (see LICENSE file for details)
+
+import sys
+import time
+import numpy
+
+from . import histogram as _histogram_func
+
+# the package re-exports the histogram() function under the same name as its module
+_histogram_module = sys.modules[_histogram_func.__module__]
+
+def _test_images(size, dtype, image_bits):
+    max_val = 2**image_bits - 1
+    rng = numpy.random.default_rng(0)
+    flat = numpy.full(size, max_val // 20, dtype=dtype, order='F')
+    # dim fluorescence-like frame: low background with shot noise
+    noisy = numpy.asfortranarray(rng.poisson(max_val // 20, size).clip(0, max_val).astype(dtype))
+    saturated = numpy.asfortranarray(rng.integers(0, max_val + 1, size).astype(dtype))
+    saturated[:, :size[1]//2] = max_val
+    return dict(flat=flat, noisy=noisy, saturated=saturated)
+
+def _time(image, image_bits, mask_geometry, threads, contiguous, repeats):
+    old = _histogram_module.USE_CONTIGUOUS_KERNELS
+    _histogram_module.USE_CONTIGUOUS_KERNELS = contiguous
+    try:
+        _histogram_func(image, image_bits=image_bits, mask_geometry=mask_geometry, threads=threads)
+        times = []
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            _histogram_func(image, image_bits=image_bits, mask_geometry=mask_geometry, threads=threads)
+            times.append(time.perf_counter() - t0)
+    finally:
+        _histogram_module.USE_CONTIGUOUS_KERNELS = old
+    return min(times)
+
+def benchmark(size=(2560, 2160), repeats=10, threads=1):
+    """Compare the default scanline kernels against the unrolled *_contiguous kernels
+    on flat, noisy, and saturated uint8 and uint16 images, with and without a mask.
+    Prints the best-of-repeats time for each in milliseconds, and returns a list of
+    (dtype name, image name, masked, strided_ms, contiguous_ms) tuples."""
+    results = []
+    for dtype, image_bits in ((numpy.uint8, 8), (numpy.uint16, 12), (numpy.uint16, 16)):
+        bits_arg = image_bits if dtype == numpy.uint16 else None
+        dtype_name = '{}({} bit)'.format(numpy.dtype(dtype).name, image_bits)
+        for name, image in _test_images(size, dtype, image_bits).items():
+            for mask_geometry in (None, (0.5, 0.5, 0.5)):
+                strided = _time(image, bits_arg, mask_geometry, threads, False, repeats) * 1000
+                contiguous = _time(image, bits_arg, mask_geometry, threads, True, repeats) * 1000
+                results.append((dtype_name, name, mask_geometry is not None, strided, contiguous))
+                print('{:<16} {:<10} {:<8} strided: {:7.2f} ms  contiguous: {:7.2f} ms  ({:.2f}x)'.format(
+                    dtype_name, name, 'masked' if mask_geometry else '', strided, contiguous, strided / contiguous))
+    return results
+
+if __name__ == '__main__':
+    benchmark()
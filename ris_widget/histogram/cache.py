@@ -0,0 +1,70 @@
+# This code is licensed under the MIT License (see LICENSE file for details)
+
+import collections
+
+class HistogramCache:
+    """A bounded least-recently-used mapping from hashable keys (e.g. identifying an image, the
+    generation of its contents, and the histogram settings) to histogram results.
+
+    Cached results are shared between users: their arrays are made read-only when stored.
+    .hits and .misses count the lookups that have found, or not found, a result.
+    """
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self._entries = collections.OrderedDict()
+        # keys put once with copy_on_revisit, whose results have not been stored
+        self._seen_keys = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        # does not count as a lookup
+        return key in self._entries
+
+    def get(self, key):
+        """Return the result stored for key, or None if there is none."""
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value, copy_on_revisit=False):
+        """Store value (a tuple, some of whose elements may be numpy arrays) for key, discarding the
+        least recently used results beyond maxsize.
+
+        If copy_on_revisit, value's arrays are buffers that the caller will reuse. The first time such
+        a key is put, it is only remembered (among the last maxsize such keys); the second time, a copy
+        of value is stored. Results that are never calculated again (e.g. those of the frames of a live
+        stream) are thus never copied.
+        """
+        if self.maxsize <= 0:
+            return
+        if copy_on_revisit:
+            if key not in self._seen_keys:
+                self._seen_keys[key] = None
+                while len(self._seen_keys) > self.maxsize:
+                    self._seen_keys.popitem(last=False)
+                return
+            del self._seen_keys[key]
+            elements = [element.copy() if hasattr(element, 'flags') else element for element in value]
+            value = value._make(elements) if hasattr(value, '_make') else tuple(elements)
+        for element in value:
+            if hasattr(element, 'flags'):
+                element.flags.writeable = False
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """Discard all results (and remembered keys) and reset the hit and miss counts."""
+        self._entries.clear()
+        self._seen_keys.clear()
+        self.hits = self.misses = 0
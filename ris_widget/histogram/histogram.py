@@ -1,29 +1,106 @@
 # This code is licensed under the MIT License (see LICENSE file for details)
 
+import collections
+import concurrent.futures as futures
 import functools
+import multiprocessing
+import threading
 import numpy
 
 from . import _histogram
+from . import masks
 
-_mn = _histogram.ffi.new('uint8_t *')
-_mx = _histogram.ffi.new('uint8_t *')
-_mn16 = _histogram.ffi.new('uint16_t *')
-_mx16 = _histogram.ffi.new('uint16_t *')
-_mnf = _histogram.ffi.new('float *')
-_mxf = _histogram.ffi.new('float *')
+# Number of threads histogram() uses when its threads argument is None. The C kernels are
+# called through cffi, which releases the GIL for the duration of each call, so the
+# scanlines of a large image can be binned concurrently.
+DEFAULT_THREADS = max(1, min(8, multiprocessing.cpu_count() - 1))
+# Images with fewer pixels than this per thread are not worth splitting up.
+MIN_PIXELS_PER_THREAD = 2**18
+# If True, unranged uint8/uint16 histograms of images whose rows are contiguous in memory
+# use the unrolled *_contiguous kernels, which bin into several sub-histograms at once.
+USE_CONTIGUOUS_KERNELS = True
+
+# Images of these types are binned, by default, over the whole range of values that they can hold
+# (for uint16, as limited by image_bits). Images of the other supported types (float32, float64, int16,
+# int32, and uint32) are instead binned over the range of values that they do hold, found in a first
+# pass over the image.
+FIXED_RANGE_DTYPES = (numpy.bool8, numpy.uint8, numpy.uint16)
 
 _int_hists = {
-    # dtype, ranged, masked: (hist_func, min_var, max_var)
-    (numpy.uint16, False, False): (_histogram.lib.hist_uint16, _mn16, _mx16),
-    (numpy.uint8, False, False): (_histogram.lib.hist_uint8, _mn, _mx),
-    (numpy.uint16, False, True): (_histogram.lib.masked_hist_uint16, _mn16, _mx16),
-    (numpy.uint8, False, True): (_histogram.lib.masked_hist_uint8, _mn, _mx),
-    (numpy.uint16, True, True): (_histogram.lib.masked_ranged_hist_uint16, _mn16, _mx16),
-    (numpy.uint8, True, True): (_histogram.lib.masked_ranged_hist_uint8, _mn, _mx),
-    (numpy.uint16, True, False): (_histogram.lib.ranged_hist_uint16, _mn16, _mx16),
-    (numpy.uint8, True, False): (_histogram.lib.ranged_hist_uint8, _mn, _mx),
+    # dtype, ranged, masked: (hist_func, min/max ctype)
+    (numpy.uint16, False, False): (_histogram.lib.hist_uint16, 'uint16_t *'),
+    (numpy.uint8, False, False): (_histogram.lib.hist_uint8, 'uint8_t *'),
+    (numpy.uint16, False, True): (_histogram.lib.masked_hist_uint16, 'uint16_t *'),
+    (numpy.uint8, False, True): (_histogram.lib.masked_hist_uint8, 'uint8_t *'),
+    (numpy.uint16, True, True): (_histogram.lib.masked_ranged_hist_uint16, 'uint16_t *'),
+    (numpy.uint8, True, True): (_histogram.lib.masked_ranged_hist_uint8, 'uint8_t *'),
+    (numpy.uint16, True, False): (_histogram.lib.ranged_hist_uint16, 'uint16_t *'),
+    (numpy.uint8, True, False): (_histogram.lib.ranged_hist_uint8, 'uint8_t *'),
+}
+
+_contiguous_hists = {
+    # dtype, masked: hist_func
+    (numpy.uint16, False): _histogram.lib.hist_uint16_contiguous,
+    (numpy.uint8, False): _histogram.lib.hist_uint8_contiguous,
+    (numpy.uint16, True): _histogram.lib.masked_hist_uint16_contiguous,
+    (numpy.uint8, True): _histogram.lib.masked_hist_uint8_contiguous,
+}
+
+_rgb_hists = {
+    # dtype, ranged, masked: hist_func
+    (numpy.uint16, False, False): _histogram.lib.hist_rgb_uint16,
+    (numpy.uint8, False, False): _histogram.lib.hist_rgb_uint8,
+    (numpy.uint16, False, True): _histogram.lib.masked_hist_rgb_uint16,
+    (numpy.uint8, False, True): _histogram.lib.masked_hist_rgb_uint8,
+    (numpy.uint16, True, False): _histogram.lib.ranged_hist_rgb_uint16,
+    (numpy.uint8, True, False): _histogram.lib.ranged_hist_rgb_uint8,
+    (numpy.uint16, True, True): _histogram.lib.masked_ranged_hist_rgb_uint16,
+    (numpy.uint8, True, True): _histogram.lib.masked_ranged_hist_rgb_uint8,
+}
+
+_stack_hists = {
+    # dtype, ranged: (hist_func, min/max dtype)
+    (numpy.uint16, False): (_histogram.lib.hist_stack_uint16, numpy.uint16),
+    (numpy.uint8, False): (_histogram.lib.hist_stack_uint8, numpy.uint8),
+    (numpy.uint16, True): (_histogram.lib.ranged_hist_stack_uint16, numpy.uint16),
+    (numpy.uint8, True): (_histogram.lib.ranged_hist_stack_uint8, numpy.uint8),
+}
+
+_range_hists = {
+    # dtype, masked: (minmax_func, ranged_hist_func, fused ranged_hist_minmax_func, min/max ctype)
+    (numpy.float32, False): (_histogram.lib.minmax_float, _histogram.lib.ranged_hist_float, _histogram.lib.ranged_hist_minmax_float, 'float *'),
+    (numpy.float32, True): (_histogram.lib.masked_minmax_float, _histogram.lib.masked_ranged_hist_float, _histogram.lib.masked_ranged_hist_minmax_float, 'float *'),
+    (numpy.float64, False): (_histogram.lib.minmax_double, _histogram.lib.ranged_hist_double, _histogram.lib.ranged_hist_minmax_double, 'double *'),
+    (numpy.float64, True): (_histogram.lib.masked_minmax_double, _histogram.lib.masked_ranged_hist_double, _histogram.lib.masked_ranged_hist_minmax_double, 'double *'),
+    (numpy.int16, False): (_histogram.lib.minmax_int16, _histogram.lib.ranged_hist_int16, _histogram.lib.ranged_hist_minmax_int16, 'double *'),
+    (numpy.int16, True): (_histogram.lib.masked_minmax_int16, _histogram.lib.masked_ranged_hist_int16, _histogram.lib.masked_ranged_hist_minmax_int16, 'double *'),
+    (numpy.int32, False): (_histogram.lib.minmax_int32, _histogram.lib.ranged_hist_int32, _histogram.lib.ranged_hist_minmax_int32, 'double *'),
+    (numpy.int32, True): (_histogram.lib.masked_minmax_int32, _histogram.lib.masked_ranged_hist_int32, _histogram.lib.masked_ranged_hist_minmax_int32, 'double *'),
+    (numpy.uint32, False): (_histogram.lib.minmax_uint32, _histogram.lib.ranged_hist_uint32, _histogram.lib.ranged_hist_minmax_uint32, 'double *'),
+    (numpy.uint32, True): (_histogram.lib.masked_minmax_uint32, _histogram.lib.masked_ranged_hist_uint32, _histogram.lib.masked_ranged_hist_minmax_uint32, 'double *'),
 }
 
+HistogramStatistics = collections.namedtuple('HistogramStatistics', ('min', 'max', 'histogram', 'nan_count', 'inf_count', 'channel_histograms'))
+
+HistogramStackStatistics = collections.namedtuple('HistogramStackStatistics', ('mins', 'maxs', 'histograms', 'min', 'max', 'histogram', 'nan_counts', 'inf_counts'))
+
+_thread_pool = None
+def _get_thread_pool():
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = futures.ThreadPoolExecutor(max_workers=multiprocessing.cpu_count())
+    return _thread_pool
+
+_thread_local = threading.local()
+def _exact_scratch():
+    # Per-thread buffer with one counter per possible uint8/uint16 value. It is all zeros
+    # between uses: callers must zero whatever bins they have counted into.
+    try:
+        return _thread_local.exact_scratch
+    except AttributeError:
+        _thread_local.exact_scratch = numpy.zeros(2**16, dtype=numpy.uint32)
+        return _thread_local.exact_scratch
+
 def _scanline_bounds(cx, cy, r):
     # based on 8-connected super-circle algorithm from comments in http://www.willperone.net/Code/codecircle.php
     # and:
@@ -68,11 +145,75 @@ def _circle_mask(cx, cy, r, image_shape):
 def _fast_index_first(image):
     image = numpy.asarray(image)
     if image.strides[0] > image.strides[1]:
-        return image.T, True
+        return image.swapaxes(0, 1), True
     else:
         return image, False
 
-def histogram(image, range=(None, None), image_bits=None, mask_geometry=None):
+def _row_chunks(rows, threads, cols, starts=None, ends=None):
+    """Split [0, rows) into at most threads contiguous (start, end) row ranges.
+    For masked images, every chunk after the first begins on a row with a non-empty
+    span, because the masked kernels seed their min/max from the first pixel of the
+    first row they are given."""
+    threads = max(1, min(threads, rows * cols // MIN_PIXELS_PER_THREAD))
+    if threads == 1:
+        return [(0, rows)]
+    if starts is None:
+        candidates = numpy.arange(1, rows)
+    else:
+        candidates = numpy.flatnonzero(ends[1:] > starts[1:]) + 1
+    if len(candidates) == 0:
+        return [(0, rows)]
+    boundaries = numpy.linspace(0, rows, threads + 1)[1:-1]
+    splits = numpy.unique(candidates[numpy.searchsorted(candidates, boundaries).clip(0, len(candidates)-1)])
+    bounds = [0] + splits.tolist() + [rows]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def _layer_chunks(layers, threads):
+    """Divide the rows of each (i, starts, ends) layer among threads, returning a list of
+    (i, starts, ends, r0, r1) chunks for _chunk_args."""
+    chunks = []
+    for layer_i, starts, ends in layers:
+        chunks += [(layer_i, starts, ends, r0, r1) for r0, r1 in _row_chunks(layer_i.shape[1], threads, layer_i.shape[0], starts, ends)]
+    return chunks
+
+def _chunk_args(chunk):
+    i, starts, ends, r0, r1 = chunk
+    args = [_histogram.ffi.cast('char *', i.ctypes.data + r0*i.strides[1]), r1 - r0, i.shape[0], i.strides[1], i.strides[0]]
+    if starts is not None:
+        args.append(_histogram.ffi.cast('uint16_t *', starts[r0:].ctypes.data))
+        args.append(_histogram.ffi.cast('uint16_t *', ends[r0:].ctypes.data))
+    return args
+
+def _subsampled_layer(i, subsample, ymin, ymax, starts, ends):
+    """Return the (i, starts, ends) layer of the pixels of the span layer at every subsample-th
+    row and column of i, or None if the layer includes no such pixels. Row and column
+    indices are taken on a grid aligned with i[0, 0], so all layers sample the same pixels."""
+    if subsample == 1:
+        return i[:,ymin:ymax], starts, ends
+    rows = numpy.arange(-(-ymin // subsample) * subsample, ymax, subsample)
+    # x is sampled if start <= x < end and x % subsample == 0
+    starts = -(-starts[rows - ymin].astype(numpy.int64) // subsample)
+    ends = -(-ends[rows - ymin].astype(numpy.int64) // subsample)
+    nonempty = numpy.flatnonzero(ends > starts)
+    if len(nonempty) == 0:
+        return None
+    # trim empty rows from either end: the masked kernels seed their min/max from the first row
+    first, last = nonempty[0], nonempty[-1] + 1
+    starts = starts[first:last].astype(numpy.uint16)
+    ends = ends[first:last].astype(numpy.uint16)
+    return i[::subsample, rows[first]:rows[last-1]+1:subsample], starts, ends
+
+def _map_chunks(func, chunks):
+    """Call func(chunk) for each chunk, using the thread pool for all but the last
+    chunk, which runs on the calling thread."""
+    if len(chunks) == 1:
+        return [func(chunks[0])]
+    pool = _get_thread_pool()
+    pending = [pool.submit(func, chunk) for chunk in chunks[:-1]]
+    last = func(chunks[-1])
+    return [future.result() for future in pending] + [last]
+
+def histogram(image, range=(None, None), image_bits=None, mask_geometry=None, threads=None, bins=None, out=None, range_hint=None, subsample=None):
     """
     image: 2-dimensional greyscale image, or GA, RGB, or RGBA image in (x, y, c) index order.
         If RGB(A), the RGB channels will be converted to greyscale first. Alpha channels are ignored.
@@ -80,20 +221,56 @@ def histogram(image, range=(None, None), image_bits=None, mask_geometry=None):
     image_bits: only applies to uint16 images. If None, images are assumed to occupy full 16-bit range.
     mask_geometry: (cx, cy, radius) of a vignette mask, as fractions of image.shape.
         (cx and radius will be in terms of image.shape[0], cy in terms of image.shape[1])
+        Alternately, a masks.SpanMask (RectMask, EllipseMask, PolygonMask, or BitmapMask) in
+        pixel coordinates. If the mask covers no pixels of the image, ValueError is raised.
+    threads: number of threads across which the image's scanlines are divided, each
+        binning into a private histogram; the per-thread results are summed, so the
+        result is identical to that of a single-threaded run. If None, DEFAULT_THREADS
+        is used. Small images are always processed on a single thread.
+    bins: if None, uint8 images are binned into 256 bins and images of other types into 1024.
+        If 'exact', bool, uint8, and uint16 images get one bin per value from the low to the high end
+        of range (by default, 0 to 2**image_bits - 1 for uint16 images). Not supported for other types.
+    out: optional uint32 array into which the histogram is written (and which is returned), so
+        that repeated calls need not allocate a new one. Only supported with bins='exact'; it must
+        have the number of bins that range and image_bits imply.
+    range_hint: for images not of FIXED_RANGE_DTYPES (e.g. float32 images), a guess at the (min, max)
+        of the image (e.g. that of the previous frame of a movie) used for any part of range that is None.
+        If the guess proves correct, the min, max, and histogram are computed in a single pass over the
+        image. When range is fully specified, a single pass is always used.
+    subsample: if an integer greater than 1, only the pixels at every subsample-th row and column
+        (starting from image[0, 0]) are binned, giving a fast approximation of the histogram, min,
+        and max of a large image. The histogram then counts only the sampled pixels.
     returns: min, max, hist
-        min, max: image min and max values (possibly outside the range, if specified)
+        min, max: image min and max values (possibly outside the range, if specified).
+            NaN and Inf pixels in float32 and float64 images are not counted in min, max, or hist.
         hist: histogram
     """
+    return histogram_statistics(image, range, image_bits, mask_geometry, threads, bins, out, range_hint, subsample)[:3]
+
+def histogram_statistics(image, range=(None, None), image_bits=None, mask_geometry=None, threads=None, bins=None, out=None, range_hint=None, subsample=None):
+    """As histogram(), but returns a HistogramStatistics namedtuple of
+    (min, max, histogram, nan_count, inf_count, channel_histograms), where:
+        nan_count and inf_count are the numbers of NaN and +/-Inf pixels in a float32 or float64 image
+            (always 0 for other types). If a floating-point image has no finite pixels, min and max are NaN.
+        channel_histograms is None for grayscale images, and for RGB(A) images is a
+            (3, n_bins) array of the R, G, and B histograms, binned as the (luma) histogram is.
+    uint8 and uint16 RGB(A) histograms (other than exact ones) are computed in a single pass over
+    the interleaved pixels, with luma approximated in integer arithmetic. Otherwise, luma is
+    calculated as a separate image (in the same integer arithmetic, for uint8 and uint16 images)
+    and histogrammed, and then each channel is histogrammed over the range that luma was."""
     image = numpy.asarray(image)
-    assert image.dtype.type in {numpy.bool8, numpy.uint8, numpy.uint16, numpy.float32}
+    assert image.dtype.type in FIXED_RANGE_DTYPES or (image.dtype.type, False) in _range_hists
+    rgb_kernel = False
+    channel_histograms = None
     if image.ndim == 3:
         if image.shape[2] in (3, 4): # RGB/RGBA
-            r, g, b = numpy.rollaxis(image, -1)[:3]
-            luma = 0.2126*r + 0.7152*g + 0.0722*b # use CIE 1931 linear luminance
-            image = luma.astype(image.dtype)
+            if bins is None and image.dtype.type in (numpy.uint8, numpy.uint16) and image.strides[2] == image.itemsize:
+                rgb_kernel = True
+            else:
+                return _rgb_histogram_statistics(image, range, image_bits, mask_geometry, threads, bins, out, range_hint, subsample)
         elif image.shape[2] == 2: # GA
             image = image[:,:,0]
-    if image.ndim != 2:
+    if image.ndim != 2 and not rgb_kernel:
         raise ValueError('Only 2D, GA, RGB, and RGBA images are supported')
 
     if image.dtype == numpy.bool8:
@@ -108,53 +285,154 @@ def histogram(image, range=(None, None), image_bits=None, mask_geometry=None):
 
     i, transpose = _fast_index_first(image)
     if masked:
-        # multiply cx, cy, and r by the shape of the original image
-        cx, cy, r = (numpy.array(mask_geometry) * [image.shape[0], image.shape[1], image.shape[0]]).astype(int)
-        if transpose:
-            cx, cy = cy, cx
-        ymin, ymax, starts, ends = _circle_mask(cx, cy, r, i.shape)
-        if ymin is None:
+        if isinstance(mask_geometry, masks.SpanMask):
+            span_layers = mask_geometry.span_layers(i.shape[:2], transpose)
+        else:
+            # multiply cx, cy, and r by the shape of the original image
+            cx, cy, r = (numpy.array(mask_geometry) * [image.shape[0], image.shape[1], image.shape[0]]).astype(int)
+            if transpose:
+                cx, cy = cy, cx
+            ymin, ymax, starts, ends = _circle_mask(cx, cy, r, i.shape[:2])
+            span_layers = None if ymin is None else [(ymin, ymax, starts, ends)]
+        if span_layers is None:
             # mask is whole region
             masked = False
-        else:
-            i = i[:,ymin:ymax]
-    args = [_histogram.ffi.cast('char *', i.ctypes.data), i.shape[1], i.shape[0], i.strides[1], i.strides[0]]
+        elif len(span_layers) == 0:
+            raise ValueError('mask_geometry does not cover any pixels of the image')
+    if subsample is None:
+        subsample = 1
     if masked:
-        sp = _histogram.ffi.cast('uint16_t *', starts.ctypes.data)
-        ep = _histogram.ffi.cast('uint16_t *', ends.ctypes.data)
-        args += [sp, ep]
+        # Rows with several spans (e.g. of a concave polygon) are binned one span at a time:
+        # each layer of the span table holds at most one span per row.
+        layers = [_subsampled_layer(i, subsample, *span_layer) for span_layer in span_layers]
+        layers = [layer for layer in layers if layer is not None]
+        if len(layers) == 0:
+            raise ValueError('mask_geometry does not cover any of the sampled pixels of the image')
+    else:
+        layers = [(i[::subsample, ::subsample], None, None)]
+    if threads is None:
+        threads = DEFAULT_THREADS
+    chunks = _layer_chunks(layers, threads)
+    contiguous = all(layer_i.strides[0] == layer_i.itemsize for layer_i, starts, ends in layers)
+
+    if bins == 'exact':
+        if image.dtype.type not in FIXED_RANGE_DTYPES:
+            raise ValueError("bins='exact' is only supported for bool, uint8, and uint16 images")
+        if was_bool:
+            valid_max = 1
+        elif image.dtype == numpy.uint8:
+            valid_max = 255
+        else:
+            valid_max = 2**16 - 1 if image_bits is None else 2**image_bits - 1
+        r_min = 0 if r_min is None else int(r_min)
+        r_max = valid_max if r_max is None else int(r_max)
+        if not 0 <= r_min <= r_max <= valid_max:
+            raise ValueError('range must lie within [0, {}]'.format(valid_max))
+        n_bins = r_max - r_min + 1
+        if out is None:
+            out = numpy.zeros(n_bins, dtype=numpy.uint32)
+        else:
+            if out.dtype != numpy.uint32 or out.shape != (n_bins,):
+                raise ValueError('out must be a uint32 array of shape ({},)'.format(n_bins))
+            out.fill(0)
+        # Count every value into a (thread-local, preallocated) 65536-bin scratch histogram with the
+        # unshifted, unranged kernels, then add the requested bins to out.
+        hist_func, minmax_type = _int_hists[(image.dtype.type, False, masked)]
+        if USE_CONTIGUOUS_KERNELS and contiguous and image.dtype != numpy.uint16:
+            # (the uint16 contiguous kernels allocate 65536-bin sub-histograms per call, whereas the
+            # plain kernels count straight into the scratch histogram)
+            hist_func = _contiguous_hists[(image.dtype.type, masked)]
+        extra_args = [0] if image.dtype == numpy.uint16 else []
+        out_lock = threading.Lock()
+        def chunk_hist(chunk):
+            scratch = _exact_scratch()
+            mn = _histogram.ffi.new(minmax_type)
+            mx = _histogram.ffi.new(minmax_type)
+            hist_func(*_chunk_args(chunk), _histogram.ffi.cast('uint32_t *', scratch.ctypes.data), *extra_args, mn, mx)
+            lo, hi = max(r_min, mn[0]), min(r_max, mx[0])
+            if lo <= hi:
+                with out_lock:
+                    out[lo-r_min:hi-r_min+1] += scratch[lo:hi+1]
+            scratch[mn[0]:mx[0]+1] = 0
+            return mn[0], mx[0]
+        mins, maxs = zip(*_map_chunks(chunk_hist, chunks))
+        return HistogramStatistics(min(mins), max(maxs), out, 0, 0, channel_histograms)
+    elif bins is not None:
+        raise ValueError("bins must be None or 'exact'")
+    if out is not None:
+        raise ValueError("out is only supported with bins='exact'")
 
     if image.dtype == numpy.uint8:
-        hist = numpy.zeros(256, dtype=numpy.uint32)
+        n_bins = 256
     else:
-        hist = numpy.zeros(1024, dtype=numpy.uint32)
-    args.append(_histogram.ffi.cast('uint32_t *', hist.ctypes.data))
-
-    if image.dtype == numpy.float32:
-        mn, mx = _mnf, _mxf
-        if masked:
-            minmax_func = _histogram.lib.masked_minmax_float
-            hist_func = _histogram.lib.masked_ranged_hist_float
+        n_bins = 1024
+
+    if image.dtype.type not in FIXED_RANGE_DTYPES:
+        minmax_func, hist_func, fused_func, minmax_type = _range_hists[(image.dtype.type, masked)]
+        def new_stats():
+            return _histogram.ffi.new(minmax_type), _histogram.ffi.new(minmax_type), _histogram.ffi.new('uint32_t *'), _histogram.ffi.new('uint32_t *')
+        def chunk_minmax(chunk):
+            stats = new_stats()
+            minmax_func(*_chunk_args(chunk), *stats)
+            return tuple(stat[0] for stat in stats)
+        def chunk_hist(chunk):
+            hist = numpy.zeros(n_bins, dtype=numpy.uint32)
+            hist_func(*_chunk_args(chunk), _histogram.ffi.cast('uint32_t *', hist.ctypes.data), n_bins, r_min, r_max)
+            return hist
+        def chunk_fused(chunk):
+            hist = numpy.zeros(n_bins, dtype=numpy.uint32)
+            stats = new_stats()
+            fused_func(*_chunk_args(chunk), _histogram.ffi.cast('uint32_t *', hist.ctypes.data), n_bins, r_min, r_max, *stats)
+            return tuple(stat[0] for stat in stats) + (hist,)
+        guess_min = r_min is None and range_hint is not None
+        guess_max = r_max is None and range_hint is not None
+        if guess_min:
+            r_min = range_hint[0]
+        if guess_max:
+            r_max = range_hint[1]
+        if r_min is not None and r_max is not None:
+            # Single pass: min, max, NaN/Inf counts, and the histogram over the known or guessed range
+            mins, maxs, nans, infs, hists = zip(*_map_chunks(chunk_fused, chunks))
+            mn, mx, nan_count, inf_count, hist = min(mins), max(maxs), sum(nans), sum(infs), sum(hists)
+            if (guess_min and mn != r_min) or (guess_max and mx != r_max):
+                # the guessed range was wrong: bin again over the actual range
+                if guess_min:
+                    r_min = mn
+                if guess_max:
+                    r_max = mx
+                hist = sum(_map_chunks(chunk_hist, chunks))
         else:
-            minmax_func = _histogram.lib.minmax_float
-            hist_func = _histogram.lib.ranged_hist_float
-        minmax_args = args[:-1] + [mn, mx] # ditch the hist pointer, and add the min and max pointers
-        minmax_func(*minmax_args)
-        if r_min is None:
-            r_min = mn[0]
-        if r_max is None:
-            r_max = mx[0]
-        args += [len(hist), r_min, r_max]
+            mins, maxs, nans, infs = zip(*_map_chunks(chunk_minmax, chunks))
+            mn, mx, nan_count, inf_count = min(mins), max(maxs), sum(nans), sum(infs)
+            if r_min is None:
+                r_min = mn
+            if r_max is None:
+                r_max = mx
+            hist = sum(_map_chunks(chunk_hist, chunks))
+        if mn > mx:
+            # no finite pixels
+            mn = mx = numpy.nan
+        elif numpy.issubdtype(image.dtype, numpy.integer):
+            mn, mx = int(mn), int(mx)
+        return HistogramStatistics(mn, mx, hist, nan_count, inf_count, channel_histograms)
     else: # integral type image
-        hist_func, mn, mx = _int_hists[(image.dtype.type, ranged, masked)]
+        hist_func, minmax_type = _int_hists[(image.dtype.type, ranged, masked)]
+        hist_shape = n_bins
+        if rgb_kernel:
+            # luma, R, G, B
+            hist_func = _rgb_hists[(image.dtype.type, ranged, masked)]
+            hist_shape = 4, n_bins
+        elif USE_CONTIGUOUS_KERNELS and not ranged and contiguous:
+            hist_func = _contiguous_hists[(image.dtype.type, masked)]
+        extra_args = []
         if image.dtype == numpy.uint16:
             if image_bits is None:
                 image_bits = 16
             if ranged:
-                args.append(len(hist)) # nbins arg
+                extra_args.append(n_bins)
             else:
                 assert image_bits >= 10
-                args.append(image_bits - 10) # bit shift arg
+                extra_args.append(image_bits - 10) # bit shift arg
         if ranged:
             if r_min is None:
                 r_min = 0
@@ -163,11 +441,202 @@ def histogram(image, range=(None, None), image_bits=None, mask_geometry=None):
                     r_max = 255
                 else:
                     r_max = 2**image_bits - 1
-            args += [int(r_min), int(r_max)]
-        args += [mn, mx]
-    hist_func(*args)
+            extra_args += [int(r_min), int(r_max)]
+        def chunk_hist(chunk):
+            hist = numpy.zeros(hist_shape, dtype=numpy.uint32)
+            mn = _histogram.ffi.new(minmax_type)
+            mx = _histogram.ffi.new(minmax_type)
+            hist_func(*_chunk_args(chunk), _histogram.ffi.cast('uint32_t *', hist.ctypes.data), *extra_args, mn, mx)
+            return mn[0], mx[0], hist
+        mins, maxs, hists = zip(*_map_chunks(chunk_hist, chunks))
+        mn, mx, hist = min(mins), max(maxs), sum(hists)
+        if rgb_kernel:
+            hist, channel_histograms = hist[0], hist[1:]
     if was_bool:
         hist = hist[:2]
         r_min, r_max = bool(r_min), bool(r_max)
-    return mn[0], mx[0], hist
+    return HistogramStatistics(mn, mx, hist, 0, 0, channel_histograms)
 
+def _rgb_histogram_statistics(image, range, image_bits, mask_geometry, threads, bins, out, range_hint, subsample):
+    # histogram_statistics of an RGB(A) image that the RGB kernels do not handle: luma is histogrammed as a
+    # grayscale image, and then each channel over the range that luma was binned over
+    r, g, b = numpy.rollaxis(image, -1)[:3]
+    if image.dtype.type in (numpy.uint8, numpy.uint16):
+        # the RGB kernels' integer approximation of luma, which (unlike a float64 temporary) fits in uint32
+        luma = numpy.multiply(r, 13933, dtype=numpy.uint32)
+        luma += numpy.multiply(g, 46871, dtype=numpy.uint32)
+        luma += numpy.multiply(b, 4732, dtype=numpy.uint32)
+        luma >>= 16
+        luma = luma.astype(image.dtype)
+    else:
+        luma = (0.2126*r + 0.7152*g + 0.0722*b).astype(image.dtype) # use CIE 1931 linear luminance
+    stats = histogram_statistics(luma, range, image_bits, mask_geometry, threads, bins, out, range_hint, subsample)
+    r_min, r_max = range
+    if image.dtype.type not in FIXED_RANGE_DTYPES and not numpy.isnan([stats.min, stats.max]).any():
+        # luma was binned over its own min and max where range is None
+        if r_min is None:
+            r_min = stats.min
+        if r_max is None:
+            r_max = stats.max
+    channel_histograms = numpy.array([histogram_statistics(image[:,:,c], (r_min, r_max), image_bits, mask_geometry, threads, bins,
+        subsample=subsample).histogram for c in (0, 1, 2)])
+    return stats._replace(channel_histograms=channel_histograms)
+
+def histogram_percentiles(hist, hist_min, hist_max, percentiles):
+    """Estimate the values at the given percentiles of the data counted in hist.
+
+    hist: histogram whose bins evenly divide the interval [hist_min, hist_max]
+    percentiles: iterable of percentiles in [0, 100]
+    returns: list of values, linearly interpolated within the bin containing each
+        percentile. No pass over the original data is required.
+    """
+    hist = numpy.asarray(hist)
+    cumulative = numpy.cumsum(hist, dtype=numpy.uint64)
+    total = int(cumulative[-1])
+    bin_width = (hist_max - hist_min) / len(hist)
+    values = []
+    for percentile in percentiles:
+        target = percentile / 100 * total
+        if total == 0 or target <= 0:
+            # the lower edge of the first non-empty bin (or hist_min for an empty histogram)
+            nonzero = numpy.flatnonzero(hist)
+            bin = nonzero[0] if len(nonzero) else 0
+            values.append(hist_min + bin * bin_width)
+            continue
+        bin = min(int(numpy.searchsorted(cumulative, target)), len(hist) - 1)
+        below = int(cumulative[bin - 1]) if bin > 0 else 0
+        fraction = (target - below) / hist[bin]
+        values.append(hist_min + (bin + fraction) * bin_width)
+    return values
+
+
+def _stack_args(views):
+    # returns the image pointer and geometry arguments of the *_stack kernels, and the arrays that must
+    # be kept alive while they are in use
+    pointers = _histogram.ffi.new('char *[]', [_histogram.ffi.cast('char *', v.ctypes.data) for v in views])
+    rows = numpy.array([v.shape[1] for v in views], dtype=numpy.uint16)
+    cols = numpy.array([v.shape[0] for v in views], dtype=numpy.uint16)
+    r_strides = numpy.array([v.strides[1] for v in views], dtype=numpy.uint32)
+    c_strides = numpy.array([v.strides[0] for v in views], dtype=numpy.uint32)
+    args = [pointers, len(views), _histogram.ffi.cast('uint16_t *', rows.ctypes.data), _histogram.ffi.cast('uint16_t *', cols.ctypes.data),
+        _histogram.ffi.cast('uint32_t *', r_strides.ctypes.data), _histogram.ffi.cast('uint32_t *', c_strides.ctypes.data)]
+    return args, (rows, cols, r_strides, c_strides)
+
+def _uint32_ptr(a):
+    return _histogram.ffi.cast('uint32_t *', a.ctypes.data)
+
+def histogram_stack(images, range=(None, None), image_bits=None, mask_geometry=None, threads=None):
+    """Histogram every image of a stack, e.g. the pages of a Flipbook, to find a display range for all of them.
+
+    images: list of images of the same dtype, or an array of images indexed (image, x, y[, c])
+    range, image_bits, mask_geometry: as for histogram(), applying to every image
+    threads: number of threads across which the images are divided. If None, DEFAULT_THREADS is used.
+    returns: a HistogramStackStatistics namedtuple of
+        (mins, maxs, histograms, min, max, histogram, nan_counts, inf_counts), where:
+        mins, maxs: arrays of the min and max of each image
+        histograms: (n_images, n_bins) array of the histogram of each image. All images are binned alike
+            (images not of FIXED_RANGE_DTYPES over range, or over the min and max of the whole stack where
+            range is None), so that the histograms may be compared and summed.
+        min, max, histogram: min, max, and (summed) histogram of the whole stack
+        nan_counts, inf_counts: arrays of the number of NaN and +/-Inf pixels in each float32 or float64 image
+
+    Unmasked 2D uint8, uint16, and float32 stacks are binned by C kernels that process a whole
+    group of images per call, with a group per thread. Other stacks are histogrammed one image
+    at a time with histogram_statistics()."""
+    images = [numpy.asarray(image) for image in images]
+    if len(images) == 0:
+        raise ValueError('images must not be empty')
+    dtype = images[0].dtype
+    if any(image.dtype != dtype for image in images):
+        raise ValueError('All images must be of the same dtype')
+    range = tuple(range)
+    if threads is None:
+        threads = DEFAULT_THREADS
+    if mask_geometry is not None or dtype.type not in (numpy.bool8, numpy.uint8, numpy.uint16, numpy.float32) or any(image.ndim != 2 for image in images):
+        return _histogram_stack_by_image(images, range, image_bits, mask_geometry, threads)
+
+    was_bool = dtype == numpy.bool8
+    views = [_fast_index_first(image.view(numpy.uint8) if was_bool else image)[0] for image in images]
+    n_images = len(views)
+    n_pixels = sum(v.size for v in views)
+    threads = max(1, min(threads, n_images, n_pixels // MIN_PIXELS_PER_THREAD))
+    bounds = numpy.linspace(0, n_images, threads + 1).round().astype(int)
+    groups = list(zip(bounds[:-1], bounds[1:]))
+    n_bins = 256 if views[0].dtype == numpy.uint8 else 1024
+    histograms = numpy.zeros((n_images, n_bins), dtype=numpy.uint32)
+    nan_counts = numpy.zeros(n_images, dtype=numpy.uint32)
+    inf_counts = numpy.zeros(n_images, dtype=numpy.uint32)
+    r_min, r_max = range
+
+    if dtype == numpy.float32:
+        mins = numpy.empty(n_images, dtype=numpy.float32)
+        maxs = numpy.empty(n_images, dtype=numpy.float32)
+        def group_minmax(group):
+            k0, k1 = group
+            args, keep_alive = _stack_args(views[k0:k1])
+            _histogram.lib.minmax_stack_float(*args, _histogram.ffi.cast('float *', mins[k0:].ctypes.data),
+                _histogram.ffi.cast('float *', maxs[k0:].ctypes.data), _uint32_ptr(nan_counts[k0:]), _uint32_ptr(inf_counts[k0:]))
+        _map_chunks(group_minmax, groups)
+        # images without finite pixels have min > max
+        no_finite = mins > maxs
+        mins[no_finite] = maxs[no_finite] = numpy.nan
+        mn, mx = (numpy.nan, numpy.nan) if no_finite.all() else (numpy.nanmin(mins), numpy.nanmax(maxs))
+        if r_min is None:
+            r_min = mn
+        if r_max is None:
+            r_max = mx
+        if not numpy.isnan([r_min, r_max]).any():
+            def group_hist(group):
+                k0, k1 = group
+                args, keep_alive = _stack_args(views[k0:k1])
+                _histogram.lib.ranged_hist_stack_float(*args, _uint32_ptr(histograms[k0:]), n_bins, r_min, r_max)
+            _map_chunks(group_hist, groups)
+    else:
+        ranged = range != (None, None)
+        hist_func, minmax_dtype = _stack_hists[(views[0].dtype.type, ranged)]
+        extra_args = []
+        if views[0].dtype == numpy.uint16:
+            if image_bits is None:
+                image_bits = 16
+            if ranged:
+                extra_args.append(n_bins)
+            else:
+                assert image_bits >= 10
+                extra_args.append(image_bits - 10) # bit shift arg
+        if ranged:
+            if r_min is None:
+                r_min = 0
+            if r_max is None:
+                r_max = 255 if views[0].dtype == numpy.uint8 else 2**image_bits - 1
+            extra_args += [int(r_min), int(r_max)]
+        mins = numpy.empty(n_images, dtype=minmax_dtype)
+        maxs = numpy.empty(n_images, dtype=minmax_dtype)
+        minmax_type = 'uint8_t *' if minmax_dtype == numpy.uint8 else 'uint16_t *'
+        def group_hist(group):
+            k0, k1 = group
+            args, keep_alive = _stack_args(views[k0:k1])
+            hist_func(*args, _uint32_ptr(histograms[k0:]), *extra_args,
+                _histogram.ffi.cast(minmax_type, mins[k0:].ctypes.data), _histogram.ffi.cast(minmax_type, maxs[k0:].ctypes.data))
+        _map_chunks(group_hist, groups)
+        mn, mx = mins.min(), maxs.max()
+        if was_bool:
+            histograms = histograms[:, :2]
+    return HistogramStackStatistics(mins, maxs, histograms, mn, mx, histograms.sum(axis=0, dtype=numpy.uint32), nan_counts, inf_counts)
+
+def _histogram_stack_by_image(images, range, image_bits, mask_geometry, threads):
+    stats = [histogram_statistics(image, range, image_bits, mask_geometry, threads) for image in images]
+    mins = numpy.array([s.min for s in stats])
+    maxs = numpy.array([s.max for s in stats])
+    if images[0].dtype.type not in FIXED_RANGE_DTYPES and None in range:
+        # bin every image over the range of the whole stack
+        r_min, r_max = range
+        if r_min is None:
+            r_min = numpy.nanmin(mins)
+        if r_max is None:
+            r_max = numpy.nanmax(maxs)
+        stats = [histogram_statistics(image, (r_min, r_max), image_bits, mask_geometry, threads) for image in images]
+    histograms = numpy.array([s.histogram for s in stats])
+    nan_counts = numpy.array([s.nan_count for s in stats], dtype=numpy.uint32)
+    inf_counts = numpy.array([s.inf_count for s in stats], dtype=numpy.uint32)
+    return HistogramStackStatistics(mins, maxs, histograms, numpy.nanmin(mins), numpy.nanmax(maxs),
+        histograms.sum(axis=0, dtype=numpy.uint32), nan_counts, inf_counts)
\ No newline at end of file
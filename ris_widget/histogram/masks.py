@@ -0,0 +1,170 @@
+# This code is licensed under the MIT License (see LICENSE file for details)
+
+"""Histogram masks of arbitrary shape, for use as the mask_geometry argument of histogram()
+or as Layer.histogram_mask.
+
+Each mask is rasterized into a table of spans: for every scanline, the [start, end) runs of
+pixels that the mask covers. A pixel is covered if its center lies within the shape. Rows
+of a concave polygon or bitmap may have several spans; the table is split into "layers"
+holding at most one span per row, each of which is binned by the same masked kernels that
+are used for the circular vignette mask. Span tables are cached per mask and image shape,
+so a mask is rasterized only once however many frames it is applied to.
+
+Geometry is given in image pixel coordinates: x indexes image.shape[0] and y image.shape[1].
+"""
+
+import functools
+import numpy
+
+class SpanMask:
+    """Base class for histogram masks. Subclasses implement _spans()."""
+    def span_layers(self, image_shape, transpose=False):
+        """Return the mask's span table for an image of the given (x, y) shape, as a list of
+        (ymin, ymax, starts, ends) tuples, where starts and ends are uint16 arrays giving the
+        [start, end) x-range covered in each row from ymin to ymax (exclusive). Rows of a layer
+        may be empty (start == end), except for the first and last. If transpose is True, the
+        roles of x and y are swapped, for images stored with y as the fast-varying index.
+        Returns None if the mask covers the whole image."""
+        return _span_layers(self, tuple(image_shape), transpose)
+
+    def _spans(self, image_shape, transpose):
+        """Return (rows, starts, ends) arrays of every span of the mask, ordered by row and
+        then by start, in the (possibly transposed) coordinates of the scanlines."""
+        raise NotImplementedError()
+
+class _GeometryMask(SpanMask):
+    # masks whose geometry is a sequence of (x, y) points
+    def __init__(self, geometry):
+        self.geometry = tuple(tuple(map(float, point)) for point in geometry)
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return self.geometry == other.geometry
+
+    def __hash__(self):
+        return hash((type(self), self.geometry))
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, self.geometry)
+
+    def _points(self, transpose):
+        points = numpy.array(self.geometry, dtype=float).reshape(-1, 2)
+        return points[:, ::-1] if transpose else points
+
+class RectMask(_GeometryMask):
+    """Rectangle with corners ((x1, y1), (x2, y2)), as for the geometry of an overlay.RectROI."""
+    def __init__(self, geometry):
+        super().__init__(geometry)
+        if len(self.geometry) != 2:
+            raise ValueError('RectMask geometry must be ((x1, y1), (x2, y2)).')
+
+    def _spans(self, image_shape, transpose):
+        (x1, y1), (x2, y2) = numpy.sort(self._points(transpose), axis=0)
+        rows = _center_range(y1, y2, image_shape[1])
+        starts = numpy.full(len(rows), _first_center(x1))
+        ends = numpy.full(len(rows), _first_center(x2))
+        return rows, starts, ends
+
+class EllipseMask(_GeometryMask):
+    """Ellipse inscribed in the rectangle ((x1, y1), (x2, y2)), as for the geometry of an
+    overlay.EllipseROI."""
+    def __init__(self, geometry):
+        super().__init__(geometry)
+        if len(self.geometry) != 2:
+            raise ValueError('EllipseMask geometry must be ((x1, y1), (x2, y2)).')
+
+    def _spans(self, image_shape, transpose):
+        (x1, y1), (x2, y2) = numpy.sort(self._points(transpose), axis=0)
+        cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+        a, b = (x2 - x1) / 2, (y2 - y1) / 2
+        rows = _center_range(y1, y2, image_shape[1])
+        if a == 0 or b == 0:
+            rows = rows[:0]
+        half_widths = a * numpy.sqrt((1 - ((rows + 0.5 - cy) / b)**2).clip(0, None))
+        return rows, _first_center(cx - half_widths), _first_center(cx + half_widths)
+
+class PolygonMask(_GeometryMask):
+    """Polygon with vertices [(x, y), ...], as for the geometry of an overlay.Polyline (which
+    is closed by joining its last point to its first). Self-intersecting polygons are filled
+    by the even-odd rule."""
+    def __init__(self, geometry):
+        super().__init__(geometry)
+        if len(self.geometry) < 3:
+            raise ValueError('PolygonMask geometry must have at least 3 points.')
+
+    def _spans(self, image_shape, transpose):
+        points = self._points(transpose)
+        x0, y0 = points.T
+        x1, y1 = numpy.roll(points, -1, axis=0).T
+        rows = _center_range(y0.min(), y0.max(), image_shape[1])
+        centers = rows[:, numpy.newaxis] + 0.5
+        # Each edge crosses the scanlines whose pixel centers lie in [min(y0, y1), max(y0, y1)),
+        # so that a vertex shared by two edges is counted once (or twice, at a local extremum).
+        crosses = (numpy.minimum(y0, y1) <= centers) & (centers < numpy.maximum(y0, y1))
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            xs = x0 + (centers - y0) * (x1 - x0) / (y1 - y0)
+        xs = numpy.sort(numpy.where(crosses, xs, numpy.inf), axis=1)
+        counts = crosses.sum(axis=1)
+        # pair up successive crossings along each scanline
+        span_idx = numpy.arange(xs.shape[1] // 2)
+        in_span = span_idx < counts[:, numpy.newaxis] // 2
+        starts = _first_center(xs[:, 0::2][:, :len(span_idx)][in_span])
+        ends = _first_center(xs[:, 1::2][in_span])
+        return numpy.broadcast_to(rows[:, numpy.newaxis], in_span.shape)[in_span], starts, ends
+
+class BitmapMask(SpanMask):
+    """Mask given by a boolean array with the same (x, y) shape as the image. Unlike the other
+    masks, BitmapMasks compare equal only to themselves, as comparing the arrays is costly."""
+    def __init__(self, mask):
+        mask = numpy.asarray(mask)
+        if mask.ndim != 2:
+            raise ValueError('BitmapMask mask must be a 2D array.')
+        self.mask = mask.astype(bool)
+
+    def __repr__(self):
+        return 'BitmapMask(<{}x{}>)'.format(*self.mask.shape)
+
+    def _spans(self, image_shape, transpose):
+        mask = self.mask.T if transpose else self.mask
+        if mask.shape != image_shape:
+            raise ValueError('BitmapMask shape {} does not match image shape {}.'.format(self.mask.shape,
+                image_shape[::-1] if transpose else image_shape))
+        edges = numpy.diff(mask.view(numpy.int8), axis=0, prepend=0, append=0).T
+        rows, starts = numpy.nonzero(edges == 1)
+        ends = numpy.nonzero(edges == -1)[1]
+        return rows, starts, ends
+
+def _first_center(x):
+    # index of the first pixel whose center, at index + 0.5, is >= x
+    return numpy.ceil(numpy.asarray(x) - 0.5).astype(numpy.int64)
+
+def _center_range(y1, y2, size):
+    # indices of the pixels whose centers lie in [y1, y2), clipped to [0, size)
+    return numpy.arange(max(0, _first_center(y1)), min(size, _first_center(y2)))
+
+@functools.lru_cache(maxsize=16)
+def _span_layers(mask, image_shape, transpose):
+    sx, sy = image_shape
+    rows, starts, ends = mask._spans(image_shape, transpose)
+    starts = starts.clip(0, sx)
+    ends = ends.clip(0, sx)
+    keep = ends > starts
+    rows, starts, ends = rows[keep], starts[keep], ends[keep]
+    if len(rows) == sy and numpy.all(starts == 0) and numpy.all(ends == sx):
+        # mask is just whole image...
+        return None
+    # the rank of each span within its row determines the layer it goes into
+    row_firsts = numpy.flatnonzero(numpy.r_[True, rows[1:] != rows[:-1]]) if len(rows) else numpy.array([], dtype=int)
+    ranks = numpy.arange(len(rows)) - numpy.repeat(row_firsts, numpy.diff(numpy.r_[row_firsts, len(rows)]))
+    layers = []
+    for rank in range(ranks.max() + 1 if len(ranks) else 0):
+        selected = ranks == rank
+        layer_rows = rows[selected]
+        ymin, ymax = int(layer_rows[0]), int(layer_rows[-1]) + 1
+        layer_starts = numpy.zeros(ymax - ymin, dtype=numpy.uint16)
+        layer_ends = numpy.zeros(ymax - ymin, dtype=numpy.uint16)
+        layer_starts[layer_rows - ymin] = starts[selected]
+        layer_ends[layer_rows - ymin] = ends[selected]
+        layers.append((ymin, ymax, layer_starts, layer_ends))
+    return layers
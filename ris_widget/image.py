@@ -1,29 +1,81 @@
 # This code is licensed under the MIT License (see LICENSE file for details)
 
+from concurrent import futures
 import ctypes
+import itertools
+import traceback
 
 import numpy
 from PyQt5 import Qt
 
+# Pyramid levels are halved in size until the larger dimension of the last is no more than this
+PYRAMID_MIN_SIZE = 512
+
+class _PyramidDoneEvent(Qt.QEvent):
+    TYPE = Qt.QEvent.registerEventType()
+    def __init__(self, generation, levels, error=None, changed_region=None):
+        super().__init__(self.TYPE)
+        self.generation = generation
+        self.levels = levels
+        self.error = error
+        self.changed_region = changed_region
+
+_pyramid_executor = None
+def _get_pyramid_executor():
+    global _pyramid_executor
+    if _pyramid_executor is None:
+        _pyramid_executor = futures.ThreadPoolExecutor(max_workers=1)
+    return _pyramid_executor
+
 class Image(Qt.QObject):
     """An instance of the Image class is a wrapper around a Numpy ndarray representing a single image.
 
     Images are immutable: do not try to change the .data or .valid_range attributes after construction.
 
     The .data array can be modified in-place after construction, however: just call .refresh() afterward.
+
+    Data of the types in NUMPY_DTYPE_TO_RANGE (bool, uint8, uint16, int16, uint32, int32, float32, and
+    float64) is used as-is; data of other integer or floating-point types is converted to float32.
+
+    Data in which either x or y varies fastest is used without copying: .memory_order is 'F' if
+    x varies fastest (the native layout, as for Fortran-ordered (x, y) arrays or the transpose of
+    row-major (y, x) arrays) and 'C' if y does (as for row-major (x, y) arrays). Rows may be padded
+    beyond the image width (e.g. a view of part of a larger image), but the pixels along each row,
+    and the channels of each pixel, must be contiguous. Other arrays are copied to the native layout.
+
+    Each Image has a .serial number, unique within the process, and a .generation count of the calls
+    to .refresh(). Together, they identify the contents of .data, e.g. for caching histograms.
+
+    Very large images may be given a .pyramid of successively downsampled levels, so that, when zoomed
+    out, only a coarser level need be drawn. .pyramid is a list of Images, the first being the Image
+    itself and each of the others half the width and height of the one before, or None for no pyramid.
+    The levels may be given when constructing the Image (e.g. as read from a pyramidal file), in which
+    case they are kept as they are, or built in a background thread, in which case they are brought up
+    to date in the background after each call to .refresh() (recalculating only the blocks of each level
+    covering changed_region, if given). Until the new levels are ready, the old ones are shown when
+    zoomed out, and .pyramid_changed is emitted once they are in place.
     """
     # TODO: update documentation after image simplification
     changed = Qt.pyqtSignal(object)
+    pyramid_changed = Qt.pyqtSignal(object)
 
     NUMPY_DTYPE_TO_RANGE = {
         numpy.bool8: (False, True),
         numpy.uint8: (0, 255),
         numpy.uint16: (0, 65535),
-        numpy.float32: (-numpy.inf, numpy.inf)}
+        numpy.int16: (-32768, 32767),
+        numpy.uint32: (0, 2**32-1),
+        numpy.int32: (-2**31, 2**31-1),
+        numpy.float32: (-numpy.inf, numpy.inf),
+        numpy.float64: (-numpy.inf, numpy.inf)}
+
+    _serials = itertools.count()
 
-    def __init__(self, data, image_bits=None, name=None, parent=None):
+    def __init__(self, data, image_bits=None, name=None, parent=None, pyramid=None):
         """
         image_bits: only applies to uint16 images. If None, images are assumed to occupy full 16-bit range.
+        pyramid: None for no pyramid, 'auto' to build the pyramid levels in a background thread, or a sequence
+        of the downsampled levels below the full-resolution data, each half the size of the one before.
         The shape of image and mask data is interpreted as (x,y) for 2-d arrays and (x,y,c) for 3-d arrays.  If your image or mask was loaded as (y,x),
         array.T will produce an (x,y)-shaped array.  In case of (y,x,c) image data, array.swapaxes(0,1) is required."""
         super().__init__(parent)
@@ -32,7 +84,8 @@ class Image(Qt.QObject):
         if not (data.ndim == 2 or (data.ndim == 3 and data.shape[2] in (2,3,4))):
             raise ValueError('data argument must be a 2D (grayscale) or 3D (grayscale with alpha, rgb, or rgba) iterable.')
 
-        if data.dtype not in (bool, numpy.uint8, numpy.uint16, numpy.float32):
+        if data.dtype.type not in self.NUMPY_DTYPE_TO_RANGE:
+            # other integer and floating-point types (e.g. int8, int64, or float16) are converted
             if numpy.issubdtype(data.dtype, numpy.floating) or numpy.issubdtype(data.dtype, numpy.integer):
                 data = data.astype(numpy.float32)
             else:
@@ -40,13 +93,12 @@ class Image(Qt.QObject):
         if image_bits is not None and data.dtype != numpy.uint16:
             raise ValueError('The image_bits argument may only be used if data is of type uint16.')
 
-        bpe = data.itemsize
-        desired_strides = (bpe, data.shape[0]*bpe) if data.ndim == 2 else (data.shape[2]*bpe, data.shape[0]*data.shape[2]*bpe, bpe)
-        if desired_strides == data.strides:
-            self._data = data
-        else:
-            self._data = numpy.ndarray(data.shape, strides=desired_strides, dtype=data.dtype)
-            self._data.flat = data.flat
+        self.memory_order = _memory_order(data)
+        if self.memory_order is None:
+            # copy to the native layout, in which x varies fastest (after the channels, if any)
+            data = numpy.ascontiguousarray(data.swapaxes(0, 1)).swapaxes(0, 1)
+            self.memory_order = 'F'
+        self._data = data
 
         if self._data.ndim == 2:
             self.type = 'G'
@@ -61,6 +113,20 @@ class Image(Qt.QObject):
             self.valid_range = self.NUMPY_DTYPE_TO_RANGE[data.dtype.type]
 
         self.name = name
+        self.serial = next(self._serials)
+        self.generation = 0
+
+        self._auto_pyramid = isinstance(pyramid, str)
+        if pyramid is None:
+            self.pyramid = None
+        elif self._auto_pyramid:
+            if pyramid != 'auto':
+                raise ValueError("The pyramid argument must be None, 'auto', or a sequence of arrays.")
+            # until the levels are built, there is only the full-resolution image
+            self.pyramid = [self]
+            self._build_pyramid()
+        else:
+            self.pyramid = [self] + self._pyramid_images(pyramid)
 
     def __repr__(self):
         return '{}; {}x{} ({})>'.format(super().__repr__()[:-1], self.size.width(), self.size.height(), self.type)
@@ -75,7 +141,60 @@ class Image(Qt.QObject):
         If only a portion of the image changed, call with (l, t, w, h) as the
         bounds of the changed_region.
         """
+        self.generation += 1
         self.changed.emit(changed_region)
+        if self._auto_pyramid:
+            self._build_pyramid(changed_region)
+
+    def _pyramid_images(self, levels):
+        images = [Image(level, self.image_bits) for level in levels]
+        for image in images:
+            if image.type != self.type or image.data.dtype != self._data.dtype:
+                raise ValueError('Pyramid levels must be of the same type and dtype as the image.')
+        return images
+
+    def _build_pyramid(self, changed_region=None):
+        # Queue a build of the whole pyramid or, if changed_region is given, of the blocks of each level
+        # covering it. Builds (of either kind) requested before the latest build of the whole pyramid are
+        # superseded by it, and are skipped if they have not yet run.
+        generation = self.generation
+        if changed_region is None:
+            self._pyramid_generation = generation
+        data = self._data
+        def run():
+            if self._pyramid_generation > generation:
+                return
+            try:
+                if changed_region is None:
+                    levels = pyramid_levels(data)
+                else:
+                    levels = _pyramid_region_levels(data, changed_region)
+                error = None
+            except Exception as e:
+                levels, error = None, e
+            Qt.QCoreApplication.postEvent(self, _PyramidDoneEvent(generation, levels, error, changed_region))
+        _get_pyramid_executor().submit(run)
+
+    def event(self, e):
+        if e.type() == _PyramidDoneEvent.TYPE:
+            if e.error is not None:
+                traceback.print_exception(type(e.error), e.error, e.error.__traceback__)
+            elif e.generation < self._pyramid_generation:
+                # the data were refreshed during the build, and newer levels are on their way
+                pass
+            elif e.changed_region is None:
+                self.pyramid = [self] + self._pyramid_images(e.levels)
+                self.pyramid_changed.emit(self)
+            elif len(self.pyramid) > 1:
+                # (regional builds queued after the first whole build arrive after it)
+                for level, (x, y, block) in zip(self.pyramid[1:], e.levels):
+                    w, h = block.shape[:2]
+                    if w and h:
+                        level.data[x:x+w, y:y+h] = block
+                        level.refresh((x, y, w, h))
+                self.pyramid_changed.emit(self)
+            return True
+        return super().event(e)
 
     def generate_contextual_info_for_pos(self, x, y):
         if not (0 <= x < self.size.width() and 0 <= y < self.size.height()):
@@ -95,6 +214,66 @@ class Image(Qt.QObject):
     def data(self):
         return self._data
 
+def pyramid_levels(data, min_size=PYRAMID_MIN_SIZE):
+    """Return a list of successively downsampled copies of the (x, y[, c]) array data, each the mean of
+    the 2x2 blocks of the one before (dropping any odd last row or column), until the larger dimension
+    of the last is no more than min_size."""
+    levels = []
+    while max(data.shape[:2]) > min_size and min(data.shape[:2]) >= 2:
+        data = _downsample(data)
+        levels.append(data)
+    return levels
+
+def _pyramid_region_levels(data, region, min_size=PYRAMID_MIN_SIZE):
+    # Return [(x, y, block), ...], for each level of pyramid_levels(data, min_size), the block of that level
+    # at (x, y) covering the (x, y, w, h) region of data. The blocks are calculated from a window of data aligned
+    # to the coarsest level's pixels, so that they equal the corresponding parts of the levels of the whole.
+    shape = data.shape[:2]
+    level_count = 0
+    while max(shape) > min_size and min(shape) >= 2:
+        shape = shape[0] // 2, shape[1] // 2
+        level_count += 1
+    align = 2**level_count
+    x, y, w, h = region
+    x0, y0 = max(x, 0) // align * align, max(y, 0) // align * align
+    x1, y1 = min(-(-(x + w) // align) * align, data.shape[0]), min(-(-(y + h) // align) * align, data.shape[1])
+    if x1 <= x0 or y1 <= y0:
+        return []
+    window = data[x0:x1, y0:y1]
+    blocks = []
+    for level in range(1, level_count + 1):
+        window = _downsample(window)
+        blocks.append((x0 >> level, y0 >> level, window))
+    return blocks
+
+def _downsample(data):
+    w, h = data.shape[0] // 2 * 2, data.shape[1] // 2 * 2
+    # wide integer types do not fit in the float32 mantissa
+    total = data[0:w:2, 0:h:2].astype(numpy.float64 if data.dtype.itemsize > 2 else numpy.float32)
+    total += data[1:w:2, 0:h:2]
+    total += data[0:w:2, 1:h:2]
+    total += data[1:w:2, 1:h:2]
+    total /= 4
+    if data.dtype.kind in 'biu':
+        total.round(out=total)
+    return total.astype(data.dtype)
+
+def _memory_order(data):
+    """Return 'F' if data can be used as-is with x varying fastest, 'C' if with y varying fastest,
+    or None if data must be copied."""
+    if data.ndim == 3:
+        if data.strides[2] != data.itemsize:
+            return None
+        pixel_stride = data.shape[2] * data.itemsize
+    else:
+        pixel_stride = data.itemsize
+    x_stride, y_stride = data.strides[:2]
+    w, h = data.shape[:2]
+    for order, fast_stride, slow_stride, fast_len in (('F', x_stride, y_stride, w), ('C', y_stride, x_stride, h)):
+        if fast_stride == pixel_stride and slow_stride % pixel_stride == 0 and slow_stride >= fast_len * pixel_stride:
+            return order
+    return None
+
 def array_from_qimage(qimage):
     if qimage.isNull() or qimage.format() != Qt.QImage.Format_Invalid:
         return
@@ -1,5 +1,9 @@
 # This code is licensed under the MIT License (see LICENSE file for details)
 
+import concurrent.futures as futures
+import functools
+import multiprocessing
+import traceback
 from PyQt5 import Qt
 import warnings
 import numpy
@@ -8,6 +12,8 @@ from . import image
 from . import histogram
 from . import qt_property
 from . import async_texture
+from .overlay import point_set
+from .overlay import roi
 
 SHADER_PROP_HELP = """The GLSL fragment shader used to render an image within a layer stack is created
 by filling in the $-values from the following template (somewhat simplified) with the corresponding
@@ -60,13 +66,70 @@ def coerce_to_tint(v):
         v += (1.0,)
     return v
 
+def coerce_to_percentiles(v):
+    if isinstance(v, str):
+        v = v.replace(',', ' ').split()
+    v = tuple(map(float, v))
+    if len(v) != 2 or not 0 <= v[0] <= v[1] <= 100:
+        raise ValueError('The iterable assigned to auto_min_max_percentiles must represent 2 real numbers (low, high) with 0 <= low <= high <= 100.')
+    return v
+
+def coerce_to_histogram_mask(v):
+    if v is None or isinstance(v, histogram.SpanMask):
+        return v
+    if isinstance(v, (roi.RectROI, roi.EllipseROI, point_set.PointSet)):
+        # use the overlay's current geometry; the mask does not follow later edits
+        geometry = v.geometry
+        if geometry is None:
+            return None
+        if isinstance(v, roi.EllipseROI):
+            return histogram.EllipseMask(geometry)
+        elif isinstance(v, roi.RectROI):
+            return histogram.RectMask(geometry)
+        elif len(geometry) < 3:
+            # too few points (so far) to enclose any pixels
+            return None
+        else:
+            return histogram.PolygonMask(geometry)
+    if isinstance(v, numpy.ndarray) and v.dtype == bool:
+        return histogram.BitmapMask(v)
+    v = tuple(map(float, v))
+    if len(v) != 3:
+        raise ValueError('The value assigned to histogram_mask must be None, (cx, cy, r) fractions of the image shape, '
+                         'a boolean mask array, a RectROI, EllipseROI, or Polyline overlay, or a histogram.SpanMask.')
+    return v
+
+# Histograms of recently shown images, so that returning to an unchanged image (e.g. flipping back to
+# a Flipbook page) does not recalculate its histogram. Accessed from the GUI thread only.
+histogram_cache = histogram.HistogramCache(maxsize=64)
+
+class _HistogramDoneEvent(Qt.QEvent):
+    TYPE = Qt.QEvent.registerEventType()
+    def __init__(self, serial, stats, error=None, cache_key=None):
+        super().__init__(self.TYPE)
+        self.serial = serial
+        self.stats = stats
+        self.error = error
+        self.cache_key = cache_key
+
+_histogram_executor = None
+def _get_histogram_executor():
+    global _histogram_executor
+    if _histogram_executor is None:
+        _histogram_executor = futures.ThreadPoolExecutor(max_workers=multiprocessing.cpu_count())
+    return _histogram_executor
+
 class Layer(qt_property.QtPropertyOwner):
     """ The class Layer contains properties that control Image presentation.
 
     Properties:
         visible
         histogram_mask
+        exact_histogram
+        preview_histogram
+        async_histogram
         auto_min_max
+        auto_min_max_percentiles
         min
         max
         gamma
@@ -84,6 +147,11 @@ class Layer(qt_property.QtPropertyOwner):
     """
 
     GAMMA_RANGE = (0.0625, 16.0)
+    # With preview_histogram, images with more pixels than this are first histogrammed from a
+    # subsample of about this many pixels ...
+    PREVIEW_HISTOGRAM_PIXELS = 2**16
+    # ... and the exact histogram is computed once no new image has arrived for this many ms.
+    PREVIEW_HISTOGRAM_REFINE_DELAY = 200
     IMAGE_TYPE_TO_GETCOLOR_EXPRESSION = {
         'G': 'vec4(s.rrr, 1.0f)',
         'Ga': 'vec4(s.rrr, s.g)',
@@ -131,13 +199,33 @@ class Layer(qt_property.QtPropertyOwner):
     type_changed = Qt.pyqtSignal(object)
     size_changed = Qt.pyqtSignal(object)
     name_changed = Qt.pyqtSignal(object)
+    # emitted whenever a new histogram is in place, whether calculated on a change of the image (once
+    # auto min/max has been applied), found in the histogram cache, replacing a preview, or delivered by
+    # an asynchronous calculation
+    histogram_ready = Qt.pyqtSignal(object)
 
     def __init__(self, image=None, parent=None):
         self._retain_auto_min_max_on_min_max_change = False
         self._image = None
+        self._histogram_snapshot = None
+        self._exact_histogram_buffer = None
+        self.image_min = self.image_max = None
+        self.nan_count = self.inf_count = 0
+        self.channel_histograms = None
+        self.histogram_is_preview = False
+        self._histogram_format = None
+        self._histogram_serial = self._applied_histogram_serial = 0
+        self._pending_histogram_job = None
+        self._histogram_job_running = False
         super().__init__(parent)
         self.image_changed.connect(self.changed)
+        self._refine_histogram_timer = Qt.QTimer(self)
+        self._refine_histogram_timer.setSingleShot(True)
+        self._refine_histogram_timer.setInterval(self.PREVIEW_HISTOGRAM_REFINE_DELAY)
+        self._refine_histogram_timer.timeout.connect(self._refine_histogram)
         self.texture = async_texture.AsyncTexture()
+        # textures of the levels of the image's pyramid, if it has one, which replace .texture
+        self._pyramid_textures = []
         # need to be set already for self.image setter to work propery
         self.dtype = None
         self.type = None
@@ -162,6 +250,9 @@ class Layer(qt_property.QtPropertyOwner):
 
     def get_savable_properties_dict(self):
         ret = {name : prop.__get__(self) for name, prop in self._properties.items() if not prop.is_default(self)}
+        if isinstance(ret.get('histogram_mask'), histogram.SpanMask):
+            # masks drawn with overlays or given as arrays are not saved
+            del ret['histogram_mask']
         return ret
 
     @property
@@ -177,10 +268,12 @@ class Layer(qt_property.QtPropertyOwner):
             if not isinstance(new_image, image.Image):
                 new_image = image.Image(new_image)
             new_image.changed.connect(self._on_image_changed)
+            new_image.pyramid_changed.connect(self._on_pyramid_changed)
 
         if self._image is not None:
             # deallocate old texture when we're done with it.
             self._image.changed.disconnect(self._on_image_changed)
+            self._image.pyramid_changed.disconnect(self._on_pyramid_changed)
 
         self._image = new_image
 
@@ -205,11 +298,23 @@ class Layer(qt_property.QtPropertyOwner):
         self._on_image_changed()
 
     def _on_image_changed(self, changed_region=None):
+        histogram_installed = False
         if self.image is not None:
+            if changed_region is None:
+                # a snapshot of the previous image must not be used to update the new one's histogram
+                self._histogram_snapshot = None
             # upload texture before calculating the histogram, so that the background texture upload (slow) runs in
-            # parallel with the foreground histogram calculation (slow)
-            self.texture.upload(self.image, changed_region)
-            self.calculate_histogram()
+            # parallel with the foreground histogram calculation (slow). (Images with pyramids are instead
+            # uploaded as drawn, a level and the tiles in view at a time: see texture_for_view.)
+            if self.image.pyramid is None:
+                self.texture.upload(self.image, changed_region)
+            if (self.async_histogram and changed_region is None and
+                    self._histogram_format == (self.image.data.dtype, self.image.type)):
+                # the previous histogram remains in place until histogram_ready is emitted for the new one
+                histogram_installed = self._request_histogram()
+            else:
+                self.calculate_histogram(changed_region)
+                histogram_installed = True
         self._update_property_defaults()
         if self.image is not None:
             if self.auto_min_max:
@@ -220,17 +325,239 @@ class Layer(qt_property.QtPropertyOwner):
                     self.min = l
                 if self.max > h:
                     self.max = h
+        if histogram_installed:
+            self.histogram_ready.emit(self)
         self.image_changed.emit(self)
 
-    def calculate_histogram(self):
+    def _on_pyramid_changed(self, image):
+        self.changed.emit(self)
+
+    def texture_for_view(self, scale, visible_rect=None):
+        """Return (texture, texture_scale): the AsyncTexture with which to draw the image, shown at the given
+        scale (in screen pixels per image pixel) with visible_rect of it in view (as (left, top, right, bottom)
+        fractions of the image's width and height, or None for all of it), and the scale at which the texture
+        is drawn. Requires a current GL context.
+
+        This is .texture, unless the image has a pyramid, in which case it is a texture for the coarsest
+        pyramid level that is still drawn at 1:1 or larger, holding only that level's tiles in view."""
+        pyramid = self.image.pyramid
+        if pyramid is None:
+            return self.texture, scale
+        # drop the full-resolution texture of a previous image without a pyramid
+        self.texture.release()
+        level = 0 if scale >= 1 else min(int(numpy.log2(1 / scale)), len(pyramid) - 1)
+        while len(self._pyramid_textures) < len(pyramid):
+            self._pyramid_textures.append(async_texture.AsyncTexture())
+        for other_level, texture in enumerate(self._pyramid_textures):
+            if other_level != level:
+                texture.release()
+        texture = self._pyramid_textures[level]
+        texture.upload_visible(pyramid[level], visible_rect)
+        return texture, scale * self.image.size.width() / pyramid[level].size.width()
+
+    def calculate_histogram(self, changed_region=None, allow_preview=True):
+        """Recalculate self.histogram, self.image_min, and self.image_max.
+
+        If changed_region (an (x, y, w, h) tuple, as passed to Image.refresh) is given, only
+        that part of the image is assumed to have changed. The first such call bins the whole
+        image and keeps a copy of its contents; subsequent calls subtract the histogram of
+        the region's previous contents and add that of its new contents, so that repeated
+        small edits (e.g. painting with a brush) cost time proportional to the region size.
+        This applies only to integer-valued images without a histogram_mask.
+
+        If exact_histogram is set and the image is bool, uint8, or uint16, the histogram has a bin
+        for every value from histogram_min to histogram_max, and is calculated into a buffer
+        kept by the layer and reused for as long as the number of bins is unchanged. (Such histograms
+        are cached, which copies them, only for images histogrammed more than once.)
+
+        Also sets self.nan_count and self.inf_count, the number of NaN and +/-Inf pixels in
+        a float32 or float64 image (which are excluded from the histogram, image_min, and image_max), and
+        self.channel_histograms, which is None for grayscale images and for RGB(A) images is a
+        (3, n_bins) array of R, G, and B histograms, binned as self.histogram (of luma) is.
+
+        If preview_histogram is set and allow_preview is True, a large image is histogrammed from
+        a subsample of its pixels, self.histogram_is_preview is set, and the exact histogram is
+        scheduled to replace it (with histogram_ready emitted) once images stop changing."""
+        self._histogram_serial += 1
+        # results of asynchronous calculations requested before now are stale
+        self._applied_histogram_serial = self._histogram_serial
+        self._pending_histogram_job = None
+        r_min, r_max = self._histogram_range()
+        if _DEBUG_NO_HIST:
+            self.image_min, self.image_max = r_min, r_max
+            self.histogram = numpy.zeros(256, dtype=numpy.uint32)
+            self.nan_count = self.inf_count = 0
+            self.channel_histograms = None
+            self.histogram_is_preview = False
+            self._histogram_format = None
+            return
+        cache_key = self._histogram_cache_key(r_min, r_max)
+        cached = histogram_cache.get(cache_key)
+        if cached is not None:
+            self._set_histogram_statistics(cached, False, changed_region)
+            return
+        if changed_region is not None and self._histogram_snapshot is not None:
+            if self._update_histogram_region(changed_region, r_min, r_max):
+                return
+        job, is_preview = self._histogram_job(r_min, r_max, allow_preview, reuse_buffer=True)
+        stats = job()
+        self._set_histogram_statistics(stats, is_preview, changed_region)
+        if not is_preview:
+            self._cache_histogram_statistics(cache_key, stats)
+
+    def _histogram_cache_key(self, r_min, r_max):
+        image = self.image
+        return (image.serial, image.generation, r_min, r_max, image.image_bits, self.histogram_mask, self._use_exact_histogram())
+
+    def _cache_histogram_statistics(self, cache_key, stats):
+        # The exact histogram buffer is reused for the next exact histogram, so caching it takes a copy
+        # (256 KiB, for 16-bit images): rather than copying every frame of a live stream, whose images are
+        # never shown again, such histograms are cached only when the same image is histogrammed a second
+        # time (e.g. on returning to a Flipbook page).
+        histogram_cache.put(cache_key, stats, copy_on_revisit=stats.histogram is self._exact_histogram_buffer)
+
+    def _histogram_range(self):
         r_min = None if self._is_default('histogram_min') else self.histogram_min
         r_max = None if self._is_default('histogram_max') else self.histogram_max
-        if not _DEBUG_NO_HIST:
-            self.image_min, self.image_max, self.histogram = histogram.histogram(
-                self.image.data, (r_min, r_max), self.image.image_bits, self.histogram_mask)
+        return r_min, r_max
+
+    def _histogram_job(self, r_min, r_max, allow_preview, reuse_buffer):
+        # Returns a function of no arguments that calculates the HistogramStatistics of the current image
+        # with the current settings, and whether that is a subsampled preview. If reuse_buffer is False, an
+        # exact histogram is calculated into a new array rather than self._exact_histogram_buffer, so that
+        # the job may run on another thread while self.histogram remains in use.
+        if self._use_exact_histogram():
+            l, h = self.image.valid_range
+            n_bins = int(h if r_max is None else r_max) - int(l if r_min is None else r_min) + 1
+            if reuse_buffer:
+                if self._exact_histogram_buffer is None or len(self._exact_histogram_buffer) != n_bins:
+                    self._exact_histogram_buffer = numpy.empty(n_bins, dtype=numpy.uint32)
+                out = self._exact_histogram_buffer
+            else:
+                out = None
+            bins = 'exact'
         else:
-            self.image_min, self.image_max = r_min, r_max
-            self.histogram = numpy.zeros(256, dtype=numpy.uint32)
+            self._exact_histogram_buffer = None
+            bins = out = None
+        range_hint = None
+        if self.image.data.dtype.type not in histogram.FIXED_RANGE_DTYPES and self.image_min is not None and numpy.isfinite([self.image_min, self.image_max]).all():
+            # guess that a float (or wide integer) image spans the same range as the previous one, allowing the
+            # histogram to be computed in a single pass if the guess is right
+            range_hint = self.image_min, self.image_max
+        subsample = None
+        if allow_preview and self.preview_histogram:
+            sx, sy = self.image.data.shape[:2]
+            subsample = int(numpy.ceil(numpy.sqrt(sx * sy / self.PREVIEW_HISTOGRAM_PIXELS)))
+            if subsample <= 1:
+                subsample = None
+        job = functools.partial(histogram.histogram_statistics, self.image.data, (r_min, r_max), self.image.image_bits,
+            self.histogram_mask, bins=bins, out=out, range_hint=range_hint, subsample=subsample)
+        return job, subsample is not None
+
+    def _set_histogram_statistics(self, stats, is_preview, changed_region=None):
+        (self.image_min, self.image_max, self.histogram, self.nan_count, self.inf_count,
+            self.channel_histograms) = stats
+        self._histogram_format = self.image.data.dtype, self.image.type
+        self.histogram_is_preview = is_preview
+        if self.histogram_is_preview:
+            # (re)start the countdown to the exact histogram, so that it is not computed while
+            # new images are still arriving
+            self._refine_histogram_timer.start()
+        else:
+            self._refine_histogram_timer.stop()
+        if (changed_region is not None and not self.histogram_is_preview and self.image.data.dtype.type in histogram.FIXED_RANGE_DTYPES and
+                self.histogram_mask is None):
+            self._histogram_snapshot = self.image.data.copy(order='K')
+        else:
+            self._histogram_snapshot = None
+
+    def _request_histogram(self):
+        # Queue calculation of the histogram of the current image on a worker thread. Only the most
+        # recent request waits for the layer's running calculation (if any) to finish: older ones are dropped.
+        # Returns True if the histogram was instead found in the cache and is already in place.
+        r_min, r_max = self._histogram_range()
+        cache_key = self._histogram_cache_key(r_min, r_max)
+        if cache_key in histogram_cache:
+            # no need to wait for anything
+            self.calculate_histogram()
+            return True
+        self._histogram_serial += 1
+        job, is_preview = self._histogram_job(r_min, r_max, allow_preview=False, reuse_buffer=False)
+        self._pending_histogram_job = self._histogram_serial, job, cache_key
+        if not self._histogram_job_running:
+            self._submit_pending_histogram_job()
+        return False
+
+    def _submit_pending_histogram_job(self):
+        serial, job, cache_key = self._pending_histogram_job
+        self._pending_histogram_job = None
+        self._histogram_job_running = True
+        def run_job():
+            try:
+                event = _HistogramDoneEvent(serial, job(), cache_key=cache_key)
+            except Exception as e:
+                event = _HistogramDoneEvent(serial, None, e)
+            Qt.QCoreApplication.postEvent(self, event)
+        _get_histogram_executor().submit(run_job)
+
+    def event(self, e):
+        if e.type() == _HistogramDoneEvent.TYPE:
+            self._histogram_job_running = False
+            if e.error is not None:
+                traceback.print_exception(type(e.error), e.error, e.error.__traceback__)
+            else:
+                histogram_cache.put(e.cache_key, e.stats)
+            if e.error is None and e.serial > self._applied_histogram_serial and self.image is not None:
+                self._applied_histogram_serial = e.serial
+                self._set_histogram_statistics(e.stats, False)
+                self._update_property_defaults()
+                if self.auto_min_max:
+                    self.do_auto_min_max()
+                self.histogram_ready.emit(self)
+            if self._pending_histogram_job is not None:
+                self._submit_pending_histogram_job()
+            return True
+        return super().event(e)
+
+    def _refine_histogram(self):
+        if self.image is None or not self.histogram_is_preview:
+            return
+        self.calculate_histogram(allow_preview=False)
+        self._update_property_defaults()
+        if self.auto_min_max:
+            self.do_auto_min_max()
+        self.histogram_ready.emit(self)
+
+    def _update_histogram_region(self, changed_region, r_min, r_max):
+        # returns False if the histogram could not be updated incrementally
+        x, y, w, h = changed_region
+        new = self.image.data[x:x+w, y:y+h]
+        if new.size == 0:
+            return True
+        old = self._histogram_snapshot[x:x+w, y:y+h]
+        image_bits = self.image.image_bits
+        bins = 'exact' if self._use_exact_histogram() else None
+        old_stats = histogram.histogram_statistics(old, (r_min, r_max), image_bits, threads=1, bins=bins)
+        new_stats = histogram.histogram_statistics(new, (r_min, r_max), image_bits, threads=1, bins=bins)
+        old_min, old_max, old_hist = old_stats[:3]
+        new_min, new_max, new_hist = new_stats[:3]
+        hist = self.histogram - old_hist + new_hist
+        image_min = min(self.image_min, new_min)
+        image_max = max(self.image_max, new_max)
+        if (old_min == self.image_min and new_min > self.image_min) or (old_max == self.image_max and new_max < self.image_max):
+            # The region previously contained an extreme value and may no longer. Other pixels may still
+            # hold that value, which can be determined from the histogram only if each bin is a single value.
+            valid_min, valid_max = self.image.valid_range
+            if r_min is not None or r_max is not None or len(hist) != valid_max - valid_min + 1:
+                return False
+            nonzero = numpy.flatnonzero(hist)
+            image_min = int(nonzero[0]) + valid_min
+            image_max = int(nonzero[-1]) + valid_min
+        self._histogram_snapshot[x:x+w, y:y+h] = new
+        self.image_min, self.image_max, self.histogram = image_min, image_max, hist
+        if self.channel_histograms is not None:
+            self.channel_histograms = self.channel_histograms - old_stats.channel_histograms + new_stats.channel_histograms
+        return True
 
     def generate_contextual_info_for_pos(self, x, y, idx=None):
         if self.image is None:
@@ -245,23 +572,100 @@ class Layer(qt_property.QtPropertyOwner):
 
     def do_auto_min_max(self):
         assert self.image is not None
+        image_min, image_max = self.image_min, self.image_max
+        low, high = self.auto_min_max_percentiles
+        if low > 0 or high < 100:
+            p_low, p_high = histogram.histogram_percentiles(self.histogram, *self._histogram_bin_range(), (low, high))
+            if low > 0:
+                image_min = min(max(image_min, p_low), image_max)
+            if high < 100:
+                image_max = max(min(image_max, p_high), image_min)
         self._retain_auto_min_max_on_min_max_change = True
         try:
-            self.min = max(self.image_min, self.histogram_min)
-            self.max = min(self.image_max, self.histogram_max)
+            self.min = max(image_min, self.histogram_min)
+            self.max = min(image_max, self.histogram_max)
         finally:
             self._retain_auto_min_max_on_min_max_change = False
 
+    def _use_exact_histogram(self):
+        return self.exact_histogram and self.image.data.dtype.type in histogram.FIXED_RANGE_DTYPES
+
+    def _histogram_bin_range(self):
+        # the interval of values evenly divided by the bins of self.histogram
+        hist_min, hist_max = self.histogram_min, self.histogram_max
+        if self.dtype.type in histogram.FIXED_RANGE_DTYPES and (self.exact_histogram or
+                (self._is_default('histogram_min') and self._is_default('histogram_max'))):
+            # exact and full-range integer histograms have bins of whole values, so the last bin
+            # includes hist_max itself
+            hist_max += 1
+        return hist_min, hist_max
+
     visible = qt_property.Property(
         default_value=True,
         coerce_arg_fn=bool)
 
+    use_mipmaps = qt_property.Property(
+        default_value=True,
+        coerce_arg_fn=bool,
+        doc='If True, the image is smoothly downsampled (from mipmaps regenerated as needed after each new\n'
+            'image) where it is shown zoomed out below 1:1. If False, zoomed-out images are drawn without\n'
+            'mipmaps, which is faster for live streams but may alias.')
+
     def _histogram_mask_post_set(self, v):
         self._on_image_changed()
 
     histogram_mask = qt_property.Property(
         default_value=None,
-        post_set_callback=_histogram_mask_post_set)
+        coerce_arg_fn=coerce_to_histogram_mask,
+        post_set_callback=_histogram_mask_post_set,
+        doc='Region of the image included in the histogram: None for the whole image, (cx, cy, r) of a circle\n'
+            'as fractions of the image shape, a boolean array of the image\'s shape, a RectROI, EllipseROI,\n'
+            'or Polyline overlay (as currently drawn), or a histogram.SpanMask.')
+
+    def _preview_histogram_post_set(self, v):
+        if not v:
+            self._refine_histogram()
+
+    preview_histogram = qt_property.Property(
+        default_value=False,
+        coerce_arg_fn=bool,
+        post_set_callback=_preview_histogram_post_set,
+        doc='If True, the histograms of large images are first calculated from a subsample of about\n'
+            'PREVIEW_HISTOGRAM_PIXELS pixels, so that live streams of frames are not held up by histogramming.\n'
+            'The exact histogram replaces the preview once no new image has arrived for\n'
+            'PREVIEW_HISTOGRAM_REFINE_DELAY ms.')
+
+    def _async_histogram_post_set(self, v):
+        if not v and self.image is not None and (self._histogram_job_running or self._pending_histogram_job is not None):
+            self.calculate_histogram()
+            self._update_property_defaults()
+            if self.auto_min_max:
+                self.do_auto_min_max()
+            self.histogram_ready.emit(self)
+
+    async_histogram = qt_property.Property(
+        default_value=False,
+        coerce_arg_fn=bool,
+        post_set_callback=_async_histogram_post_set,
+        doc='If True, when the image changes its histogram is calculated on a worker thread rather than\n'
+            'the GUI thread. The previous histogram (and auto min/max) stays in place until the new one is\n'
+            'ready, at which point histogram_ready is emitted. If several images arrive while a histogram\n'
+            'is being calculated, only the most recent is histogrammed next. Images of a different dtype\n'
+            'or type than the last, and partial refreshes, are still histogrammed immediately.')
+
+    def _exact_histogram_post_set(self, v):
+        if self.image is not None:
+            self.calculate_histogram()
+            if self.auto_min_max:
+                self.do_auto_min_max()
+            self.histogram_ready.emit(self)
+
+    exact_histogram = qt_property.Property(
+        default_value=False,
+        coerce_arg_fn=bool,
+        post_set_callback=_exact_histogram_post_set,
+        doc='If True, bool, uint8, and uint16 images are histogrammed with one bin per value (e.g. 4096 bins\n'
+            'for 12-bit images) rather than 1024 bins. Has no effect for images of other types.')
 
     def _auto_min_max_post_set(self, v):
         if v and self.image is not None:
@@ -272,6 +676,17 @@ class Layer(qt_property.QtPropertyOwner):
         coerce_arg_fn=bool,
         post_set_callback=_auto_min_max_post_set)
 
+    def _auto_min_max_percentiles_post_set(self, v):
+        if self.auto_min_max and self.image is not None:
+            self.do_auto_min_max()
+
+    auto_min_max_percentiles = qt_property.Property(
+        default_value=(0.0, 100.0),
+        coerce_arg_fn=coerce_to_percentiles,
+        post_set_callback=_auto_min_max_percentiles_post_set,
+        doc='(low, high) percentiles of the histogram used as min and max when auto_min_max is enabled.\n'
+            'The default of (0, 100) uses the image min and max. Percentiles are interpolated within histogram bins.')
+
     def _min_default(self):
         if self.image is None:
             return 0.0
@@ -329,7 +744,7 @@ class Layer(qt_property.QtPropertyOwner):
     def _histogram_min_default(self):
         if self.image is None:
             return 0.0
-        elif self.dtype == numpy.float32:
+        elif self.dtype.type not in histogram.FIXED_RANGE_DTYPES:
             return self.image_min
         else:
             return float(self.image.valid_range[0])
@@ -337,7 +752,7 @@ class Layer(qt_property.QtPropertyOwner):
     def _histogram_max_default(self):
         if self.image is None:
             return 65535.0
-        elif self.dtype == numpy.float32:
+        elif self.dtype.type not in histogram.FIXED_RANGE_DTYPES:
             return self.image_max
         else:
             return float(self.image.valid_range[1])
@@ -371,6 +786,8 @@ class Layer(qt_property.QtPropertyOwner):
                 self.max = self.histogram_max
         finally:
             self._retain_auto_min_max_on_min_max_change = False
+        if self.image is not None:
+            self.histogram_ready.emit(self)
         if self.image is not None and self.auto_min_max:
             self.do_auto_min_max()
 
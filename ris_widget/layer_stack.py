@@ -38,10 +38,12 @@ class LayerStack(Qt.QObject):
     its current value.
     * focused_image_changed(new_focused_image): The image of the currently-focused layer has changed, either because the foused layer
     itself has changed, or the image in that layer was replaced or modified in-place.
+    * histogram_ready(layer): relayed from the histogram_ready signal of any layer in the stack.
 
     """
     layer_focus_changed = Qt.pyqtSignal(Qt.QObject, object, object)
     focused_image_changed = Qt.pyqtSignal(object)
+    histogram_ready = Qt.pyqtSignal(object)
 
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -54,6 +56,8 @@ class LayerStack(Qt.QObject):
         self.layer_focus_changed.connect(self._on_layer_focus_changed)
 
         self._histogram_mask = None
+        self._histogram_mask_overlay = None
+        self._auto_min_max_percentiles = None
         self._selection_model = None
         self.auto_min_max_all_action = Qt.QAction(self)
         self.auto_min_max_all_action.setText('Auto Min/Max')
@@ -154,12 +158,42 @@ class LayerStack(Qt.QObject):
 
     @property
     def histogram_mask(self):
+        """The histogram_mask applied to every Layer in the stack, including those added later.
+        May be set to anything Layer.histogram_mask accepts. If set to a RectROI, EllipseROI, or
+        Polyline overlay, the mask follows the overlay as it is edited in the GUI."""
         return self._histogram_mask
 
     @histogram_mask.setter
     def histogram_mask(self, r):
-        for layer in self.layers:
-            layer.histogram_mask = r
+        if self._histogram_mask_overlay is not None:
+            self._histogram_mask_overlay.geometry_change_callbacks.remove(self._on_histogram_mask_overlay_changed)
+            self._histogram_mask_overlay = None
+        if hasattr(r, 'geometry_change_callbacks'):
+            r.geometry_change_callbacks.append(self._on_histogram_mask_overlay_changed)
+            self._histogram_mask_overlay = r
+        self._set_histogram_mask(layer.coerce_to_histogram_mask(r))
+
+    def _set_histogram_mask(self, mask):
+        self._histogram_mask = mask
+        for l in self.layers:
+            l.histogram_mask = mask
+
+    def _on_histogram_mask_overlay_changed(self, geometry):
+        self._set_histogram_mask(layer.coerce_to_histogram_mask(self._histogram_mask_overlay))
+
+    @property
+    def auto_min_max_percentiles(self):
+        """If not None, the (low, high) auto_min_max_percentiles applied to every Layer in the stack,
+        including those added later."""
+        return self._auto_min_max_percentiles
+
+    @auto_min_max_percentiles.setter
+    def auto_min_max_percentiles(self, v):
+        if v is not None:
+            v = layer.coerce_to_percentiles(v)
+            for l in self.layers:
+                l.auto_min_max_percentiles = v
+        self._auto_min_max_percentiles = v
 
     def ensure_layer_focused(self):
         """If we have both a layer list & selection model and no Layer is selected & .layers is not empty:
@@ -178,15 +212,19 @@ class LayerStack(Qt.QObject):
         auto_min_max_all = self.auto_min_max_all
         for layer in layers:
             layer.histogram_mask = self.histogram_mask
+            if self._auto_min_max_percentiles is not None:
+                layer.auto_min_max_percentiles = self._auto_min_max_percentiles
             if auto_min_max_all:
                 layer.auto_min_max = True
             # can connect without worrying that it's already connected because LayerList guarantees
             # that a given layer can only be in the lost
             layer.auto_min_max_changed.connect(self._on_layer_auto_min_max_changed)
+            layer.histogram_ready.connect(self.histogram_ready)
 
     def _detach_layers(self, layers):
         for layer in layers:
             layer.auto_min_max_changed.disconnect(self._on_layer_auto_min_max_changed)
+            layer.histogram_ready.disconnect(self.histogram_ready)
 
     def _on_inserting_into_layers(self, idx, inserted_layers):
         self._attach_layers(inserted_layers)
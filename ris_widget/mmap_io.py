@@ -0,0 +1,186 @@
+# This code is licensed under the MIT License (see LICENSE file for details)
+
+"""Memory-mapped reading of uncompressed image files: .npy files, raw pixel dumps, and uncompressed
+(single- or multi-page, classic or BigTIFF) TIFF files.
+
+The arrays returned are read-only views of the files' contents, mapped into memory without reading
+them: pages of the file are read by the OS only as they are touched (e.g. when the image is drawn
+or histogrammed), and may be dropped from the page cache again under memory pressure. So image.Image
+can wrap them without copying, and stacks much larger than the available RAM can be browsed.
+
+Arrays are returned in the (x, y[, c]) layout of image.Image: the rows of raw and TIFF files are
+mapped as rows in which x varies fastest. .npy files are assumed to have been saved in that layout
+too, e.g. by numpy.save(path, image.data). Data must be stored in native byte order, and TIFF pixel
+data for each page must be contiguous (one or more adjacent strips, not tiles), or NotMappableError
+is raised: such files must be read, e.g. by freeimage, instead.
+
+Each mapped file holds an open file descriptor, so, when first used, this module raises the limit on
+open files to the maximum permitted. Multi-page TIFFs share one mapping for all their pages.
+"""
+
+import pathlib
+import struct
+
+import numpy
+
+# file suffixes that may be read by read()
+SUFFIXES = ('.npy', '.tif', '.tiff')
+
+class NotMappableError(ValueError):
+    """Raised if a file is not of a format that can be mapped into memory as an image."""
+    pass
+
+def read(path):
+    """Return the image in the .npy or TIFF file at path (the first page, for a multi-page TIFF)
+    as a read-only, memory-mapped array."""
+    path = pathlib.Path(path)
+    suffix = path.suffix.lower()
+    if suffix == '.npy':
+        return read_npy(path)
+    elif suffix in ('.tif', '.tiff'):
+        return read_tiff_pages(path, max_pages=1)[0]
+    raise NotMappableError('Cannot memory-map files of type "{}".'.format(path.suffix))
+
+def read_npy(path):
+    """Return the 2D (x, y) or 3D (x, y, c) array in the .npy file at path, memory-mapped read-only."""
+    _raise_open_file_limit()
+    try:
+        data = numpy.load(str(path), mmap_mode='r')
+    except ValueError as e:
+        # e.g. object arrays, which cannot be mapped
+        raise NotMappableError(str(e))
+    if data.ndim not in (2, 3):
+        raise NotMappableError('{} contains a {}D array, not an image.'.format(path, data.ndim))
+    _check_byte_order(data.dtype, path)
+    return data
+
+def read_raw(path, shape, dtype, offset=0):
+    """Return a read-only, memory-mapped (x, y[, c]) array of the raw pixel data in the file at path,
+    which is stored starting at the given byte offset, with rows of x varying fastest. shape is the
+    (width, height) or (width, height, channels) of the image."""
+    _raise_open_file_limit()
+    dtype = numpy.dtype(dtype)
+    _check_byte_order(dtype, path)
+    w, h, *c = shape
+    data = numpy.memmap(str(path), dtype=dtype, mode='r', offset=offset, shape=(h, w, *c))
+    return data.swapaxes(0, 1)
+
+def read_tiff_pages(path, max_pages=None):
+    """Return a list of read-only, memory-mapped (x, y[, c]) arrays of the pages of the uncompressed TIFF
+    file at path (or of no more than max_pages of them)."""
+    with open(str(path), 'rb') as f:
+        pages = _tiff_pages(f, path, max_pages)
+    _raise_open_file_limit()
+    whole = numpy.memmap(str(path), dtype=numpy.uint8, mode='r')
+    arrays = []
+    for offset, dtype, shape in pages:
+        data = numpy.ndarray(shape, dtype=dtype, buffer=whole, offset=offset)
+        arrays.append(data.swapaxes(0, 1))
+    return arrays
+
+# TIFF field type: struct format
+_TIFF_FIELD_TYPES = {1: 'B', 3: 'H', 4: 'I', 16: 'Q'}
+# TIFF SampleFormat: numpy dtype kind
+_TIFF_SAMPLE_FORMATS = {1: 'u', 2: 'i', 3: 'f'}
+
+def _tiff_pages(f, path, max_pages):
+    # return a list of (offset, dtype, (height, width[, samples])) of the pages of the TIFF file f
+    header = f.read(16)
+    byte_order = {b'II': '<', b'MM': '>'}.get(header[:2])
+    if byte_order is None or len(header) < 8:
+        raise NotMappableError('{} is not a TIFF file.'.format(path))
+    magic = struct.unpack(byte_order + 'H', header[2:4])[0]
+    if magic == 42:
+        ifd_offset = struct.unpack(byte_order + 'I', header[4:8])[0]
+        count_format, entry_format, value_size = 'H', 'HHI4s', 4
+    elif magic == 43:
+        # BigTIFF
+        ifd_offset = struct.unpack(byte_order + 'Q', header[8:16])[0]
+        count_format, entry_format, value_size = 'Q', 'HHQ8s', 8
+    else:
+        raise NotMappableError('{} is not a TIFF file.'.format(path))
+    count_size = struct.calcsize(count_format)
+    entry_size = struct.calcsize(byte_order + entry_format)
+    pages = []
+    while ifd_offset and (max_pages is None or len(pages) < max_pages):
+        f.seek(ifd_offset)
+        entry_count = struct.unpack(byte_order + count_format, f.read(count_size))[0]
+        entries = f.read(entry_count * entry_size)
+        ifd_offset = struct.unpack(byte_order + count_format.replace('H', 'I'), f.read(value_size))[0]
+        tags = {}
+        for i in range(entry_count):
+            tag, field_type, count, value = struct.unpack_from(byte_order + entry_format, entries, i * entry_size)
+            value_format = _TIFF_FIELD_TYPES.get(field_type)
+            if value_format is None:
+                # ASCII, rational, &c. fields are not needed
+                continue
+            value_format = '{}{}{}'.format(byte_order, count, value_format)
+            size = struct.calcsize(value_format)
+            if size > value_size:
+                position = f.tell()
+                f.seek(struct.unpack(byte_order + count_format.replace('H', 'I'), value)[0])
+                value = f.read(size)
+                f.seek(position)
+            tags[tag] = struct.unpack_from(value_format, value)
+        pages.append(_tiff_page(tags, byte_order, path))
+    return pages
+
+def _tiff_page(tags, byte_order, path):
+    def tag(number, default=None):
+        values = tags.get(number)
+        if values is None:
+            if default is None:
+                raise NotMappableError('{} lacks required TIFF tag {}.'.format(path, number))
+            return default
+        return values[0]
+    width, height = tag(256), tag(257)
+    samples = tag(277, 1)
+    bits = set(tags.get(258, (1,)))
+    sample_formats = set(tags.get(339, (1,)))
+    if tag(259, 1) != 1:
+        raise NotMappableError('{} is compressed.'.format(path))
+    if samples > 1 and tag(284, 1) != 1:
+        raise NotMappableError('{} stores color channels in separate planes.'.format(path))
+    if 322 in tags:
+        raise NotMappableError('{} is tiled.'.format(path))
+    if len(bits) != 1 or len(sample_formats) != 1:
+        raise NotMappableError('{} has channels of differing types.'.format(path))
+    bits, = bits
+    sample_format, = sample_formats
+    if bits not in (8, 16, 32, 64) or sample_format not in _TIFF_SAMPLE_FORMATS:
+        raise NotMappableError('{} has {}-bit samples of format {}.'.format(path, bits, sample_format))
+    dtype = numpy.dtype('{}{}{}'.format(byte_order, _TIFF_SAMPLE_FORMATS[sample_format], bits // 8))
+    _check_byte_order(dtype, path)
+    offsets, byte_counts = tags.get(273), tags.get(279)
+    if not offsets or byte_counts is None or len(offsets) != len(byte_counts):
+        raise NotMappableError('{} lacks strip offsets.'.format(path))
+    for offset, byte_count, next_offset in zip(offsets, byte_counts, offsets[1:]):
+        if offset + byte_count != next_offset:
+            raise NotMappableError('{} has non-contiguous strips.'.format(path))
+    shape = (height, width) if samples == 1 else (height, width, samples)
+    if sum(byte_counts) < numpy.prod(shape) * dtype.itemsize:
+        raise NotMappableError('{} has less pixel data than its size requires.'.format(path))
+    return offsets[0], dtype, shape
+
+def _check_byte_order(dtype, path):
+    if not dtype.isnative:
+        raise NotMappableError('{} is not in native byte order.'.format(path))
+
+_open_file_limit_raised = False
+def _raise_open_file_limit():
+    # a flipbook of thousands of mapped files holds thousands of file descriptors
+    global _open_file_limit_raised
+    if _open_file_limit_raised:
+        return
+    _open_file_limit_raised = True
+    try:
+        import resource
+    except ImportError:
+        # e.g. on Windows
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
@@ -9,9 +9,12 @@ from PyQt5 import Qt
 from . import shader_item
 from .. import shared_resources
 from .. import internal_util
+from ..histogram import FIXED_RANGE_DTYPES
 
 class HistogramItem(shader_item.ShaderItem):
     QGRAPHICSITEM_TYPE = shared_resources.generate_unique_qgraphicsitem_type()
+    # histograms with more bins than this are drawn via a 2D texture, downsampled in the fragment shader
+    MAX_1D_BINS = 1024
 
     def __init__(self, layer_stack, graphics_item_parent=None):
         super().__init__(graphics_item_parent)
@@ -39,6 +42,8 @@ class HistogramItem(shader_item.ShaderItem):
             old_layer.max_changed.disconnect(self.max_item.arrow_item._on_value_changed)
             old_layer.histogram_min_changed.disconnect(self._on_layer_histogram_change)
             old_layer.histogram_max_changed.disconnect(self._on_layer_histogram_change)
+            old_layer.exact_histogram_changed.disconnect(self._on_layer_histogram_change)
+            old_layer.histogram_ready.disconnect(self._on_layer_histogram_change)
             old_layer.gamma_changed.disconnect(self.gamma_item._on_value_changed)
         self._connect_layer(new_layer)
 
@@ -50,6 +55,8 @@ class HistogramItem(shader_item.ShaderItem):
             layer.max_changed.connect(self.max_item.arrow_item._on_value_changed)
             layer.histogram_min_changed.connect(self._on_layer_histogram_change)
             layer.histogram_max_changed.connect(self._on_layer_histogram_change)
+            layer.exact_histogram_changed.connect(self._on_layer_histogram_change)
+            layer.histogram_ready.connect(self._on_layer_histogram_change)
             layer.gamma_changed.connect(self.gamma_item._on_value_changed)
         self._on_layer_histogram_change()
 
@@ -75,7 +82,19 @@ class HistogramItem(shader_item.ShaderItem):
                 qpainter.beginNativePainting()
                 estack.callback(qpainter.endNativePainting)
                 QGL = shared_resources.QGL()
-                desired_shader_type = 'G'
+                # Histograms with more bins than MAX_1D_BINS (e.g. exact histograms of 12- or 16-bit images) are
+                # stored in a 2D texture and downsampled to the view width by the fragment shader.
+                downsample = len(histogram) > self.MAX_1D_BINS
+                # For RGB(A) images, the R, G, and B histograms are overlaid on the luma histogram, with the
+                # four stored as the components of an RGBA texture.
+                channel_histograms = None if downsample else layer.channel_histograms
+                if downsample:
+                    desired_shader_type, frag_name = 'G_downsampled', 'histogram_item_downsampling_fragment_shader'
+                elif channel_histograms is not None:
+                    desired_shader_type, frag_name = 'rgb', 'histogram_item_rgb_fragment_shader'
+                else:
+                    desired_shader_type, frag_name = 'G', 'histogram_item_fragment_shader'
+                desired_tex_format = Qt.QOpenGLTexture.R32F if channel_histograms is None else Qt.QOpenGLTexture.RGBA32F
                 if desired_shader_type in self.progs:
                     prog = self.progs[desired_shader_type]
                     if not QGL.glIsProgram(prog.programId()):
@@ -86,20 +105,27 @@ class HistogramItem(shader_item.ShaderItem):
                     prog = self.build_shader_prog(
                         desired_shader_type,
                         'planar_quad_vertex_shader',
-                        'histogram_item_fragment_shader')
-                desired_tex_width = len(histogram)
+                        frag_name)
+                if downsample:
+                    desired_tex_size = self.MAX_1D_BINS, int(math.ceil(len(histogram) / self.MAX_1D_BINS))
+                else:
+                    desired_tex_size = len(histogram), 1
                 tex = self._tex
                 if tex is not None:
-                    if tex.width() != desired_tex_width:
+                    if ((tex.width(), tex.height()) != desired_tex_size or (tex.target() == Qt.QOpenGLTexture.Target2D) != downsample or
+                            tex.format() != desired_tex_format):
                         tex.destroy()
                         tex = None
                 if tex is None:
-                    tex = Qt.QOpenGLTexture(Qt.QOpenGLTexture.Target1D)
-                    tex.setFormat(Qt.QOpenGLTexture.R32F)
+                    tex = Qt.QOpenGLTexture(Qt.QOpenGLTexture.Target2D if downsample else Qt.QOpenGLTexture.Target1D)
+                    tex.setFormat(desired_tex_format)
                     tex.setWrapMode(Qt.QOpenGLTexture.ClampToEdge)
                     tex.setMipLevels(1)
                     tex.setAutoMipMapGenerationEnabled(False)
-                    tex.setSize(desired_tex_width)
+                    if downsample:
+                        tex.setSize(*desired_tex_size)
+                    else:
+                        tex.setSize(desired_tex_size[0])
                     tex.allocateStorage()
                     # tex stores histogram bin counts - values that are intended to be addressed by element without
                     # interpolation.  Thus, nearest neighbor for texture filtering.
@@ -111,12 +137,40 @@ class HistogramItem(shader_item.ShaderItem):
                     tex.bind()
                     estack.callback(tex.release)
                 max_bin_val = histogram.max()
+                if channel_histograms is not None:
+                    max_bin_val = max(max_bin_val, channel_histograms.max())
                 if self._hist_tex_needs_upload:
-                    GL.glTexSubImage1D(
-                        GL.GL_TEXTURE_1D, 0, 0, desired_tex_width, GL.GL_RED,
-                        GL.GL_UNSIGNED_INT,
-                        memoryview(histogram)
-                    )
+                    if downsample:
+                        width = desired_tex_size[0]
+                        full_rows, remainder = divmod(len(histogram), width)
+                        if full_rows:
+                            GL.glTexSubImage2D(
+                                GL.GL_TEXTURE_2D, 0, 0, 0, width, full_rows, GL.GL_RED,
+                                GL.GL_UNSIGNED_INT,
+                                memoryview(histogram[:full_rows*width])
+                            )
+                        if remainder:
+                            GL.glTexSubImage2D(
+                                GL.GL_TEXTURE_2D, 0, 0, full_rows, remainder, 1, GL.GL_RED,
+                                GL.GL_UNSIGNED_INT,
+                                memoryview(histogram[full_rows*width:])
+                            )
+                    elif channel_histograms is not None:
+                        # interleave as (luma, R, G, B) texels
+                        texels = numpy.empty((len(histogram), 4), dtype=numpy.uint32)
+                        texels[:,0] = histogram
+                        texels[:,1:] = channel_histograms.T
+                        GL.glTexSubImage1D(
+                            GL.GL_TEXTURE_1D, 0, 0, desired_tex_size[0], GL.GL_RGBA,
+                            GL.GL_UNSIGNED_INT,
+                            memoryview(texels)
+                        )
+                    else:
+                        GL.glTexSubImage1D(
+                            GL.GL_TEXTURE_1D, 0, 0, desired_tex_size[0], GL.GL_RED,
+                            GL.GL_UNSIGNED_INT,
+                            memoryview(histogram)
+                        )
                     self._hist_tex_needs_upload = False
                     self._tex = tex
                 glQuad = shared_resources.GL_QUAD()
@@ -139,6 +193,10 @@ class HistogramItem(shader_item.ShaderItem):
                 prog.setUniformValue('tex', 0)
                 dpi_ratio = widget.devicePixelRatio()
                 prog.setUniformValue('inv_view_size', 1/(dpi_ratio * widget_size.width()), 1/(dpi_ratio * widget_size.height()))
+                if downsample:
+                    prog.setUniformValue('inv_tex_size', 1/desired_tex_size[0], 1/desired_tex_size[1])
+                    prog.setUniformValue('tex_width', float(desired_tex_size[0]))
+                    prog.setUniformValue('bin_count', float(len(histogram)))
                 inv_max_transformed_bin_val = max_bin_val**-self.gamma_gamma
                 prog.setUniformValue('inv_max_transformed_bin_val', inv_max_transformed_bin_val)
                 prog.setUniformValue('gamma_gamma', self.gamma_gamma)
@@ -167,14 +225,26 @@ class HistogramItem(shader_item.ShaderItem):
                     hist_width = layer.histogram_max - hist_min
                     n_bins = len(histogram)
                     bin_width = hist_width / n_bins
-                    bin = int(self.contextual_info_pos.x() * n_bins)
+                    bin = min(max(int(self.contextual_info_pos.x() * n_bins), 0), n_bins - 1)
                     l, r = hist_min + bin * bin_width, hist_min + (bin + 1) * bin_width
-                    if image.data.dtype == numpy.float32:
+                    if layer.exact_histogram and image.data.dtype.type in FIXED_RANGE_DTYPES:
+                        bin_text = '{}'.format(int(hist_min) + bin)
+                    elif image.data.dtype.type not in FIXED_RANGE_DTYPES:
                         bin_text = '[{:.8g},{:.8g}{}'.format(l, r, ']' if bin == n_bins - 1 else ')')
                     else:
                         l, r = int(math.ceil(l)), int(math.floor(r))
                         bin_text = '{}'.format(l) if image.data.dtype == numpy.uint8 else '[{},{}]'.format(l, r)
                     text = bin_text + ': {}'.format(histogram[bin])
+                    if layer.channel_histograms is not None and len(layer.channel_histograms[0]) == n_bins:
+                        text += ' (R: {}, G: {}, B: {})'.format(*layer.channel_histograms[:, bin])
+                    total = histogram.sum(dtype=numpy.uint64)
+                    if total:
+                        # cumulative percentile at the bin's upper edge, for choosing layer.auto_min_max_percentiles
+                        text += ' ({:.4g}%)'.format(100 * histogram[:bin+1].sum(dtype=numpy.uint64) / total)
+                    if layer.nan_count or layer.inf_count:
+                        text += '; excluded: {} NaN, {} Inf'.format(layer.nan_count, layer.inf_count)
+                    if layer.histogram_is_preview:
+                        text += ' [subsampled preview]'
         self.scene().contextual_info_item.set_info_text(text)
 
     def _on_layer_histogram_change(self):
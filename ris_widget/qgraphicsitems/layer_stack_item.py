@@ -19,7 +19,8 @@ UNIFORM_SECTION = Template(textwrap.dedent("""\
     uniform float rescale_min_${tex_unit};
     uniform float rescale_range_${tex_unit};
     uniform float gamma_${tex_unit};
-    uniform vec4 tint_${tex_unit};"""))
+    uniform vec4 tint_${tex_unit};
+    uniform vec4 tile_${tex_unit};"""))
 
 COLOR_TRANSFORM = Template(textwrap.dedent("""\
     vec4 color_transform_${tex_unit}(vec4 in_, vec4 tint, float rescale_min, float rescale_range, float gamma_scalar)
@@ -33,7 +34,7 @@ COLOR_TRANSFORM = Template(textwrap.dedent("""\
 
 MAIN_SECTION = Template(textwrap.dedent("""\
         // layer_stack[${layer_index}]
-        s = texture2D(tex_${tex_unit}, tex_coord);
+        s = texture2D(tex_${tex_unit}, (${tex_coord} - tile_${tex_unit}.xy) * tile_${tex_unit}.zw);
         s = color_transform_${tex_unit}(${getcolor_expression}, tint_${tex_unit}, rescale_min_${tex_unit}, rescale_range_${tex_unit}, gamma_${tex_unit});
         sca = s.rgb * s.a;
     ${blend_function}
@@ -235,24 +236,42 @@ class LayerStackItem(shader_item.ShaderItem):
         qpainter.beginNativePainting()
         with ExitStack() as estack:
             estack.callback(qpainter.endNativePainting)
-            visible_layer_indices = self._get_visible_layer_indices_and_update_texs()
+            if widget is None:
+                # We are being called as a result of a BaseView.snapshot(..) invocation, which may render
+                # any part of the scene, so no tiles may be skipped as being out of view
+                widget = self.scene().views()[0].gl_widget
+                view_rect = None
+            else:
+                view = widget.view
+                visible_rect = self.mapFromScene(view.mapToScene(view.viewport().rect())).boundingRect()
+                rect = self.boundingRect()
+                # the part of the item in view, in the normalized coordinates of the unit square it is mapped onto
+                view_rect = ((visible_rect.left() - rect.left()) / rect.width(), (visible_rect.top() - rect.top()) / rect.height(),
+                             (visible_rect.right() - rect.left()) / rect.width(), (visible_rect.bottom() - rect.top()) / rect.height())
+                if view_rect[2] <= 0 or view_rect[3] <= 0 or view_rect[0] >= 1 or view_rect[1] >= 1:
+                    return
+            zoom = widget.view.zoom * widget.devicePixelRatio()
+            visible_layer_indices, textures = self._get_visible_layer_indices_and_update_texs(zoom, view_rect)
             if not visible_layer_indices:
                 return
             layer_indices = [(tex_unit, layer_index, self.layer_stack.layers[layer_index]) for tex_unit, layer_index in enumerate(visible_layer_indices)]
             prog_desc = tuple((layer.getcolor_expression,
                                layer.blend_function if tex_unit > 0 else 'src',
-                               layer.transform_section)
-                              for tex_unit, layer_index, layer in layer_indices)
+                               layer.transform_section,
+                               texture.transposed)
+                              for (tex_unit, layer_index, layer), (texture, mipmaps) in zip(layer_indices, textures))
             if prog_desc in self.progs:
                 prog = self.progs[prog_desc]
             else:
                 uniforms = [UNIFORM_SECTION.substitute(tex_unit=tex_unit) for tex_unit, layer_index, layer in layer_indices]
                 color_transforms = [COLOR_TRANSFORM.substitute(tex_unit=tex_unit, transform_section=layer.transform_section)
                                     for tex_unit, layer_index, layer in layer_indices]
+                # textures of images in which y varies fastest are stored transposed
                 mains = [MAIN_SECTION.substitute(layer_index=layer_index, tex_unit=tex_unit,
+                                                 tex_coord='tex_coord.yx' if texture.transposed else 'tex_coord',
                                                  getcolor_expression=layer.getcolor_expression,
                                                  blend_function=layer.BLEND_FUNCTIONS[layer.blend_function] if tex_unit > 0 else SRC_BLEND)
-                         for tex_unit, layer_index, layer in layer_indices]
+                         for (tex_unit, layer_index, layer), (texture, mipmaps) in zip(layer_indices, textures)]
 
                 prog = self.build_shader_prog(
                     prog_desc,
@@ -263,9 +282,6 @@ class LayerStackItem(shader_item.ShaderItem):
                     main='\n'.join(mains))
             prog.bind()
             estack.callback(prog.release)
-            if widget is None:
-                # We are being called as a result of a BaseView.snapshot(..) invocation
-                widget = self.scene().views()[0].gl_widget
             glQuad = shared_resources.GL_QUAD()
             glQuad.buffer.bind()
             estack.callback(glQuad.buffer.release)
@@ -324,34 +340,83 @@ class LayerStackItem(shader_item.ShaderItem):
                 prog.setUniformValue(f'tint_{tex_unit}', Qt.QVector4D(*layer.tint))
             self.set_blend(estack)
             QGL.glEnableClientState(QGL.GL_VERTEX_ARRAY)
-            QGL.glDrawArrays(QGL.GL_TRIANGLE_FAN, 0, 4)
+            # Images too large for a single texture are drawn one cell of the combined tile grid of all the
+            # layers at a time, with the tile of each layer covering that cell bound in its texture unit.
+            # Fragments outside the cell are discarded, and cells that are out of view are not drawn at all.
+            for tile_rect, tiles in self._tile_passes([texture for texture, mipmaps in textures], view_rect):
+                prog.setUniformValue('tile_rect', Qt.QVector4D(*tile_rect))
+                for tex_unit, ((texture, mipmaps), tile) in enumerate(zip(textures, tiles)):
+                    if len(texture.tiles) > 1:
+                        texture.bind(tex_unit, mipmaps=mipmaps, tile=tile)
+                    prog.setUniformValue(f'tile_{tex_unit}', Qt.QVector4D(*texture.tile_transform(tile)))
+                QGL.glDrawArrays(QGL.GL_TRIANGLE_FAN, 0, 4)
         if self._new_image:
             self.new_image_painted.emit()
             self._new_image = False
 
+    @staticmethod
+    def _tile_passes(textures, view_rect):
+        """Return a list of (tile_rect, tiles) pairs, one for each cell of the grid formed by the tile edges of
+        all the textures that intersects view_rect ((left, top, right, bottom) in the normalized coordinates of
+        the unit square onto which the item is mapped, or None for all of it). tile_rect is the cell's
+        (left, top, right, bottom), in the same coordinates, and tiles is the index of the tile of each texture
+        that covers it. Right and bottom edges at the item's edge are pushed out past 1, as the shader treats
+        them as exclusive."""
+        if all(len(texture.tiles) == 1 for texture in textures):
+            return [((0, 0, 2, 2), [0] * len(textures))]
+        x_edges = numpy.unique(numpy.concatenate([texture.image_tile_edges()[0] for texture in textures]))
+        y_edges = numpy.unique(numpy.concatenate([texture.image_tile_edges()[1] for texture in textures]))
+        vx0, vy0, vx1, vy1 = (0, 0, 1, 1) if view_rect is None else view_rect
+        passes = []
+        for y0, y1 in zip(y_edges[:-1], y_edges[1:]):
+            if y1 <= vy0 or y0 >= vy1:
+                continue
+            for x0, x1 in zip(x_edges[:-1], x_edges[1:]):
+                if x1 <= vx0 or x0 >= vx1:
+                    continue
+                cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+                tile_rect = x0, y0, x1 if x1 < 1 else 2, y1 if y1 < 1 else 2
+                passes.append((tile_rect, [texture.tile_at(cx, cy) for texture in textures]))
+        return passes
+
     @staticmethod
     def _normalize_for_gl(v, image):
         """Some things to note:
-        * OpenGL normalizes uint16 data uploaded to float32 texture for the full uint16 range.  We store
+        * OpenGL normalizes uint16 data uploaded to float32 texture for the full uint16 range, and samples
+        the normalized (GL_R16, GL_R8, GL_R16_SNORM) textures used for 8- and 16-bit data the same way.  We store
         our unpacked 12-bit images in uint16 arrays.  Therefore, OpenGL will normalize by dividing by
         65535, even though no 12-bit image will have a component value larger than 4095.
-        * float32 data uploaded to float32 texture is not normalized"""
+        * Likewise, other integer data is normalized for the full range of its type: unsigned types to [0, 1]
+        and signed types to [-1, 1] (dividing by 32767 for int16, for example).
+        * float32 data uploaded to float32 texture is not normalized, nor is float64 data (which is
+        converted to float32 for upload)"""
         if image.data.dtype == numpy.uint16:
             v /= 65535
         elif image.data.dtype == numpy.uint8 or image.data.dtype == bool:
             v /= 255
-        elif image.data.dtype == numpy.float32:
+        elif image.data.dtype == numpy.int16:
+            v /= 32767
+        elif image.data.dtype == numpy.uint32:
+            v /= 2**32 - 1
+        elif image.data.dtype == numpy.int32:
+            v /= 2**31 - 1
+        elif image.data.dtype in (numpy.float32, numpy.float64):
             pass
         else:
             raise NotImplementedError('OpenGL-compatible normalization for {} missing.'.format(image.data.dtype))
         return v
 
-    def _get_visible_layer_indices_and_update_texs(self):
+    def _get_visible_layer_indices_and_update_texs(self, zoom=1, view_rect=None):
         """Meant to be executed between a pair of QPainter.beginNativePainting() QPainter.endNativePainting() calls or,
         at the very least, when an OpenGL context is current, _get_visible_layer_indices_and_update_texs does whatever is required,
-        for every visible layer with non-None .layer in self.layer_stack, in order that self._texs[layer] represents layer, including texture
-        object creation and texture data uploading, and it leaves self._texs[layer] bound to texture unit n, where n is
-        the associated visible_layer_index."""
+        for every visible layer with non-None .layer in self.layer_stack, in order that its texture represents layer, including texture
+        object creation and texture data uploading, and it leaves that texture bound to texture unit n, where n is
+        the associated visible_layer_index. (Textures of more than one tile are instead bound a tile at a time, as drawn.)
+
+        The texture is that returned by Layer.texture_for_view for the layer drawn at zoom device pixels per item
+        unit, with view_rect (in normalized item coordinates; None for all of it) in view. Returns visible_layer_indices
+        and a parallel list of (texture, mipmaps) pairs, where mipmaps is True for the textures of layers with use_mipmaps
+        set that are drawn smaller than 1:1, which are bound with their mipmaps."""
         layer_stack = self.layer_stack
         if layer_stack.examine_layer_mode:
             layer_index = layer_stack.focused_layer_idx
@@ -361,9 +426,19 @@ class LayerStackItem(shader_item.ShaderItem):
         else:
             visible_layer_indices = []
         bound = set()
+        textures = []
         for tex_unit, layer_index in enumerate(visible_layer_indices):
-            texture = layer_stack.layers[layer_index].texture
+            layer = layer_stack.layers[layer_index]
+            scale = zoom * self.boundingRect().width() / layer.image.size.width()
+            texture, texture_scale = layer.texture_for_view(scale, view_rect)
+            # mipmaps are needed only if the texture is drawn with fewer device pixels than it has texels
+            mipmaps = texture_scale < 1 and layer.use_mipmaps
+            textures.append((texture, mipmaps))
             if texture not in bound:
-                texture.bind(tex_unit)
+                if texture.status == 'uploading':
+                    # the tiles are laid out by the first upload, on the upload thread
+                    texture.ready.wait()
+                if len(texture.tiles) == 1:
+                    texture.bind(tex_unit, mipmaps=mipmaps)
                 bound.add(texture)
-        return visible_layer_indices
\ No newline at end of file
+        return visible_layer_indices, textures
\ No newline at end of file
@@ -95,8 +95,8 @@ class LayerStackPainterItem(Qt.QGraphicsObject):
             r.setBottom(target_height - 1)
         x1, x2, y1, y2 = r.left(), r.right(), r.top(), r.bottom()
         brush.apply(self.target_image.data[x1:x2+1, y1:y2+1], br)
-        w = x2 - x1
-        h = y2 - y1
+        w = x2 - x1 + 1
+        h = y2 - y1 + 1
         self.target_image.refresh((x1, y1, w, h))
         return True
 
@@ -0,0 +1,41 @@
+#version 120
+#line 3
+// This code is licensed under the MIT License (see LICENSE file for details)
+
+// Used instead of histogram_item_fragment_shader for histograms with more bins than fit in a
+// 1D texture or in the view's width. The bins are stored in row-major order in the rows of a
+// 2D texture, and each column of fragments displays the largest of the bins it spans.
+
+uniform sampler2D tex;
+uniform vec2 inv_view_size;
+uniform vec2 inv_tex_size;
+uniform float tex_width;
+uniform float bin_count;
+uniform float inv_max_transformed_bin_val;
+uniform float gamma_gamma;
+uniform float opacity;
+
+const int MAX_BINS_PER_FRAGMENT = 65536;
+
+float get_bin_value(float bin)
+{
+    float row = floor(bin / tex_width);
+    float col = bin - row * tex_width;
+    return texture2D(tex, (vec2(col, row) + 0.5f) * inv_tex_size).r * 4294967295.0f;
+}
+
+void main()
+{
+    float first_bin = floor((gl_FragCoord.x - 0.5f) * inv_view_size.x * bin_count);
+    float end_bin = min(max(ceil((gl_FragCoord.x + 0.5f) * inv_view_size.x * bin_count), first_bin + 1.0f), bin_count);
+    float bin_value = 0.0f;
+    for (int i = 0; i < MAX_BINS_PER_FRAGMENT; ++i) {
+        float bin = first_bin + float(i);
+        if (bin >= end_bin) break;
+        bin_value = max(bin_value, get_bin_value(bin));
+    }
+    float bin_height = pow(bin_value, gamma_gamma) * inv_max_transformed_bin_val;
+    float intensity = 1.0f - clamp(floor((gl_FragCoord.y * inv_view_size.y) / bin_height), 0, 1);
+
+    gl_FragColor = vec4(intensity, intensity, intensity, intensity * opacity);
+}
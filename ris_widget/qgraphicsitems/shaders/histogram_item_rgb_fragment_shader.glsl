@@ -0,0 +1,24 @@
+#version 120
+#line 3
+// This code is licensed under the MIT License (see LICENSE file for details)
+
+// Used instead of histogram_item_fragment_shader for RGB(A) images: each texel holds the luma,
+// red, green, and blue bin counts in its r, g, b, and a components. The luma histogram is drawn
+// in gray as usual, with the red, green, and blue histograms overlaid in their own colors.
+
+uniform sampler1D tex;
+uniform vec2 inv_view_size;
+uniform float inv_max_transformed_bin_val;
+uniform float gamma_gamma;
+uniform float opacity;
+
+void main()
+{
+    vec4 bin_values = texture1D(tex, gl_FragCoord.x * inv_view_size.x) * 4294967295.0f;
+    vec4 bin_heights = pow(bin_values, vec4(gamma_gamma)) * inv_max_transformed_bin_val;
+    vec4 intensities = 1.0f - clamp(floor((gl_FragCoord.y * inv_view_size.y) / bin_heights), 0, 1);
+    vec3 color = clamp(0.4f * intensities.r + 0.6f * intensities.gba, 0, 1);
+    float alpha = max(intensities.r, max(intensities.g, max(intensities.b, intensities.a)));
+
+    gl_FragColor = vec4(color, alpha * opacity);
+}
@@ -5,6 +5,7 @@
 uniform float layer_stack_item_opacity;
 uniform float viewport_height;
 uniform mat3 frag_to_tex;
+uniform vec4 tile_rect;
 $uniforms
 
 vec2 transform_frag_to_tex()
@@ -27,6 +28,8 @@ void main()
     float isa, ida, osa, oda, sada;
 
     if(tex_coord.x < 0.0f || tex_coord.x > 1.0f || tex_coord.y < 0.0f || tex_coord.y > 1.0f) discard;
+    // when drawing one tile of a tiled image, discard fragments outside of it
+    if(tex_coord.x < tile_rect.x || tex_coord.x >= tile_rect.z || tex_coord.y < tile_rect.y || tex_coord.y >= tile_rect.w) discard;
 
 $main
     gl_FragColor = vec4(dca / da, da * layer_stack_item_opacity);
@@ -1,16 +1,22 @@
 ﻿# This code is licensed under the MIT License (see LICENSE file for details)
 
 
+import collections
+import math
+import mmap
 import numpy
 import pathlib
 import glob
+import time
 from PyQt5 import Qt
 import os.path
 
 from ..object_model import uniform_signaling_list
 from ..object_model import drag_drop_model_behavior
 from ..object_model import property_table_model
+from .. import histogram
 from .. import image
+from .. import mmap_io
 from . import progress_thread_pool
 
 try:
@@ -48,6 +54,432 @@ class ImageList(uniform_signaling_list.UniformSignalingList):
     def take_input_element(self, obj):
         return obj if isinstance(obj, image.Image) else image.Image(obj)
 
+class LazyImageList(ImageList):
+    """Flipbook page of image files that are read only when the page is shown (see Flipbook.apply), and
+    dropped again once the images of other, more recently shown lazy pages exceed page_cache.budget bytes.
+    Until it is loaded, the page is empty: only the paths and names of its images are kept."""
+    def __init__(self, image_paths, image_names=None, parent=None):
+        super().__init__(parent=parent)
+        self.image_paths = list(image_paths)
+        self.image_names = [str(path) for path in self.image_paths] if image_names is None else list(image_names)
+        self.loaded = False
+        # True while the page is shown by a Flipbook, which keeps it from being unloaded
+        self.shown = False
+
+    def read(self):
+        """Read and return the arrays of the page's images, without loading them into the page (which
+        must be done on the GUI thread, whereas this may be called from any)."""
+        return [_read_image(pathlib.Path(path)) for path in self.image_paths]
+
+    def load(self, arrays=None):
+        """Load the page's images, if they are not already loaded, from arrays previously returned by
+        read() (or by reading them now, if None), and mark the page as recently used."""
+        if not self.loaded:
+            if arrays is None:
+                arrays = self.read()
+            images = [image.Image(array, name=name) for array, name in zip(arrays, self.image_names)]
+            self.loaded = True
+            self[:] = images
+        page_cache.touch(self)
+
+    def unload(self):
+        """Drop the page's images, to be read again when next needed."""
+        if self.loaded:
+            self.loaded = False
+            page_cache.discard(self)
+            self.clear()
+
+class PageCache:
+    """LRU of the loaded LazyImageLists, shared by all Flipbooks. Once the images of the loaded pages
+    together exceed .budget bytes, the least recently used pages are unloaded (except for the most
+    recently used one, and those shown by a Flipbook)."""
+    def __init__(self, budget=2**30):
+        self.budget = budget
+        # LazyImageList: bytes of its images
+        self._pages = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._pages)
+
+    @property
+    def size(self):
+        return sum(self._pages.values())
+
+    def touch(self, page):
+        self._pages[page] = sum(image.data.nbytes for image in page)
+        self._pages.move_to_end(page)
+        size = self.size
+        for oldest in list(self._pages)[:-1]:
+            if size <= self.budget:
+                break
+            if not oldest.shown:
+                size -= self._pages[oldest]
+                oldest.unload()
+
+    def discard(self, page):
+        self._pages.pop(page, None)
+
+    def clear(self):
+        for page in list(self._pages):
+            page.unload()
+
+page_cache = PageCache()
+
+class _PrefetchDoneEvent(Qt.QEvent):
+    TYPE = Qt.QEvent.registerEventType()
+    def __init__(self, page, future):
+        super().__init__(self.TYPE)
+        self.page = page
+        self.future = future
+
+class PagePrefetcher(Qt.QObject):
+    """Reads the lazy pages that a Flipbook is likely to show next on its thread pool, so that they are
+    loaded before they are shown. Those are the next .ahead pages in the direction of navigation (or, when
+    navigating quickly, as many as are shown in .lookahead_time seconds, up to .max_ahead), and .behind
+    pages in the other direction, stepping by the size of the last move (so that, e.g., every other page is
+    read if only every other page is shown). No more pages are read than fit in page_cache.budget, and
+    reads of pages that leave this window are cancelled, if not yet started. Memory-mapped images are
+    read from disk too, rather than only when shown.
+
+    .hits and .misses count the lazy pages shown that were, and were not, already loaded, and .cancelled
+    the reads that were cancelled. .hit_rate is the fraction of hits, and .in_flight the number of reads
+    queued or running. .read_time is the (moving) average number of seconds a read takes. page_read is
+    emitted when a read finishes (or is cancelled)."""
+    page_read = Qt.pyqtSignal(object)
+
+    def __init__(self, flipbook, ahead=4, behind=2, max_ahead=32, lookahead_time=0.5):
+        super().__init__(flipbook)
+        self.flipbook = flipbook
+        self.ahead = ahead
+        self.behind = behind
+        self.max_ahead = max_ahead
+        self.lookahead_time = lookahead_time
+        self.enabled = True
+        self.hits = self.misses = self.cancelled = 0
+        self.read_time = None
+        # navigation direction (+1 or -1), step size, and speed in pages per second
+        self.direction = 1
+        self.step = 1
+        self.speed = 0
+        self._last_idx = None
+        self._last_time = None
+        # LazyImageList: future of the read of its arrays
+        self._futures = {}
+        self._window = set()
+
+    @property
+    def hit_rate(self):
+        shown = self.hits + self.misses
+        return self.hits / shown if shown else None
+
+    @property
+    def in_flight(self):
+        return len(self._futures)
+
+    def reset_stats(self):
+        self.hits = self.misses = self.cancelled = 0
+
+    def is_reading(self, page):
+        """True if page is being (or is queued to be) read."""
+        return page in self._futures
+
+    def load(self, page):
+        """Load the lazy page, which is about to be shown, using its prefetched arrays if they are ready
+        or on their way."""
+        arrays = None
+        if page.loaded:
+            self.hits += 1
+        else:
+            self.misses += 1
+            future = self._futures.pop(page, None)
+            if future is not None and future.cancel():
+                self.cancelled += 1
+            elif future is not None:
+                try:
+                    arrays, read_time = future.result()
+                except Exception:
+                    # read again below, letting the error propagate this time
+                    pass
+        page.load(arrays)
+
+    def update(self, idx, step=None):
+        """Note that page idx is now shown, and start reading the pages around it. If step is given, it
+        is used instead of the size of the last move as the step between the pages read."""
+        now = time.perf_counter()
+        if self._last_idx is not None and idx != self._last_idx:
+            move = idx - self._last_idx
+            self.direction = 1 if move > 0 else -1
+            self.step = abs(move)
+            elapsed = now - self._last_time
+            if elapsed > 0:
+                # exponential moving average, to ride out irregular timing
+                self.speed = 0.7 * self.speed + 0.3 * self.step / elapsed
+        if step is not None:
+            self.step = step
+        self._last_idx, self._last_time = idx, now
+        pages = self.flipbook.pages
+        page_count = len(pages)
+        window = []
+        if self.enabled and page_count > 1:
+            ahead = min(self.max_ahead, max(self.ahead, math.ceil(self.speed / self.step * self.lookahead_time)))
+            behind = self.behind
+            # no more pages than fit in the budget alongside the current one, judging by the loaded pages' size
+            if len(page_cache):
+                page_size = max(page_cache.size / len(page_cache), 1)
+                fit = max(int(page_cache.budget // page_size) - 1, 0)
+                ahead = min(ahead, fit)
+                behind = min(behind, fit - ahead)
+            offsets = [self.direction * self.step * i for i in range(1, ahead + 1)]
+            offsets += [-self.direction * self.step * i for i in range(1, behind + 1)]
+            # (wrapping around, as playback does)
+            window = [pages[(idx + offset) % page_count] for offset in offsets]
+        self._window = set(window)
+        for page, future in list(self._futures.items()):
+            if page not in self._window and future.cancel():
+                del self._futures[page]
+                self.cancelled += 1
+        for page in window:
+            if isinstance(page, LazyImageList) and not page.loaded and page not in self._futures:
+                future = self.flipbook._get_thread_pool().submit(_prefetch_page, page, show_progress=False)
+                self._futures[page] = future
+                future.add_done_callback(lambda future, page=page:
+                    Qt.QApplication.instance().postEvent(self, _PrefetchDoneEvent(page, future)))
+
+    def cancel(self):
+        """Cancel all queued reads."""
+        for page, future in list(self._futures.items()):
+            if future.cancel():
+                del self._futures[page]
+                self.cancelled += 1
+        self._window = set()
+
+    def event(self, e):
+        if e.type() == _PrefetchDoneEvent.TYPE:
+            if self._futures.get(e.page) is e.future:
+                del self._futures[e.page]
+                if not e.future.cancelled():
+                    error = e.future.exception()
+                    # pages that have left the window since are not loaded, lest they push out those in it
+                    if error is None:
+                        arrays, read_time = e.future.result()
+                        self.read_time = read_time if self.read_time is None else 0.7 * self.read_time + 0.3 * read_time
+                        if e.page in self._window and not e.page.loaded:
+                            e.page.load(arrays)
+            self.page_read.emit(e.page)
+            return True
+        return super().event(e)
+
+class PlaybackScheduler(Qt.QObject):
+    """Plays a Flipbook's pages at .fps frames per second of wall-clock time. Each frame is shown when it
+    is due, rather than a fixed interval after the last, and frames already past due (because showing
+    the last took too long) are skipped. If the page due is still being read by the Flipbook's
+    prefetcher, playback either waits for it and then carries on at the same rate (if .starved_policy
+    is 'wait'), or drops frames until a page that is loaded is due (if 'drop'), reading pages as far
+    ahead, and as far apart, as needed to keep pace.
+
+    .achieved_fps is the rate at which the last few frames were shown, .dropped_frames the number of
+    frames skipped or dropped since playback started, and .stalls and .stall_time the number of waits
+    for the prefetcher and the seconds spent waiting. stats_changed is emitted about twice a second
+    during playback, and when it stops."""
+    stats_changed = Qt.pyqtSignal(object)
+    STARVED_POLICIES = ('wait', 'drop')
+
+    def __init__(self, flipbook, fps=30, starved_policy='wait'):
+        super().__init__(flipbook)
+        self.flipbook = flipbook
+        self.starved_policy = starved_policy
+        self.timer = Qt.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setTimerType(Qt.Qt.PreciseTimer)
+        self.timer.timeout.connect(self._tick)
+        self._playing = False
+        self._wait_start = None
+        self.fps = fps
+        self.reset_stats()
+        flipbook.prefetcher.page_read.connect(self._on_page_read)
+
+    @property
+    def fps(self):
+        return self._fps
+
+    @fps.setter
+    def fps(self, fps):
+        if fps <= 0:
+            raise ValueError('fps must be positive.')
+        self._fps = fps
+        if self._playing:
+            self._restart_clock()
+            self._schedule()
+
+    @property
+    def starved_policy(self):
+        return self._starved_policy
+
+    @starved_policy.setter
+    def starved_policy(self, policy):
+        if policy not in self.STARVED_POLICIES:
+            raise ValueError('starved_policy must be one of {}.'.format(', '.join(self.STARVED_POLICIES)))
+        self._starved_policy = policy
+
+    @property
+    def playing(self):
+        return self._playing
+
+    @property
+    def achieved_fps(self):
+        times = self._show_times
+        if len(times) < 2 or times[-1] == times[0]:
+            return None
+        return (len(times) - 1) / (times[-1] - times[0])
+
+    def reset_stats(self):
+        self.dropped_frames = self.stalls = 0
+        self.stall_time = 0
+        # times at which the last few frames were shown
+        self._show_times = collections.deque(maxlen=32)
+        self._last_report = 0
+
+    def start(self):
+        self.reset_stats()
+        self._playing = True
+        self._restart_clock()
+        self._schedule()
+
+    def stop(self):
+        self._playing = False
+        self._wait_start = None
+        self.timer.stop()
+        self.stats_changed.emit(self)
+
+    def _restart_clock(self):
+        # frame 0 is the page shown now, and frame n is due n / fps seconds later
+        self._start_time = time.perf_counter()
+        self._start_idx = self._shown_idx = self.flipbook.current_page_idx
+        self._frame = 0
+        self._wait_start = None
+
+    def _schedule(self):
+        due = self._start_time + (self._frame + 1) / self._fps
+        self.timer.start(max(0, math.ceil((due - time.perf_counter()) * 1000)))
+
+    def _on_page_read(self, page):
+        if self._playing and self._wait_start is not None:
+            self._tick()
+
+    def _tick(self):
+        flipbook = self.flipbook
+        page_count = len(flipbook.pages)
+        if not self._playing or page_count == 0:
+            return
+        if flipbook.current_page_idx != self._shown_idx:
+            # navigated elsewhere during playback (or pages were added or removed): carry on from there
+            self._restart_clock()
+        now = time.perf_counter()
+        if self._wait_start is None:
+            frame = max(int((now - self._start_time) * self._fps), self._frame + 1)
+        else:
+            frame = self._wait_frame
+        idx = (self._start_idx + frame) % page_count
+        page = flipbook.pages[idx]
+        prefetcher = flipbook.prefetcher
+        if self._starved_policy == 'wait' and prefetcher.is_reading(page):
+            if self._wait_start is None:
+                self._wait_start, self._wait_frame = now, frame
+                self.stalls += 1
+            # resumed by _on_page_read
+            return
+        if self._starved_policy == 'drop' and isinstance(page, LazyImageList) and not page.loaded:
+            # Rather than reading the page now, read ahead of playback every step-th page, where step is
+            # the number of frames that pass while a page is read, so that reading keeps pace with playback.
+            # Pages are chosen from a fixed grid of frames, so that they stay in the prefetcher's window.
+            read_frames = 0 if prefetcher.read_time is None else self._fps * prefetcher.read_time
+            step = max(1, math.ceil(read_frames))
+            target = (frame // step + 1) * step
+            prefetcher.update((self._start_idx + target) % page_count, step)
+            self.dropped_frames += frame - self._frame
+            self._frame = frame
+            self._schedule()
+            return
+        if self._wait_start is not None:
+            # resume at the same rate, from the frame waited for
+            waited = now - self._wait_start
+            self.stall_time += waited
+            self._start_time += waited
+            self._wait_start = None
+        self.dropped_frames += frame - self._frame - 1
+        self._frame = frame
+        flipbook.current_page_idx = idx
+        self._shown_idx = flipbook.current_page_idx
+        now = time.perf_counter()
+        self._show_times.append(now)
+        if now - self._last_report >= 0.5:
+            self._last_report = now
+            self.stats_changed.emit(self)
+        self._schedule()
+
+def _stack_batches(pages, idx):
+    # yield lists of the (data, image_bits) of the images at position idx of pages, in batches such that the
+    # images read from lazy pages that are not loaded (which are held only for the batch) fit in the page budget
+    batch = []
+    batch_bytes = 0
+    for page in pages:
+        if isinstance(page, LazyImageList) and not page.loaded:
+            if idx >= len(page.image_paths):
+                continue
+            data = _read_image(pathlib.Path(page.image_paths[idx]))
+            batch.append((data, None))
+            batch_bytes += data.nbytes
+        elif len(page) > idx:
+            batch.append((page[idx].data, page[idx].image_bits))
+        if batch and batch_bytes >= page_cache.budget:
+            yield batch
+            batch = []
+            batch_bytes = 0
+    if batch:
+        yield batch
+
+def _stack_statistics(pages, idx, mask_geometry, range=(None, None)):
+    # histogram.histogram_stack of the images at position idx of pages (of the first image's dtype), batch by batch
+    dtype = image_bits = None
+    batch_stats = []
+    for batch in _stack_batches(pages, idx):
+        if dtype is None:
+            dtype, image_bits = batch[0][0].dtype, batch[0][1]
+        arrays = [data for data, bits in batch if data.dtype == dtype]
+        if arrays:
+            batch_stats.append(histogram.histogram_stack(arrays, range, image_bits=image_bits, mask_geometry=mask_geometry))
+    if len(batch_stats) == 0:
+        return None
+    if len(batch_stats) == 1:
+        return batch_stats[0]
+    mins = numpy.concatenate([stats.mins for stats in batch_stats])
+    maxs = numpy.concatenate([stats.maxs for stats in batch_stats])
+    if dtype.type not in histogram.FIXED_RANGE_DTYPES and None in range:
+        # each batch was binned over its own range: bin them all over the range of the whole stack instead
+        r_min, r_max = range
+        if r_min is None:
+            r_min = numpy.nanmin(mins)
+        if r_max is None:
+            r_max = numpy.nanmax(maxs)
+        if not numpy.isnan([r_min, r_max]).any():
+            return _stack_statistics(pages, idx, mask_geometry, (r_min, r_max))
+    histograms = numpy.concatenate([stats.histograms for stats in batch_stats])
+    return histogram.HistogramStackStatistics(mins, maxs, histograms, numpy.nanmin(mins), numpy.nanmax(maxs),
+        histograms.sum(axis=0, dtype=numpy.uint32), numpy.concatenate([stats.nan_counts for stats in batch_stats]),
+        numpy.concatenate([stats.inf_counts for stats in batch_stats]))
+
+def _prefetch_page(page):
+    t0 = time.perf_counter()
+    arrays = page.read()
+    for array in arrays:
+        base = array
+        while base is not None and not isinstance(base, (numpy.memmap, mmap.mmap)):
+            base = getattr(base, 'base', None)
+        if base is not None:
+            # touch every page of memory-mapped data, so that it is read from disk now
+            array.max()
+    return arrays, time.perf_counter() - t0
+
 class PageList(uniform_signaling_list.UniformSignalingList):
     def take_input_element(self, obj):
         if isinstance(obj, ImageList):
@@ -74,6 +506,23 @@ class _ReadPageTaskDoneEvent(Qt.QEvent):
 class _ReadPageTaskPage:
     __slots__ = ["page", "im_fpaths", "im_names", "ims"]
 
+def _is_loading(image_list):
+    # pages are empty while their images are read, except for lazy pages, which are empty until shown
+    return len(image_list) == 0 and not isinstance(image_list, LazyImageList)
+
+def _is_mappable(path):
+    return path.suffix.lower() in mmap_io.SUFFIXES
+
+def _read_image(path):
+    # map uncompressed files into memory rather than reading them, falling back to freeimage for the rest
+    if _is_mappable(path):
+        try:
+            return mmap_io.read(path)
+        except mmap_io.NotMappableError:
+            if freeimage is None:
+                raise
+    return freeimage.read(str(path))
+
 _FLIPBOOK_PAGES_DOCSTRING = ("""
     The list of pages represented by a Flipbook instance's list view is available via a that
     Flipbook instance's .pages property.
@@ -111,6 +560,7 @@ class Flipbook(Qt.QWidget):
         self.pages_model = PagesModel(property_names=self.DISPLAY_PROPERTIES,
             signaling_list=pages, parent=self.pages_view)
         pages.replaced.connect(self._on_pages_replaced)
+        pages.removed.connect(self._on_pages_removed)
         self.pages_model.handle_dropped_files = self._handle_dropped_files
         self.pages_model.rowsInserted.connect(self._on_model_change)
         self.pages_model.rowsRemoved.connect(self._on_model_change)
@@ -138,6 +588,12 @@ class Flipbook(Qt.QWidget):
         Qt.QShortcut(Qt.Qt.Key_Delete, self, self.delete_button.click, context=Qt.Qt.WidgetWithChildrenShortcut)
         Qt.QShortcut(Qt.Qt.Key_Backspace, self, self.delete_button.click, context=Qt.Qt.WidgetWithChildrenShortcut)
         mergebox.addWidget(self.delete_button)
+        self.apply_stack_range_action = Qt.QAction('Stack min/max', self)
+        self.apply_stack_range_action.setToolTip('Set the min and max of each layer to the range of its images across all pages')
+        self.apply_stack_range_action.triggered.connect(lambda: self.apply_stack_range())
+        stack_range_button = Qt.QToolButton()
+        stack_range_button.setDefaultAction(self.apply_stack_range_action)
+        mergebox.addWidget(stack_range_button)
         layout.addLayout(mergebox)
 
         playbox = Qt.QHBoxLayout()
@@ -149,17 +605,20 @@ class Flipbook(Qt.QWidget):
         playbox.addSpacerItem(Qt.QSpacerItem(0, 0, Qt.QSizePolicy.Expanding, Qt.QSizePolicy.Minimum))
         playbox.addWidget(self.play_button)
         self.fps_editor = Qt.QLineEdit()
-        self.fps_editor.setValidator(Qt.QIntValidator(1, 99, parent=self))
+        self.fps_editor.setValidator(Qt.QIntValidator(1, 9999, parent=self))
         self.fps_editor.editingFinished.connect(self._on_fps_editing_finished)
-        self.fps_editor.setFixedWidth(30)
+        self.fps_editor.setFixedWidth(45)
         self.fps_editor.setAlignment(Qt.Qt.AlignCenter)
 
         playbox.addWidget(self.fps_editor)
         playbox.addWidget(Qt.QLabel('FPS'))
+        self.playback_stats_label = Qt.QLabel()
+        playbox.addWidget(self.playback_stats_label)
         playbox.addSpacerItem(Qt.QSpacerItem(0, 0, Qt.QSizePolicy.Expanding, Qt.QSizePolicy.Minimum))
         layout.addLayout(playbox)
-        self.playback_timer = Qt.QTimer()
-        self.playback_timer.timeout.connect(self.advance_frame)
+        self.prefetcher = PagePrefetcher(self)
+        self.playback_scheduler = PlaybackScheduler(self)
+        self.playback_scheduler.stats_changed.connect(self._on_playback_stats_changed)
         self.playback_fps = 30
 
         self._on_page_selection_changed()
@@ -175,21 +634,60 @@ class Flipbook(Qt.QWidget):
             self._detach_page()
             return
         pages = self.pages
+        if current_page_idx >= len(pages):
+            # the current row is being removed
+            self._detach_page()
+            return
         current_page = pages[current_page_idx]
+        if isinstance(current_page, LazyImageList):
+            # read the page's images now, if not prefetched (before attaching, as loading fills the page)
+            if current_page is self._attached_page:
+                # re-applied as its contents changed: not a page shown, as far as the prefetcher's counts go
+                current_page.load()
+            else:
+                self.prefetcher.load(current_page)
         if current_page is not self._attached_page:
             self._detach_page()
             current_page.inserted.connect(self.apply)
             current_page.removed.connect(self.apply)
             current_page.replaced.connect(self.apply)
+            if isinstance(current_page, LazyImageList):
+                current_page.shown = True
             self._attached_page = current_page
         self.layer_stack.layers = current_page # setter magic takes care of rest
+        self.prefetcher.update(current_page_idx)
         self.current_page_changed.emit(self)
 
+    def apply_stack_range(self, pages=None):
+        """For each layer of .layer_stack, histogram the images at that layer's position in every page
+        (or in each of the given pages) with histogram.histogram_stack, and set the layer's min and max
+        to the min and max of all of those images, so that every page is displayed with the same range.
+        auto_min_max is turned off for the affected layers. Returns the list of HistogramStackStatistics
+        (or None, for layers with no images of the same dtype as the first page's) for each layer.
+
+        Lazy pages that are not loaded are not loaded for this: only the image needed is read from each,
+        and the images read are histogrammed in batches that fit within page_cache.budget (float images
+        being read twice if there are several batches, first to find the range to bin them over)."""
+        if pages is None:
+            pages = self.pages
+        results = []
+        for idx, layer in enumerate(self.layer_stack.layers):
+            stats = _stack_statistics(pages, idx, layer.histogram_mask)
+            results.append(stats)
+            if stats is None or numpy.isnan(stats.min):
+                continue
+            layer.auto_min_max = False
+            layer.min = stats.min
+            layer.max = stats.max
+        return results
+
     def _detach_page(self):
         if self._attached_page is not None:
             self._attached_page.inserted.disconnect(self.apply)
             self._attached_page.removed.disconnect(self.apply)
             self._attached_page.replaced.disconnect(self.apply)
+            if isinstance(self._attached_page, LazyImageList):
+                self._attached_page.shown = False
             self._attached_page = None
 
     @staticmethod
@@ -204,7 +702,7 @@ class Flipbook(Qt.QWidget):
         else:
             return list(path)
 
-    def add_image_files(self, image_paths, page_names=None, image_names=None, insertion_point=None):
+    def add_image_files(self, image_paths, page_names=None, image_names=None, insertion_point=None, lazy=False):
         """Add image files (or stacks of image files) to the flipbook.
 
         Parameters:
@@ -223,15 +721,22 @@ class Flipbook(Qt.QWidget):
             insertion_point: numerical index before which to insert the images
                 in the flipbook (negative values permitted). If not specified,
                 images will be inserted after the last entry.
+            lazy: If True, add LazyImageList pages, which read their images
+                only when shown, and keep them only while page_cache.budget
+                allows, rather than reading every image now.
 
-        Returns list of futures objects corresponding to the page-IO tasks.
-        To wait until read is done, call concurrent.futures.wait() on this list.
+        .npy files and uncompressed TIFFs are memory-mapped rather than read (see mmap_io), so that
+        their pixels are read from disk only when shown, and are not held in memory otherwise.
+
+        Returns list of futures objects corresponding to the page-IO tasks
+        (empty if lazy is True). To wait until read is done, call
+        concurrent.futures.wait() on this list.
         """
-        if freeimage is None:
-            raise RuntimeError('Could not import freeimage module for image IO')
         paths = []
         for page_paths in self._expand_to_path_list(image_paths):
             paths.append(list(map(pathlib.Path, self._expand_to_path_list(page_paths))))
+        if freeimage is None and not all(_is_mappable(path) for subpaths in paths for path in subpaths):
+            raise RuntimeError('Could not import freeimage module for image IO')
 
         if len(paths) == 0:
             return []
@@ -251,6 +756,18 @@ class Flipbook(Qt.QWidget):
         if image_names is None:
             image_names = [[str(p) for p in subpaths] for subpaths in paths]
 
+        if insertion_point is None:
+            insertion_point = len(self.pages)
+        if lazy:
+            new_pages = []
+            for file_paths, page_name, page_image_names in zip(paths, page_names, image_names):
+                page = LazyImageList(file_paths, page_image_names)
+                page.name = page_name
+                new_pages.append(page)
+            self.pages[insertion_point:insertion_point] = new_pages
+            self.ensure_page_focused()
+            return []
+
         task_pages = []
         for file_paths, page_name, page_image_names in zip(paths, page_names, image_names):
             task_page = _ReadPageTaskPage()
@@ -261,13 +778,11 @@ class Flipbook(Qt.QWidget):
             assert len(task_page.im_names) == len(task_page.im_fpaths)
             task_pages.append(task_page)
 
-        if insertion_point is None:
-            insertion_point = len(self.pages)
         return self.queue_page_creation_tasks(insertion_point, task_pages)
 
 
     def _handle_dropped_files(self, fpaths, dst_row, dst_column, dst_parent):
-        if freeimage is None:
+        if freeimage is None and not all(_is_mappable(pathlib.Path(fpath)) for fpath in fpaths):
             return False
         if dst_row in (-1, None):
             dst_row = len(self.pages)
@@ -292,15 +807,19 @@ class Flipbook(Qt.QWidget):
         return super().event(e)
 
     def _read_page_task(self, task_page):
-        task_page.ims = [freeimage.read(str(image_fpath)) for image_fpath in task_page.im_fpaths]
+        task_page.ims = [_read_image(image_fpath) for image_fpath in task_page.im_fpaths]
         Qt.QApplication.instance().postEvent(self, _ReadPageTaskDoneEvent(task_page))
 
     def _on_task_error(self, task_page):
         Qt.QApplication.instance().postEvent(self, _ReadPageTaskDoneEvent(task_page, error=True))
 
-    def queue_page_creation_tasks(self, insertion_point, task_pages):
+    def _get_thread_pool(self):
         if not hasattr(self, 'thread_pool'):
             self.thread_pool = progress_thread_pool.ProgressThreadPool(self.cancel_page_creation_tasks, self.layout)
+        return self.thread_pool
+
+    def queue_page_creation_tasks(self, insertion_point, task_pages):
+        self._get_thread_pool()
         new_pages = []
         page_futures = []
         for task_page in task_pages:
@@ -316,7 +835,7 @@ class Flipbook(Qt.QWidget):
 
     def cancel_page_creation_tasks(self):
         for i, image_list in reversed(list(enumerate(self.pages))):
-            if len(image_list) == 0:
+            if len(image_list) == 0 and not isinstance(image_list, LazyImageList):
                 # page removal calls the on_removal function, which as above is the future's cancel()
                 self.pages_model.removeRows(i, 1)
 
@@ -357,7 +876,19 @@ class Flipbook(Qt.QWidget):
             return
         target_row = mergeable_rows.pop(0)
         target_page = self.pages[target_row]
-        to_add = [self.pages[row] for row in mergeable_rows]
+        if isinstance(target_page, LazyImageList):
+            # a lazy page would drop the merged images when unloaded, so it is replaced with an ordinary page
+            target_page.load()
+            merged_page = ImageList(target_page)
+            merged_page.name = target_page.name
+            self.pages[target_row] = target_page = merged_page
+        to_add = []
+        for row in mergeable_rows:
+            image_list = self.pages[row]
+            if isinstance(image_list, LazyImageList):
+                image_list.load()
+            # (a copy, as deleting a lazy page below unloads it)
+            to_add.append(list(image_list))
         midx = self.pages_model.createIndex(target_row, 0)
         self.pages_view.selectionModel().select(midx, Qt.QItemSelectionModel.Deselect)
         self.delete_selected()
@@ -375,6 +906,20 @@ class Flipbook(Qt.QWidget):
     def _on_pages_replaced(self, idxs, replaced_pages, pages):
         if self.current_page_idx in idxs:
             self.apply()
+        self._unload_removed_pages(replaced_pages)
+
+    def _on_pages_removed(self, idxs, pages):
+        self._unload_removed_pages(pages)
+
+    def _unload_removed_pages(self, pages):
+        # free the images of lazy pages no longer in the flipbook (unless they were only moved within it)
+        remaining = set(map(id, self.pages))
+        for page in pages:
+            if isinstance(page, LazyImageList) and id(page) not in remaining:
+                if page is self._attached_page:
+                    # lest unloading (which empties the page) make apply() read it back in
+                    self._detach_page()
+                page.unload()
 
     def focus_prev_page(self):
         """Advance to the previous page, if there is one."""
@@ -482,13 +1027,12 @@ class Flipbook(Qt.QWidget):
 
     @property
     def playback_fps(self):
-        return 1000/self.playback_timer.interval()
+        return self.playback_scheduler.fps
 
     @playback_fps.setter
     def playback_fps(self, v):
         self.fps_editor.setText(str(v))
-        interval_ms = (1/v)*1000
-        self.playback_timer.setInterval(interval_ms)
+        self.playback_scheduler.fps = v
 
     def _on_fps_editing_finished(self):
         self.playback_fps = int(self.fps_editor.text())
@@ -503,9 +1047,16 @@ class Flipbook(Qt.QWidget):
 
     def _on_play_button_toggled(self, v):
         if v:
-            self.playback_timer.start()
+            self.playback_scheduler.start()
+        else:
+            self.playback_scheduler.stop()
+
+    def _on_playback_stats_changed(self, scheduler):
+        achieved_fps = scheduler.achieved_fps
+        if achieved_fps is None:
+            self.playback_stats_label.setText('')
         else:
-            self.playback_timer.stop()
+            self.playback_stats_label.setText('({:.1f} FPS, {} dropped)'.format(achieved_fps, scheduler.dropped_frames))
 
     def advance_frame(self):
         page_count = len(self.pages)
@@ -539,7 +1090,7 @@ class PagesModel(drag_drop_model_behavior.DragDropModelBehavior, property_table_
     def flags(self, midx):
         if midx.isValid() and midx.column() == 0:
             image_list = self.signaling_list[midx.row()]
-            if len(image_list) == 0:
+            if _is_loading(image_list):
                 return super().flags(midx) & ~Qt.Qt.ItemIsEditable
         return super().flags(midx)
 
@@ -548,7 +1099,7 @@ class PagesModel(drag_drop_model_behavior.DragDropModelBehavior, property_table_
             image_list = self.signaling_list[midx.row()]
             if image_list is None:
                 return Qt.QVariant()
-            if role == Qt.Qt.ForegroundRole and len(image_list) == 0:
+            if role == Qt.Qt.ForegroundRole and _is_loading(image_list):
                 return Qt.QApplication.palette().brush(Qt.QPalette.Disabled, Qt.QPalette.WindowText)
             elif role == Qt.Qt.BackgroundRole and image_list.color is not None:
                 return Qt.QBrush(image_list.color)
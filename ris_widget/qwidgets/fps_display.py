@@ -1,5 +1,6 @@
 # This code is licensed under the MIT License (see LICENSE file for details)
 
+import collections
 import numpy
 from PyQt5 import Qt
 import time
@@ -7,8 +8,10 @@ import time
 class FPSDisplay(Qt.QWidget):
     """A widget displaying interval since last .notify call and 1 / the interval since last .notify call.
     FPSDisplay collects data and refreshes only when visible, reducing the cost of having it constructed
-    and hidden with a signal attached to .notify."""
-    def __init__(self, changed_signal, parent=None):
+    and hidden with a signal attached to .notify.
+    If histogram_signal is supplied, the rate at which it is emitted is also displayed, showing how many of the
+    displayed frames are being histogrammed when histograms are calculated asynchronously."""
+    def __init__(self, changed_signal, parent=None, histogram_signal=None):
         super().__init__(parent)
         l = Qt.QFormLayout()
         self.setLayout(l)
@@ -38,6 +41,14 @@ class FPSDisplay(Qt.QWidget):
         fps_box.addWidget(self.interval_field, alignment=Qt.Qt.AlignRight)
         fps_box.addWidget(self.interval_suffix, alignment=Qt.Qt.AlignLeft)
 
+        self.histogram_times = collections.deque()
+        self.histogram_rate_field = None
+        if histogram_signal is not None:
+            self.histogram_rate_field = Qt.QLabel()
+            self.histogram_rate_field.setFont(Qt.QFont('Courier'))
+            l.addRow('Histograms/s:', self.histogram_rate_field)
+            histogram_signal.connect(self.notify_histogram)
+
         self.sample_count = 60
         changed_signal.connect(self.notify)
 
@@ -70,11 +81,31 @@ class FPSDisplay(Qt.QWidget):
             self.prev_t = t
             self._refresh()
 
+    def notify_histogram(self):
+        if not self.isVisible():
+            return
+        self.histogram_times.append(time.time())
+        while len(self.histogram_times) > self._sample_count:
+            self.histogram_times.popleft()
+        self._refresh_histogram_rate()
+
+    def _refresh_histogram_rate(self):
+        if self.histogram_rate_field is None:
+            return
+        elapsed = self.histogram_times[-1] - self.histogram_times[0] if self.histogram_times else 0
+        if elapsed == 0:
+            self.histogram_rate_field.setText('')
+        else:
+            rate = (len(self.histogram_times) - 1) / elapsed
+            self.histogram_rate_field.setText('{:.1f}'.format(round(rate, 1)))
+
     def clear(self):
         self.acquired_sample_count = 0
         self.prev_t = None
+        self.histogram_times.clear()
         if self.isVisible():
             self._refresh()
+            self._refresh_histogram_rate()
 
     def _refresh(self):
         if self.acquired_sample_count < 2:
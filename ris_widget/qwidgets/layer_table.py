@@ -207,6 +207,7 @@ class LayerTableModel(LayerTableDragDropBehavior, property_table_model.PropertyT
         'visible',
         'blend_function',
         'auto_min_max',
+        'auto_min_max_percentiles',
         'tint',
         'opacity',
         # 'getcolor_expression',
@@ -235,6 +236,7 @@ class LayerTableModel(LayerTableDragDropBehavior, property_table_model.PropertyT
         self._special_data_getters = {
             'visible': self._getd_visible,
             'auto_min_max': self._getd_auto_min_max,
+            'auto_min_max_percentiles': self._getd_auto_min_max_percentiles,
             'tint': self._getd_tint,
             'blend_function': self._getd_blend_function,
             'getcolor_expression': self._getd_defaultable_property,
@@ -324,6 +326,11 @@ class LayerTableModel(LayerTableDragDropBehavior, property_table_model.PropertyT
                 r = Qt.Qt.Unchecked
             return Qt.QVariant(r)
 
+    def _getd_auto_min_max_percentiles(self, midx, role):
+        if role in (Qt.Qt.DisplayRole, Qt.Qt.EditRole):
+            return Qt.QVariant('{:g}, {:g}'.format(*self.get_cell(midx)))
+        return self._getd_defaultable_property(midx, role)
+
     def _getd_tint(self, midx, role):
         if role == Qt.Qt.DecorationRole:
             return Qt.QVariant(Qt.QColor(*(int(c*255) for c in self.signaling_list[midx.row()].tint)))
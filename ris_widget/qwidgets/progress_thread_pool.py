@@ -20,7 +20,7 @@ class UpdateEvent(Qt.QEvent):
 class ProgressThreadPool(Qt.QWidget):
     def __init__(self, cancel_jobs, attached_layout, parent=None):
         super().__init__(parent)
-        self.thread_pool = futures.ThreadPoolExecutor(max_workers=multiprocessing.cpu_count()-1)
+        self.thread_pool = futures.ThreadPoolExecutor(max_workers=max(multiprocessing.cpu_count()-1, 1))
         self.task_count_lock = threading.Lock()
         self._queued_tasks = 0
         self._retired_tasks = 0
@@ -52,7 +52,12 @@ class ProgressThreadPool(Qt.QWidget):
             del future.on_error
             del future.on_error_args
 
-    def submit(self, task, *args, on_error=None, on_error_args=[], **kws):
+    def submit(self, task, *args, on_error=None, on_error_args=[], show_progress=True, **kws):
+        """Run task(*args, **kws) on the pool, returning its future. If show_progress is False, the task
+        is not counted in the progress bar (e.g. for background work the user did not ask for), and
+        errors are left to the caller to retrieve from the future."""
+        if not show_progress:
+            return self.thread_pool.submit(task, *args, **kws)
         self.increment_queued()
         future = self.thread_pool.submit(task, *args, **kws)
         future.on_error = on_error